@@ -0,0 +1,304 @@
+
+"""Load-testing suite behind `queuectl bench`.
+
+Every scenario runs against a fresh database in a scratch directory, with
+real worker processes where it needs them, and returns one flat dict of
+numbers. `run` gathers them with the parameters and host details into a
+JSON document that can be saved and later `compare`d with another run.
+
+Scenarios:
+  enqueue  one-job-per-transaction and bulk enqueue rates
+  claim    drain rate and latency of `jobs` jobs enqueued against N idle
+           workers, once per N in `workers` (claim contention)
+  retry    a retry storm: every job fails, all retry at the same moment
+           (backoff_base 1, no jitter) until they land in the DLQ
+  large    status, list and DLQ page timings on a `large_rows`-row table
+
+Job types come from `generate`: noop (`date`), python (a pool call),
+cpu (a pool call burning `cpu_ms` of CPU) and output (`output_bytes` of
+stdout). Each prints its start time as the first line of stdout, so
+enqueue-to-start latency is measured from the job's side. End-to-end runs
+from the enqueue call until the result is visible to a reader, sampled
+every OBSERVE_INTERVAL_S from job_logs (appended in the commit that
+finishes the job). Inputs are seeded so two runs do the same work.
+"""
+from __future__ import annotations
+import json, os, platform, random, signal, sqlite3, statistics, subprocess, sys, tempfile, threading, time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from . import repo
+from .config import set_config
+from .db import connect, write_txn
+from .notify import wake_dir
+from .utils import utc_now, to_iso
+
+SCENARIOS = ("enqueue", "claim", "retry", "large")
+JOB_TYPES = ("noop", "python", "cpu", "output")
+FORMAT_VERSION = 1
+OBSERVE_INTERVAL_S = 0.005
+STARTUP_TIMEOUT_S = 15.0
+DRAIN_TIMEOUT_S = 300.0
+
+def stamp() -> None:
+    """python job: report the start time."""
+    print(f"{time.time():.6f}")
+
+def burn(ms: float) -> None:
+    """cpu job: report the start time, then spin for ms of CPU time."""
+    stamp()
+    end = time.process_time() + ms / 1000.0
+    while time.process_time() < end:
+        pass
+
+def generate(job_type: str, n: int, prefix: str = "bench", seed: int = 0, cpu_ms: float = 5.0,
+             output_bytes: int = 1 << 20, **fields: Any) -> Iterator[Dict[str, Any]]:
+    """n synthetic jobs of job_type, ids `<prefix>-<i>`, priorities 0-4
+    drawn from `seed`. Extra fields are copied into every job."""
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"job type must be one of {', '.join(JOB_TYPES)}")
+    rng = random.Random(seed)
+    for i in range(n):
+        if job_type == "noop":
+            job = {"command": "date +%s.%N"}
+        elif job_type == "python":
+            job = {"kind": "python", "callable": "queuectl.bench:stamp"}
+        elif job_type == "cpu":
+            job = {"kind": "python", "callable": "queuectl.bench:burn", "args": [cpu_ms]}
+        else:
+            job = {"command": f"date +%s.%N; head -c {output_bytes} /dev/zero | tr '\\0' x"}
+        yield {"id": f"{prefix}-{i}", "priority": rng.randrange(5), **job, **fields}
+
+def _quantiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p99": None}
+    s = sorted(samples)
+    return {"p50": round(statistics.median(s) * 1000, 2), "p99": round(s[max(0, -(-len(s) * 99 // 100) - 1)] * 1000, 2)}
+
+def db_bytes(conn: sqlite3.Connection) -> int:
+    """Database plus WAL on disk."""
+    return sum(os.path.getsize(p) for p in (conn.path, conn.path + "-wal") if os.path.exists(p))
+
+def _start_workers(db: str, n: int, concurrency: int) -> List[subprocess.Popen]:
+    procs = [subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", db,
+                               "--concurrency", str(concurrency)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(n)]
+    # Every worker binds a wakeup socket once it is ready to claim.
+    d = wake_dir(str(Path(db).resolve()))
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while time.monotonic() < deadline:
+        try:
+            if len(os.listdir(d)) >= n:
+                break
+        except FileNotFoundError:
+            pass
+        time.sleep(0.02)
+    return procs
+
+def _stop_workers(procs: List[subprocess.Popen]) -> None:
+    for p in procs:
+        p.send_signal(signal.SIGTERM)
+    for p in procs:
+        try:
+            p.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.wait()
+
+class _Observer(threading.Thread):
+    """Records when each job's result first becomes visible."""
+
+    def __init__(self, db: str, expected: int):
+        super().__init__(name="bench-observer", daemon=True)
+        self.db, self.expected = db, expected
+        self.seen: Dict[str, float] = {}
+        self.done = threading.Event()
+
+    def run(self) -> None:
+        conn = connect(self.db)
+        last = 0
+        deadline = time.monotonic() + DRAIN_TIMEOUT_S
+        while len(self.seen) < self.expected and time.monotonic() < deadline:
+            rows = conn.execute("SELECT id, job_id FROM job_logs WHERE id > ? ORDER BY id", (last,)).fetchall()
+            now = time.time()
+            for log_id, job_id in rows:
+                self.seen.setdefault(job_id, now)
+                last = log_id
+            time.sleep(OBSERVE_INTERVAL_S)
+        conn.close()
+        self.done.set()
+
+def _started(conn: sqlite3.Connection, job_id: str) -> Optional[float]:
+    logs = repo.get_logs(conn, job_id, 1)
+    try:
+        return float(logs[0]["stdout"].split("\n", 1)[0])
+    except (IndexError, ValueError):
+        return None
+
+def bench_enqueue(workdir: Path, jobs: int, job_type: str, seed: int, **opts) -> List[Dict[str, Any]]:
+    conn = connect(str(workdir / "enqueue.db"))
+    t0 = time.perf_counter()
+    for job in generate(job_type, jobs, "single", seed, **opts):
+        repo.enqueue(conn, job)
+    single = time.perf_counter() - t0
+    bulk_n = jobs * 20
+    t0 = time.perf_counter()
+    repo.enqueue_many(conn, generate(job_type, bulk_n, "bulk", seed, **opts))
+    bulk = time.perf_counter() - t0
+    return [{"scenario": "enqueue", "variant": "single", "jobs": jobs, "jobs_per_s": round(jobs / single, 1)},
+            {"scenario": "enqueue", "variant": "bulk", "jobs": bulk_n, "jobs_per_s": round(bulk_n / bulk, 1),
+             "db_bytes": db_bytes(conn)}]
+
+def bench_claim(workdir: Path, jobs: int, job_type: str, seed: int, workers: int, concurrency: int = 1,
+                rate: float = 0.0, **opts) -> Dict[str, Any]:
+    """`jobs` jobs enqueued one per transaction (at `rate` per second, or
+    as fast as possible with 0) against `workers` idle workers."""
+    db = str(workdir / f"claim-{workers}.db")
+    conn = connect(db)
+    procs = _start_workers(db, workers, concurrency)
+    observer = _Observer(db, jobs)
+    observer.start()
+    enqueued: Dict[str, float] = {}
+    try:
+        t_start = time.time()
+        for i, job in enumerate(generate(job_type, jobs, "claim", seed, **opts)):
+            if rate > 0:
+                time.sleep(max(0.0, t_start + i / rate - time.time()))
+            enqueued[job["id"]] = time.time()
+            repo.enqueue(conn, job)
+        observer.done.wait(DRAIN_TIMEOUT_S)
+    finally:
+        _stop_workers(procs)
+    seen = observer.seen
+    started = {j: _started(conn, j) for j in seen}
+    elapsed = (max(seen.values()) - t_start) if seen else None
+    start_q = _quantiles([s - enqueued[j] for j, s in started.items() if s is not None])
+    e2e_q = _quantiles([t - enqueued[j] for j, t in seen.items()])
+    return {"scenario": "claim", "variant": f"{workers}w", "workers": workers, "concurrency": concurrency,
+            "jobs": jobs, "completed": repo.status(conn)["states"]["completed"],
+            "jobs_per_s": round(len(seen) / elapsed, 1) if elapsed else None,
+            "start_p50_ms": start_q["p50"], "start_p99_ms": start_q["p99"],
+            "e2e_p50_ms": e2e_q["p50"], "e2e_p99_ms": e2e_q["p99"], "db_bytes": db_bytes(conn)}
+
+def bench_retry(workdir: Path, jobs: int, workers: int, retries: int = 2, concurrency: int = 1, **_) -> Dict[str, Any]:
+    db = str(workdir / "retry.db")
+    conn = connect(db)
+    for key, value in (("backoff_base", "1"), ("backoff_jitter", "0")):
+        set_config(conn, key, value)
+    procs = _start_workers(db, workers, concurrency)
+    try:
+        t0 = time.perf_counter()
+        repo.enqueue_many(conn, ({"id": f"retry-{i}", "command": "exit 1", "max_retries": retries}
+                                 for i in range(jobs)))
+        deadline = time.monotonic() + DRAIN_TIMEOUT_S
+        while repo.status(conn)["states"]["dead"] < jobs and time.monotonic() < deadline:
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - t0
+    finally:
+        _stop_workers(procs)
+    runs = conn.execute("SELECT COUNT(*) FROM job_logs").fetchone()[0]
+    return {"scenario": "retry", "variant": f"{workers}w", "workers": workers, "jobs": jobs, "retries": retries,
+            "dead": repo.status(conn)["states"]["dead"], "executions": runs,
+            "jobs_per_s": round(runs / elapsed, 1), "drain_s": round(elapsed, 2), "db_bytes": db_bytes(conn)}
+
+def _populate(conn: sqlite3.Connection, n: int) -> None:
+    # 90% completed history, 5% dead, 5% pending, like a long-lived queue.
+    now = to_iso(utc_now())
+    def rows():
+        for i in range(n):
+            state = ("pending", "dead")[i // 10 % 2] if i % 10 == 0 else "completed"
+            created = f"2024-01-{1 + i % 28:02d}T00:{i % 60:02d}:{(i // 60) % 60:02d}Z"
+            yield (f"job-{i:09d}", "true", state, 0, 3, created, created if state != "pending" else now, created, i % 5)
+    with write_txn(conn):
+        conn.executemany("""
+            INSERT INTO jobs(id, command, state, attempts, max_retries, created_at, updated_at, run_at, priority)
+            VALUES(?,?,?,?,?,?,?,?,?)
+        """, rows())
+    conn.execute("ANALYZE;")
+
+def _time_ms(fn, repeat: int = 5) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return round(statistics.median(samples) * 1000, 3)
+
+def bench_large(workdir: Path, large_rows: int, **_) -> Dict[str, Any]:
+    conn = connect(str(workdir / "large.db"))
+    t0 = time.perf_counter()
+    _populate(conn, large_rows)
+    load_s = time.perf_counter() - t0
+    middle = repo.job_cursor({"created_at": "2024-01-15T00:00:00Z", "id": ""})
+    return {"scenario": "large", "variant": f"{large_rows} rows", "rows": large_rows, "load_s": round(load_s, 2),
+            "status_ms": _time_ms(lambda: repo.status(conn)),
+            "list_first_ms": _time_ms(lambda: repo.list_jobs(conn, None, 50)),
+            "list_middle_ms": _time_ms(lambda: repo.list_jobs(conn, None, 50, after=middle)),
+            "list_pending_ms": _time_ms(lambda: repo.list_jobs(conn, "pending", 50)),
+            "dlq_first_ms": _time_ms(lambda: repo.dlq_list(conn, 50)),
+            "db_bytes": db_bytes(conn)}
+
+def _host() -> Dict[str, Any]:
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "sqlite": sqlite3.sqlite_version}
+
+def run(scenarios: Sequence[str], jobs: int = 500, workers: Sequence[int] = (1, 4), concurrency: int = 1,
+        job_type: str = "noop", rate: float = 0.0, retries: int = 2, large_rows: int = 100000,
+        seed: int = 0, cpu_ms: float = 5.0, output_bytes: int = 1 << 20,
+        progress=None) -> Dict[str, Any]:
+    """Run the named scenarios in order and return the result document.
+    progress, if given, is called with each result as it is produced."""
+    bad = [s for s in scenarios if s not in SCENARIOS]
+    if bad:
+        raise ValueError(f"unknown scenario {bad[0]!r}; choose from {', '.join(SCENARIOS)}")
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"job type must be one of {', '.join(JOB_TYPES)}")
+    params = {"scenarios": list(scenarios), "jobs": jobs, "workers": list(workers), "concurrency": concurrency,
+              "job_type": job_type, "rate": rate, "retries": retries, "large_rows": large_rows, "seed": seed,
+              "cpu_ms": cpu_ms, "output_bytes": output_bytes}
+    doc = {"format": FORMAT_VERSION, "created_at": to_iso(utc_now()), "host": _host(), "params": params,
+           "results": []}
+    opts = {"cpu_ms": cpu_ms, "output_bytes": output_bytes}
+    def add(result):
+        doc["results"].append(result)
+        if progress:
+            progress(result)
+    with tempfile.TemporaryDirectory(prefix="queuectl-bench-") as d:
+        for scenario in scenarios:
+            if scenario == "enqueue":
+                for r in bench_enqueue(Path(d), jobs, job_type, seed, **opts):
+                    add(r)
+            elif scenario == "claim":
+                for n in workers:
+                    add(bench_claim(Path(d), jobs, job_type, seed, n, concurrency, rate, **opts))
+            elif scenario == "retry":
+                add(bench_retry(Path(d), jobs, max(workers), retries, concurrency))
+            else:
+                add(bench_large(Path(d), large_rows))
+    return doc
+
+def save(doc: Dict[str, Any], path: str) -> None:
+    Path(path).write_text(json.dumps(doc, indent=2) + "\n")
+
+def load(path: str) -> Dict[str, Any]:
+    doc = json.loads(Path(path).read_text())
+    if doc.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{path}: not a queuectl bench result (format {doc.get('format')!r})")
+    return doc
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One row per metric present in both runs, matched by scenario and
+    variant, with the relative change (after / before - 1)."""
+    old = {(r["scenario"], r["variant"]): r for r in before["results"]}
+    rows = []
+    for r in after["results"]:
+        prev = old.get((r["scenario"], r["variant"]))
+        if prev is None:
+            continue
+        for key, value in r.items():
+            base = prev.get(key)
+            if key in ("scenario", "variant") or not isinstance(value, (int, float)) or not isinstance(base, (int, float)):
+                continue
+            rows.append({"scenario": r["scenario"], "variant": r["variant"], "metric": key, "before": base,
+                         "after": value, "change": (value / base - 1) if base else None})
+    return rows
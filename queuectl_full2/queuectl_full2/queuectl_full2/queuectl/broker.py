@@ -0,0 +1,322 @@
+
+"""Optional broker daemon: one process owns the database's write path.
+
+Without a broker every worker and CLI call competes for SQLite's single
+write lock. `queuectl broker` listens on a Unix stream socket at
+`.queuectl/broker/<db name>.sock` next to the database and runs enqueue,
+claim, ack and lease calls for everyone on its own connection. Requests
+that arrive together are group-committed: the broker opens one write
+transaction, runs each request in its own savepoint (so one failing
+request does not undo the others), commits once and only then answers.
+
+The protocol is length-prefixed frames: a 4-byte big-endian length then a
+JSON object. Requests are `{"op": name, "args": [...]}` with `op` one of
+OPS (the repo function of that name, minus its connection); replies are
+`{"ok": true, "result": ...}` or `{"ok": false, "error": ..., "kind": ...}`.
+
+Callers go through `Store`, which uses the broker when its socket answers
+and the repo functions on a direct connection otherwise, so nothing else
+needs to know whether a broker is running.
+"""
+from __future__ import annotations
+import base64, json, os, selectors, signal, socket, sqlite3, struct, time
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import metrics, repo
+from .db import connect, write_txn
+from .notify import wake
+
+OPS = ("enqueue", "enqueue_many", "enqueue_dag", "acquire_batch", "record_results",
+       "release_jobs", "extend_leases", "next_due_ms")
+_WRITES = ("enqueue", "enqueue_many", "enqueue_dag", "record_results", "release_jobs")
+MAX_FRAME = 64 * 1024 * 1024
+MAX_GROUP = 256
+RECONNECT_S = 5.0
+_HEADER = struct.Struct(">I")
+_MAX_SUN_PATH = 100
+# Reply kind for a group whose COMMIT failed: nothing in it was applied.
+_COMMIT_FAILED = "CommitFailed"
+# Exceptions a reply may carry back to the caller, by class name.
+_ERRORS = {"DuplicateJobError": repo.DuplicateJobError, "ValueError": ValueError,
+           "IntegrityError": sqlite3.IntegrityError, "KeyError": KeyError}
+
+class BrokerUnavailable(ConnectionError):
+    """No broker answered, or it went away mid-call."""
+
+def socket_path(db_path: str) -> Path:
+    p = Path(db_path)
+    return p.parent / ".queuectl" / "broker" / f"{p.name}.sock"
+
+def _frame(obj: Any) -> bytes:
+    data = json.dumps(obj, separators=(",", ":"), default=str).encode()
+    return _HEADER.pack(len(data)) + data
+
+def _encode_results(results) -> list:
+    # Output is raw bytes from exec.run_command; JSON carries it as base64.
+    return [[job, code, base64.b64encode(_as_bytes(out)).decode(), base64.b64encode(_as_bytes(err)).decode()]
+            for job, code, out, err in results]
+
+def _decode_results(results) -> list:
+    return [(job, code, base64.b64decode(out), base64.b64decode(err)) for job, code, out, err in results]
+
+def _as_bytes(s) -> bytes:
+    if isinstance(s, bytes):
+        return s
+    return (s or "").encode("utf-8", "replace")
+
+class BrokerClient:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    @classmethod
+    def connect(cls, db_path: str, timeout: float = 30.0) -> Optional["BrokerClient"]:
+        """A client for the broker serving db_path, or None if none is running."""
+        path = socket_path(db_path)
+        if not hasattr(socket, "AF_UNIX") or not path.exists():
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(path))
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+
+    def call(self, op: str, *args: Any) -> Any:
+        if op == "record_results":
+            args = (_encode_results(args[0]),)
+        try:
+            self.sock.sendall(_frame({"op": op, "args": args}))
+            reply = json.loads(self._read(_HEADER.unpack(self._read(_HEADER.size))[0]))
+        except (OSError, ValueError, struct.error) as e:
+            raise BrokerUnavailable(str(e)) from None
+        if reply["ok"]:
+            return reply["result"]
+        if reply.get("kind") == _COMMIT_FAILED:
+            raise BrokerUnavailable(reply["error"])
+        raise _ERRORS.get(reply.get("kind"), RuntimeError)(reply["error"])
+
+    def _read(self, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionResetError("broker closed the connection")
+            buf += chunk
+        return bytes(buf)
+
+    def close(self) -> None:
+        self.sock.close()
+
+class Store:
+    """The job-flow functions of repo (OPS), sent to the broker while one is
+    running and run on `conn` directly otherwise.
+
+    If the broker goes away mid-call, or its group commit fails, the call
+    is retried directly; like a lost lease, that can repeat an operation
+    whose reply was lost, never drop one. A missing broker is looked for again every RECONNECT_S."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.client = BrokerClient.connect(conn.path)
+        self._retry_at = time.monotonic() + RECONNECT_S
+
+    @property
+    def brokered(self) -> bool:
+        return self.client is not None
+
+    def _call(self, op: str, *args: Any) -> Any:
+        if self.client is None and time.monotonic() >= self._retry_at:
+            self.client = BrokerClient.connect(self.conn.path)
+            self._retry_at = time.monotonic() + RECONNECT_S
+        if self.client is not None:
+            try:
+                return self.client.call(op, *args)
+            except BrokerUnavailable:
+                self.client.close()
+                self.client = None
+                self._retry_at = time.monotonic() + RECONNECT_S
+        return getattr(repo, op)(self.conn, *args)
+
+    def enqueue(self, job: Dict[str, Any]) -> str:
+        return self._call("enqueue", job)
+
+    def enqueue_many(self, jobs: Iterable[Dict[str, Any]], batch_size: int = 10000,
+                     on_conflict: str = "fail") -> int:
+        # Materialise one batch at a time, brokered or not: the broker may
+        # appear or vanish between calls, and a generator cannot be sent
+        # (or re-sent after a fallback). One frame per batch, so a large
+        # file still streams.
+        it, total = iter(jobs), 0
+        while True:
+            batch = list(islice(it, batch_size))
+            if not batch:
+                return total
+            total += self._call("enqueue_many", batch, batch_size, on_conflict)
+
+    def enqueue_dag(self, jobs: List[Dict[str, Any]]) -> List[str]:
+        return self._call("enqueue_dag", jobs)
+
+    def acquire_batch(self, worker_id: str, n: int, queues: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self._call("acquire_batch", worker_id, n, queues)
+
+    def record_results(self, results) -> None:
+        if results:
+            self._call("record_results", results)
+
+    def release_jobs(self, worker_id: str, job_ids: List[str]) -> int:
+        return self._call("release_jobs", worker_id, job_ids)
+
+    def extend_leases(self, worker_id: str, lease_seconds: int, job_ids: List[str]) -> int:
+        return self._call("extend_leases", worker_id, lease_seconds, job_ids)
+
+    def next_due_ms(self) -> Optional[int]:
+        return self._call("next_due_ms")
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+class _Peer:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+    def requests(self) -> List[dict]:
+        out = []
+        while len(self.inbuf) >= _HEADER.size:
+            n = _HEADER.unpack_from(self.inbuf)[0]
+            if n > MAX_FRAME:
+                raise ValueError("frame too large")
+            if len(self.inbuf) < _HEADER.size + n:
+                break
+            out.append(json.loads(bytes(self.inbuf[_HEADER.size:_HEADER.size + n])))
+            del self.inbuf[:_HEADER.size + n]
+        return out
+
+_stop = False
+
+def _on_signal(signum, frame):
+    global _stop
+    _stop = True
+
+def _execute(conn: sqlite3.Connection, req: dict) -> dict:
+    op, args = req.get("op"), req.get("args") or []
+    if op not in OPS:
+        return {"ok": False, "error": f"unknown op {op!r}", "kind": "ValueError"}
+    if op == "record_results":
+        args = [_decode_results(args[0])]
+    try:
+        return {"ok": True, "result": getattr(repo, op)(conn, *args)}
+    except Exception as e:
+        return {"ok": False, "error": str(e), "kind": type(e).__name__}
+
+def serve(db_path: Optional[str] = None) -> None:
+    """Run the broker in the foreground until SIGTERM/SIGINT."""
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+    conn = connect(db_path)
+    path = socket_path(conn.path)
+    if len(str(path)) > _MAX_SUN_PATH:
+        raise RuntimeError(f"socket path too long for AF_UNIX: {path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    probe = BrokerClient.connect(conn.path, timeout=1.0)
+    if probe is not None:
+        probe.close()
+        raise RuntimeError(f"a broker is already serving {conn.path}")
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(str(path))
+    os.chmod(path, 0o600)
+    listener.listen(128)
+    listener.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(listener, selectors.EVENT_READ, None)
+    last_dump = 0.0
+    try:
+        while not _stop:
+            pending = []
+            for key, mask in sel.select(timeout=0.5):
+                if key.data is None:
+                    sock, _ = listener.accept()
+                    sock.setblocking(False)
+                    sel.register(sock, selectors.EVENT_READ, _Peer(sock))
+                    continue
+                peer = key.data
+                if mask & selectors.EVENT_READ:
+                    try:
+                        data = peer.sock.recv(1 << 16)
+                    except (BlockingIOError, InterruptedError):
+                        data = None
+                    except OSError:
+                        data = b""
+                    if data == b"":
+                        _drop(sel, peer)
+                        continue
+                    if data:
+                        peer.inbuf += data
+                        try:
+                            pending.extend((peer, r) for r in peer.requests())
+                        except ValueError:
+                            _drop(sel, peer)
+                            continue
+                if mask & selectors.EVENT_WRITE:
+                    _flush(sel, peer)
+            for i in range(0, len(pending), MAX_GROUP):
+                _group_commit(conn, sel, pending[i:i + MAX_GROUP])
+            if time.monotonic() - last_dump >= metrics.DUMP_INTERVAL_S:
+                metrics.dump(conn.path)
+                last_dump = time.monotonic()
+    finally:
+        metrics.remove(conn.path)
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        conn.close()
+
+def _group_commit(conn: sqlite3.Connection, sel, group) -> None:
+    """Run a group of requests in one transaction and answer them after COMMIT."""
+    with metrics.timed("queuectl_broker_group_seconds"):
+        try:
+            with write_txn(conn, "broker"):
+                replies = [_execute(conn, req) for _, req in group]
+        except sqlite3.Error as e:
+            replies = [{"ok": False, "error": f"commit failed: {e}", "kind": _COMMIT_FAILED}] * len(group)
+    metrics.observe("queuectl_broker_group_size", len(group))
+    if any(req.get("op") in _WRITES for _, req in group):
+        wake(conn.path)
+    for (peer, _), reply in zip(group, replies):
+        if peer.sock.fileno() < 0:
+            continue
+        peer.outbuf += _frame(reply)
+        _flush(sel, peer)
+
+def _flush(sel, peer: _Peer) -> None:
+    try:
+        sent = peer.sock.send(peer.outbuf) if peer.outbuf else 0
+    except (BlockingIOError, InterruptedError):
+        sent = 0
+    except OSError:
+        _drop(sel, peer)
+        return
+    del peer.outbuf[:sent]
+    sel.modify(peer.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if peer.outbuf else 0), peer)
+
+def _drop(sel, peer: _Peer) -> None:
+    try:
+        sel.unregister(peer.sock)
+    except (KeyError, ValueError):
+        pass
+    peer.sock.close()
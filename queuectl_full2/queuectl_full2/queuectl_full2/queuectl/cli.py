@@ -1,22 +1,48 @@
 
 from __future__ import annotations
-import json, sys
+import json, shlex, sys, sqlite3, time
+from itertools import islice
+from pathlib import Path
 import typer
-from rich.console import Console
-from rich.table import Table
 from typing import Optional
 from .db import connect, DEFAULT_DB_PATH
-from .repo import enqueue as repo_enqueue, list_jobs, status as repo_status, dlq_list, dlq_retry, get_logs
+from .shards import ShardSet
+from .repo import job_cursor, get_logs, get_job
+from .logstore import live_path, follow_marker
 from .utils import gen_id, utc_now, to_iso
-from .worker import start_controller, stop_controller
-from .config import get_config, set_config
+from .config import get_config
+from . import metrics
 
 app = typer.Typer(add_completion=False)
-console = Console()
+
+# rich, the worker module and maintenance are imported only by the commands
+# that use them, so a `status --json` does not pay for them at startup.
+class _LazyConsole:
+    _console = None
+
+    def __getattr__(self, name):
+        if _LazyConsole._console is None:
+            from rich.console import Console
+            _LazyConsole._console = Console()
+        return getattr(_LazyConsole._console, name)
+
+console = _LazyConsole()
+
+def _table(title: str):
+    from rich.table import Table
+    return Table(title=title)
+
+def _print_json(data) -> None:
+    # Plain json instead of rich's highlighter: --json is for scripts.
+    sys.stdout.write(json.dumps(data, indent=2, default=str) + "\n")
 
 def _conn(db: Optional[str]):
     return connect(db)
 
+def _shards(db: Optional[str]) -> ShardSet:
+    # Every shard of the queue; a plain single-file queue is one shard.
+    return ShardSet(db)
+
 @app.command(help="Add a new job to the queue. Provide JSON or use flags.")
 def enqueue(job_json: Optional[str] = typer.Argument(None),
             command: Optional[str] = typer.Option(None, "--command", "-c", help="Command to execute"),
@@ -24,14 +50,38 @@ def enqueue(job_json: Optional[str] = typer.Argument(None),
             max_retries: int = typer.Option(None, "--max-retries"),
             priority: int = typer.Option(0, "--priority"),
             run_at: Optional[str] = typer.Option(None, "--run-at", help="ISO UTC time"),
+            timeout: Optional[int] = typer.Option(None, "--timeout", help="Seconds before the job's process group is killed"),
+            cpu_seconds: Optional[int] = typer.Option(None, "--cpu-seconds", help="CPU time limit (RLIMIT_CPU)"),
+            memory_mb: Optional[int] = typer.Option(None, "--memory-mb", help="Address space limit in MiB (RLIMIT_AS)"),
+            no_shell: bool = typer.Option(False, "--no-shell", help="Split the command and exec it without /bin/sh"),
+            queue: Optional[str] = typer.Option(None, "--queue", "-q", help="Named queue (default: 'default')"),
+            concurrency_key: Optional[str] = typer.Option(None, "--concurrency-key", help="Share this key's rate/concurrency limits"),
+            depends_on: Optional[str] = typer.Option(None, "--depends-on", help="Comma-separated job ids that must complete first"),
+            idempotency_key: Optional[str] = typer.Option(None, "--idempotency-key", help="Skip if a job with this key was enqueued within dedup_window_seconds"),
+            coalesce: bool = typer.Option(False, "--coalesce", help="Return an identical job that is still pending instead of adding another"),
             db: Optional[str] = typer.Option(None, "--db", help=f"DB path (default: {DEFAULT_DB_PATH})")):
-    conn = _conn(db)
+    shards = _shards(db)
     if job_json:
         job = json.loads(job_json)
     else:
         if not command:
             raise typer.BadParameter("Either JOB_JSON or --command required.")
         job = {"command": command}
+    if not any(k in job for k in ("command", "argv", "callable")):
+        raise typer.BadParameter("Job needs 'command', 'argv' or 'callable'.")
+    if job.get("kind") == "python":
+        job.setdefault("command", job.get("callable"))
+    if no_shell and "argv" not in job:
+        job["argv"] = shlex.split(job["command"])
+    job.setdefault("command", shlex.join(job.get("argv") or []))
+    for key, value in (("timeout", timeout), ("cpu_seconds", cpu_seconds), ("memory_mb", memory_mb), ("queue", queue),
+                       ("concurrency_key", concurrency_key), ("idempotency_key", idempotency_key)):
+        if value is not None:
+            job[key] = value
+    if coalesce:
+        job["coalesce"] = True
+    if depends_on:
+        job["depends_on"] = [d.strip() for d in depends_on.split(",") if d.strip()]
     job.setdefault("id", id or gen_id())
     if max_retries is not None:
         job["max_retries"] = max_retries
@@ -40,29 +90,116 @@ def enqueue(job_json: Optional[str] = typer.Argument(None),
     if "run_at" not in job:
         job["run_at"] = to_iso(utc_now())
     job.setdefault("priority", priority)
-    repo_enqueue(conn, job)
+    try:
+        job_id = shards.enqueue(job)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    if job_id != job["id"]:
+        console.print(f"[yellow]Duplicate[/yellow] of {job_id}; nothing enqueued")
+        return
     console.print(f"[green]Enqueued[/green] {job['id']} : {job['command']}")
 
+@app.command(help="Bulk-enqueue jobs from a JSONL file (one job object per line) or '-' for stdin.")
+def enqueue_bulk(source: str = typer.Argument("-", help="JSONL file path, or - for stdin"),
+                 batch_size: int = typer.Option(10000, "--batch-size", help="Rows per transaction"),
+                 on_conflict: str = typer.Option("fail", "--on-conflict", help="Duplicate id: fail|skip|replace"),
+                 db: Optional[str] = typer.Option(None, "--db")):
+    if on_conflict not in ("fail", "skip", "replace"):
+        raise typer.BadParameter("--on-conflict must be fail, skip or replace")
+    shards = _shards(db)
+    fh = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    def jobs():
+        for lineno, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise typer.BadParameter(f"line {lineno}: {e}")
+            if not any(k in job for k in ("command", "argv", "callable")):
+                raise typer.BadParameter(f"line {lineno}: missing 'command', 'argv' or 'callable'")
+            yield job
+    try:
+        n = shards.enqueue_many(jobs(), batch_size=batch_size, on_conflict=on_conflict)
+    except sqlite3.IntegrityError as e:
+        console.print(f"[red]Duplicate job id ({e}); earlier batches were committed.[/red]")
+        raise typer.Exit(1)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    console.print(f"[green]Enqueued[/green] {n} jobs")
+
+@app.command(help="Enqueue a workflow atomically: a JSON array (or JSONL) of jobs with 'depends_on' id lists.")
+def enqueue_dag(source: str = typer.Argument("-", help="JSON/JSONL file path, or - for stdin"),
+                db: Optional[str] = typer.Option(None, "--db")):
+    shards = _shards(db)
+    fh = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        text = fh.read()
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    try:
+        stripped = text.lstrip()
+        jobs = json.loads(text) if stripped.startswith("[") else [json.loads(l) for l in text.splitlines() if l.strip()]
+    except json.JSONDecodeError as e:
+        raise typer.BadParameter(str(e))
+    for job in jobs:
+        if not any(k in job for k in ("command", "argv", "callable")):
+            raise typer.BadParameter(f"job {job.get('id', '?')}: missing 'command', 'argv' or 'callable'")
+    try:
+        ids = shards.enqueue_dag(jobs)
+    except sqlite3.IntegrityError as e:
+        console.print(f"[red]Duplicate job id ({e}); nothing was enqueued.[/red]")
+        raise typer.Exit(1)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    console.print(f"[green]Enqueued[/green] workflow of {len(ids)} jobs")
+
+@app.command(help="Run the broker daemon in the foreground: it owns the DB's write path and group-commits "
+                  "enqueue/claim/ack for workers and CLI calls, which use it automatically while it runs.")
+def broker(db: Optional[str] = typer.Option(None, "--db")):
+    from .broker import serve
+    try:
+        serve(db)
+    except RuntimeError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(1)
+
 @app.command(help="Start worker processes.")
 def worker_start(count: int = typer.Option(1, "--count"),
+                 concurrency: int = typer.Option(1, "--concurrency", help="Jobs each worker process runs at once"),
+                 queues: Optional[str] = typer.Option(None, "--queues", help="Comma-separated queues to serve (default: all)"),
+                 max_count: Optional[int] = typer.Option(None, "--max-count", help="Autoscale between --count and this many workers"),
+                 shards: Optional[str] = typer.Option(None, "--shards", help="Comma-separated shard numbers to claim from (default: all)"),
                  db: Optional[str] = typer.Option(None, "--db")):
+    if max_count is not None and max_count < count:
+        raise typer.BadParameter("--max-count must be >= --count")
     try:
-        start_controller(count, db)
+        from .scheduler import parse_shards
+        parse_shards(shards)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    try:
+        from .worker import start_controller
+        start_controller(count, db, concurrency, queues, max_count, shards)
     except RuntimeError as e:
         console.print(f"[red]{e}[/red]")
         raise typer.Exit(1)
 
 @app.command(help="Stop worker processes gracefully.")
 def worker_stop():
+    from .worker import stop_controller
     stop_controller()
 
 @app.command(help="Show summary of job states & active workers.")
 def status(db: Optional[str] = typer.Option(None, "--db"), json_out: bool = typer.Option(False, "--json")):
-    conn = _conn(db)
-    st = repo_status(conn)
+    st = _shards(db).status()
     if json_out:
-        console.print_json(data=st); return
-    table = Table(title="queuectl status")
+        _print_json(st); return
+    table = _table("queuectl status")
     table.add_column("Metric")
     table.add_column("Value")
     table.add_row("Total", str(st["total"]))
@@ -72,57 +209,304 @@ def status(db: Optional[str] = typer.Option(None, "--db"), json_out: bool = type
     table.add_row("DB", str(db or DEFAULT_DB_PATH))
     console.print(table)
 
-@app.command(help="List jobs by state.")
+def _ms(v: Optional[float]) -> str:
+    return "-" if v is None else f"{v * 1000:.2f}"
+
+@app.command(help="Show latency histograms and counters merged from running workers.")
+def stats(db: Optional[str] = typer.Option(None, "--db"),
+          json_out: bool = typer.Option(False, "--json"),
+          prometheus: bool = typer.Option(False, "--prometheus", help="Prometheus text exposition format")):
+    snap = metrics.collect(_conn(db).path)
+    if prometheus:
+        sys.stdout.write(metrics.render(snap)); return
+    rows = metrics.summary(snap)
+    if json_out:
+        _print_json(rows); return
+    table = _table("queuectl stats (ms)")
+    for col in ("Series", "Count", "Mean", "p50", "p95", "p99"):
+        table.add_column(col)
+    for r in rows:
+        if "value" in r:
+            table.add_row(r["series"], f"{r['value']:g}", "", "", "", "")
+        else:
+            table.add_row(r["series"], str(r["count"]), _ms(r["mean"]), _ms(r["p50"]), _ms(r["p95"]), _ms(r["p99"]))
+    console.print(table)
+
+def _bench_value(key: str, v) -> str:
+    if v is None:
+        return "-"
+    if key == "db_bytes":
+        return f"{v / 1048576:.1f} MiB"
+    return f"{v:g}" if isinstance(v, float) else str(v)
+
+@app.command(help="Run the load-testing suite (enqueue, claim, retry, large) and save the results as JSON.")
+def bench(scenarios: str = typer.Option("enqueue,claim,retry,large", "--scenarios", help="Comma-separated: enqueue, claim, retry, large"),
+          jobs: int = typer.Option(500, "--jobs", help="Jobs per scenario"),
+          workers: str = typer.Option("1,4", "--workers", help="Worker counts for the claim scenario"),
+          concurrency: int = typer.Option(1, "--concurrency"),
+          job_type: str = typer.Option("noop", "--job-type", help="noop, python, cpu or output"),
+          rate: float = typer.Option(0.0, "--rate", help="Claim scenario enqueue rate per second (0 = as fast as possible)"),
+          retries: int = typer.Option(2, "--retries", help="max_retries in the retry storm"),
+          large_rows: int = typer.Option(100000, "--large-rows", help="Table size for the large scenario"),
+          seed: int = typer.Option(0, "--seed"),
+          out: Optional[str] = typer.Option(None, "--out", help="Result file (default: bench-<UTC time>.json)"),
+          compare: Optional[str] = typer.Option(None, "--compare", help="Earlier result file to compare against"),
+          json_out: bool = typer.Option(False, "--json")):
+    from . import bench as suite
+    try:
+        counts = [int(n) for n in workers.split(",") if n.strip()]
+        before = suite.load(compare) if compare else None
+        if not counts or min(counts) < 1:
+            raise ValueError("--workers needs positive worker counts")
+        progress = None if json_out else (lambda r: console.print(
+            f"[dim]{r['scenario']} {r['variant']} done[/dim]"))
+        doc = suite.run([s.strip() for s in scenarios.split(",") if s.strip()], jobs, counts, concurrency,
+                        job_type, rate, retries, large_rows, seed, progress=progress)
+    except (ValueError, OSError) as e:
+        raise typer.BadParameter(str(e))
+    out = out or f"bench-{doc['created_at'].replace(':', '').replace('-', '')}.json"
+    suite.save(doc, out)
+    if json_out:
+        _print_json(doc); return
+    if before is not None:
+        table = _table(f"bench: {compare} -> {out}")
+        for col in ("Scenario", "Metric", "Before", "After", "Change"):
+            table.add_column(col)
+        for r in suite.compare(before, doc):
+            change = "-" if r["change"] is None else f"{r['change']:+.1%}"
+            table.add_row(f"{r['scenario']} {r['variant']}", r["metric"], _bench_value(r["metric"], r["before"]),
+                          _bench_value(r["metric"], r["after"]), change)
+    else:
+        table = _table(f"bench ({out})")
+        for col in ("Scenario", "Metric", "Value"):
+            table.add_column(col)
+        for r in doc["results"]:
+            for key, v in r.items():
+                if key not in ("scenario", "variant"):
+                    table.add_row(f"{r['scenario']} {r['variant']}", key, _bench_value(key, v))
+    console.print(table)
+
+@app.command(help="Show named queues, or set a queue's --weight / --max-concurrency.")
+def queues(name: Optional[str] = typer.Argument(None),
+           weight: Optional[float] = typer.Option(None, "--weight", help="Fair-share weight (default 1)"),
+           max_concurrency: Optional[int] = typer.Option(None, "--max-concurrency", help="Cap on jobs processing at once"),
+           uncapped: bool = typer.Option(False, "--uncapped", help="Remove the concurrency cap"),
+           db: Optional[str] = typer.Option(None, "--db"),
+           json_out: bool = typer.Option(False, "--json")):
+    shards = _shards(db)
+    if name is not None:
+        if weight is None and max_concurrency is None and not uncapped:
+            raise typer.BadParameter("give --weight, --max-concurrency or --uncapped")
+        try:
+            shards.set_queue(name, weight, max_concurrency, uncapped)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+    rows = shards.queue_stats()
+    if json_out:
+        _print_json(rows); return
+    table = _table("queues")
+    for col in ("Queue", "Weight", "Max concurrency", "Runnable", "Processing"):
+        table.add_column(col)
+    for r in rows:
+        table.add_row(r["name"], f"{r['weight']:g}", "-" if r["max_concurrency"] is None else str(r["max_concurrency"]),
+                      str(r["runnable"]), str(r["processing"]))
+    console.print(table)
+
+@app.command(help="Show per-key limits, or set one for concurrency key KEY.")
+def limits(key: Optional[str] = typer.Argument(None),
+           max_concurrency: Optional[int] = typer.Option(None, "--max-concurrency", help="Jobs with this key running at once"),
+           rate: Optional[float] = typer.Option(None, "--rate", help="Job starts per second (0 = unlimited)"),
+           burst: Optional[float] = typer.Option(None, "--burst", help="Starts allowed at once after idling (default: max(1, rate))"),
+           clear: bool = typer.Option(False, "--clear", help="Remove all limits on KEY"),
+           db: Optional[str] = typer.Option(None, "--db"),
+           json_out: bool = typer.Option(False, "--json")):
+    shards = _shards(db)
+    if key is not None:
+        if max_concurrency is None and rate is None and burst is None and not clear:
+            raise typer.BadParameter("give --max-concurrency, --rate, --burst or --clear")
+        try:
+            shards.set_rate_limit(key, max_concurrency, rate, burst, clear)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+    rows = shards.rate_limits()
+    if json_out:
+        _print_json(rows); return
+    table = _table("rate limits")
+    for col in ("Key", "Max concurrency", "Rate/s", "Burst", "Processing", "Ready"):
+        table.add_column(col)
+    for r in rows:
+        table.add_row(r["key"], "-" if r["max_concurrency"] is None else str(r["max_concurrency"]),
+                      "-" if r["rate"] is None else f"{r['rate']:g}", "-" if r["burst"] is None else f"{r['burst']:g}",
+                      str(r["processing"]), str(r["ready"]))
+    console.print(table)
+
+@app.command(help="Rebuild the cached per-state counters used by status from the jobs table.")
+def reconcile(db: Optional[str] = typer.Option(None, "--db")):
+    st = _shards(db).reconcile_status()
+    console.print(f"[green]Reconciled[/green] counters: total={st['total']} " +
+                  " ".join(f"{k}={v}" for k, v in st["states"].items()))
+
+def _export(rows, fmt: str) -> None:
+    # Row-by-row writer for large result sets; never builds a table in memory.
+    out = sys.stdout
+    if fmt == "jsonl":
+        for r in rows:
+            out.write(json.dumps(r) + "\n")
+    elif fmt == "csv":
+        import csv
+        writer = None
+        for r in rows:
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=[*r])
+                writer.writeheader()
+            writer.writerow(r)
+    else:
+        raise typer.BadParameter("--format must be jsonl or csv")
+    out.flush()
+
+def _filters(command, error, since, until):
+    return dict(command_like=command, error_like=error, since=since, until=until)
+
+@app.command(help="List jobs by state, oldest first. Page with --after; stream all matches with --format.")
 def list(state: Optional[str] = typer.Option(None, "--state"),
-         limit: int = typer.Option(50, "--limit"),
+         limit: Optional[int] = typer.Option(None, "--limit", help="Max rows (default 50; unlimited with --format)"),
+         after: Optional[str] = typer.Option(None, "--after", help="Cursor printed by the previous page"),
+         command: Optional[str] = typer.Option(None, "--command", help="SQL LIKE pattern on command"),
+         error: Optional[str] = typer.Option(None, "--error", help="SQL LIKE pattern on last_error"),
+         since: Optional[str] = typer.Option(None, "--since", help="created_at >= ISO time"),
+         until: Optional[str] = typer.Option(None, "--until", help="created_at < ISO time"),
+         fmt: Optional[str] = typer.Option(None, "--format", help="Stream rows as jsonl or csv"),
          db: Optional[str] = typer.Option(None, "--db"),
          json_out: bool = typer.Option(False, "--json")):
-    conn = _conn(db)
-    rows = list_jobs(conn, state, limit)
+    shards = _shards(db)
+    filters = _filters(command, error, since, until)
+    if fmt:
+        rows = shards.iter_jobs(state, after=after, **filters)
+        _export(islice(rows, limit) if limit else rows, fmt); return
+    limit = limit or 50
+    rows = shards.list_jobs(state, limit, after=after, **filters)
     if json_out:
-        console.print_json(data=rows); return
-    table = Table(title=f"jobs (state={state or 'any'})")
+        _print_json(rows); return
+    table = _table(f"jobs (state={state or 'any'})")
     cols = ["id","state","attempts","max_retries","run_at","priority","command","last_error"]
     for c in cols:
         table.add_column(c)
     for r in rows:
         table.add_row(*(str(r.get(c,''))[:80] for c in cols))
     console.print(table)
+    if len(rows) == limit:
+        console.print(f"next page: --after '{job_cursor(rows[-1])}'")
 
-@app.command(help="DLQ: list dead jobs.")
-def dlq_list_cmd(db: Optional[str]=typer.Option(None, "--db"), json_out: bool=typer.Option(False, "--json")):
-    conn = _conn(db)
-    rows = dlq_list(conn)
+@app.command(help="DLQ: list dead jobs, most recent first. Page with --after; stream all matches with --format.")
+def dlq_list_cmd(limit: Optional[int] = typer.Option(None, "--limit", help="Max rows (default 50; unlimited with --format)"),
+                 after: Optional[str] = typer.Option(None, "--after", help="Cursor printed by the previous page"),
+                 command: Optional[str] = typer.Option(None, "--command", help="SQL LIKE pattern on command"),
+                 error: Optional[str] = typer.Option(None, "--error", help="SQL LIKE pattern on last_error"),
+                 since: Optional[str] = typer.Option(None, "--since", help="updated_at >= ISO time"),
+                 until: Optional[str] = typer.Option(None, "--until", help="updated_at < ISO time"),
+                 fmt: Optional[str] = typer.Option(None, "--format", help="Stream rows as jsonl or csv"),
+                 db: Optional[str]=typer.Option(None, "--db"),
+                 json_out: bool=typer.Option(False, "--json")):
+    shards = _shards(db)
+    filters = _filters(command, error, since, until)
+    if fmt:
+        rows = shards.iter_dlq(after=after, **filters)
+        _export(islice(rows, limit) if limit else rows, fmt); return
+    limit = limit or 50
+    rows = shards.dlq_list(limit, after=after, **filters)
     if json_out:
-        console.print_json(data=rows); return
-    table = Table(title="DLQ (dead jobs)")
+        _print_json(rows); return
+    table = _table("DLQ (dead jobs)")
     cols = ["id","attempts","max_retries","updated_at","command","last_error"]
     for c in cols:
         table.add_column(c)
     for r in rows:
         table.add_row(*(str(r.get(c,''))[:80] for c in cols))
     console.print(table)
+    if len(rows) == limit:
+        console.print(f"next page: --after '{job_cursor(rows[-1], 'updated_at')}'")
 
-@app.command(help="DLQ: retry a dead job by id.")
-def dlq_retry_cmd(job_id: str = typer.Argument(...),
+@app.command(help="DLQ: retry a dead job by id, or every dead job matching filters (--all for all).")
+def dlq_retry_cmd(job_id: Optional[str] = typer.Argument(None),
+                  command: Optional[str] = typer.Option(None, "--command", help="SQL LIKE pattern on command"),
+                  error: Optional[str] = typer.Option(None, "--error", help="SQL LIKE pattern on last_error"),
+                  since: Optional[str] = typer.Option(None, "--since", help="updated_at >= ISO time"),
+                  until: Optional[str] = typer.Option(None, "--until", help="updated_at < ISO time"),
+                  all_: bool = typer.Option(False, "--all", help="Retry the whole DLQ"),
+                  batch_size: int = typer.Option(1000, "--batch-size", help="Jobs per transaction"),
                   db: Optional[str]=typer.Option(None, "--db")):
-    conn = _conn(db)
-    ok = dlq_retry(conn, job_id)
+    shards = _shards(db)
+    filters = _filters(command, error, since, until)
+    if job_id is None:
+        if not all_ and not any(filters.values()):
+            raise typer.BadParameter("Give a JOB_ID, a filter (--command/--error/--since/--until) or --all.")
+        n = shards.dlq_retry_many(batch_size=batch_size, **filters)
+        console.print(f"[green]Re-enqueued[/green] {n} jobs")
+        return
+    ok = shards.dlq_retry(job_id)
     if not ok:
         console.print(f"[red]Job {job_id} not in DLQ[/red]")
         raise typer.Exit(1)
     console.print(f"[green]Re-enqueued[/green] {job_id}")
 
+def _follow_logs(conn, job_id: str, poll_s: float = 0.2) -> None:
+    # The marker asks the worker to spool the job's output; tail the spool
+    # while the job runs. The worker truncates it when it grows too large,
+    # so restart from 0 whenever it shrinks.
+    path = live_path(conn.path, job_id)
+    marker = follow_marker(path)
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.touch()
+    try:
+        streamed = _tail_spool(conn, job_id, path, poll_s)
+    finally:
+        try:
+            marker.unlink()
+        except FileNotFoundError:
+            pass
+    if not streamed:
+        rows = get_logs(conn, job_id, 1)
+        if rows:
+            out = sys.stdout.buffer
+            out.write(rows[0]["stdout"].encode()); out.write(rows[0]["stderr"].encode()); out.flush()
+
+def _tail_spool(conn, job_id: str, path: Path, poll_s: float) -> bool:
+    offset, streamed = 0, False
+    out = sys.stdout.buffer
+    while True:
+        try:
+            with open(path, "rb") as f:
+                f.seek(0, 2)
+                if f.tell() < offset:
+                    offset = 0
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            job = get_job(conn, job_id)
+            if job is None or job["state"] not in ("pending", "processing"):
+                break
+            chunk = b""
+        if chunk:
+            out.write(chunk); out.flush()
+            offset += len(chunk)
+            streamed = True
+        else:
+            time.sleep(poll_s)
+    return streamed
+
 @app.command(help="Show recent logs for a job.")
 def logs(job_id: str = typer.Argument(...),
          limit: int = typer.Option(5, "--limit"),
+         follow: bool = typer.Option(False, "--follow", "-f", help="Stream output while the job runs"),
          db: Optional[str]=typer.Option(None, "--db"),
          json_out: bool=typer.Option(False, "--json")):
-    conn = _conn(db)
+    conn = _shards(db).conn_for(job_id)
+    if follow:
+        _follow_logs(conn, job_id); return
     rows = get_logs(conn, job_id, limit)
     if json_out:
-        console.print_json(data=rows); return
-    table = Table(title=f"logs for {job_id}")
+        _print_json(rows); return
+    table = _table(f"logs for {job_id}")
     cols = ["id","created_at","exit_code","stdout","stderr"]
     for c in cols:
         table.add_column(c)
@@ -130,15 +514,41 @@ def logs(job_id: str = typer.Argument(...),
         table.add_row(*(str(r.get(c,''))[:80] for c in cols))
     console.print(table)
 
+@app.command(help="Archive and delete finished jobs older than the retention TTL, then compact the DB.")
+def gc(ttl_days: Optional[float] = typer.Option(None, "--ttl-days", help="Default: config job_retention_days"),
+       include_dead: bool = typer.Option(False, "--include-dead", help="Also remove old DLQ jobs"),
+       no_archive: bool = typer.Option(False, "--no-archive", help="Delete without writing archive DBs"),
+       archive_dir: Optional[str] = typer.Option(None, "--archive-dir"),
+       vacuum: bool = typer.Option(False, "--vacuum", help="Full VACUUM (one-off; enables incremental vacuum on old DBs)"),
+       every: Optional[float] = typer.Option(None, "--every", help="Keep running, once every N seconds"),
+       db: Optional[str] = typer.Option(None, "--db")):
+    from .maintenance import run_maintenance
+    shards = _shards(db)
+    dest = Path(archive_dir) if archive_dir else None
+    while True:
+        r = {"removed": 0, "segments_pruned": 0, "pages_released": 0}
+        for conn in shards.conns:
+            for k, v in run_maintenance(conn, ttl_days, include_dead, not no_archive, dest, vacuum).items():
+                r[k] = r.get(k, 0) + v
+        console.print(f"gc: removed {r['removed']} jobs, pruned {r['segments_pruned']} log segments, "
+                      f"released {r['pages_released']} pages")
+        if not every:
+            return
+        vacuum = False
+        try:
+            time.sleep(every)
+        except KeyboardInterrupt:
+            return
+
 @app.command(help="Config get or set keys.")
 def config(action: str = typer.Argument(..., help="get|set"),
            key: str = typer.Argument(...),
            value: Optional[str] = typer.Argument(None),
            db: Optional[str] = typer.Option(None, "--db")):
-    conn = _conn(db)
+    shards = _shards(db)
     if action == "get":
         try:
-            v = get_config(conn, key)
+            v = get_config(shards.conns[0], key)
         except KeyError:
             console.print(f"[red]Key not found[/red]")
             raise typer.Exit(1)
@@ -146,7 +556,13 @@ def config(action: str = typer.Argument(..., help="get|set"),
     elif action == "set":
         if value is None:
             raise typer.BadParameter("value required for set")
-        set_config(conn, key, value)
+        try:
+            shards.set_config(key, value)
+        except KeyError as e:
+            console.print(f"[red]{e.args[0]}[/red]")
+            raise typer.Exit(1)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
         console.print(f"Set {key} = {value}")
     else:
         raise typer.BadParameter("action must be 'get' or 'set'")
@@ -1,6 +1,9 @@
 
 from __future__ import annotations
-import sqlite3
+import sqlite3, time
+from typing import Dict
+
+VERSION_KEY = "config_version"
 
 def get_config(conn: sqlite3.Connection, key: str) -> str:
     row = conn.execute("SELECT value FROM config WHERE key=?", (key,)).fetchone()
@@ -9,8 +12,78 @@ def get_config(conn: sqlite3.Connection, key: str) -> str:
     return row["value"]
 
 def set_config(conn: sqlite3.Connection, key: str, value: str) -> None:
-    with conn:
+    if key == VERSION_KEY:
+        raise KeyError(f"{key} is maintained by queuectl")
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
         conn.execute("INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+        conn.execute("""
+            INSERT INTO config(key,value) VALUES(?, '1')
+            ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER) + 1
+        """, (VERSION_KEY,))
+        conn.execute("COMMIT;")
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    cache = getattr(conn, "config_cache", None)
+    if cache is not None:
+        cache.refresh(force=True)
 
 def get_int(conn: sqlite3.Connection, key: str) -> int:
     return int(get_config(conn, key))
+
+class ConfigCache:
+    """In-process snapshot of the config table.
+
+    Every set_config bumps config_version; refresh() probes that one row
+    (at most once per check_interval seconds) and reloads the whole table
+    only when it changed. Hot paths read settings from memory instead of
+    issuing a query per claim or failure, and long-running workers pick up
+    `queuectl config set` changes without a restart."""
+
+    def __init__(self, conn: sqlite3.Connection, check_interval: float = 1.0):
+        self.conn = conn
+        self.check_interval = check_interval
+        self.version = None
+        self._values: Dict[str, str] = {}
+        self._checked = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reload if the stored version moved; returns True when it did."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        row = self.conn.execute("SELECT value FROM config WHERE key=?", (VERSION_KEY,)).fetchone()
+        version = row[0] if row else None
+        if version == self.version and not force:
+            return False
+        self._values = {r[0]: r[1] for r in self.conn.execute("SELECT key, value FROM config")}
+        self.version = version
+        return True
+
+    def get(self, key: str) -> str:
+        try:
+            return self._values[key]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get_int(self, key: str) -> int:
+        return int(self.get(key))
+
+    def get_float(self, key: str) -> float:
+        return float(self.get(key))
+
+def snapshot(conn: sqlite3.Connection) -> ConfigCache:
+    """The connection's config cache, refreshed if its version is stale."""
+    cache = getattr(conn, "config_cache", None)
+    if cache is None:
+        cache = ConfigCache(conn)
+        try:
+            conn.config_cache = cache
+        except AttributeError:
+            pass  # plain sqlite3.Connection: no place to keep it
+        return cache
+    cache.refresh()
+    return cache
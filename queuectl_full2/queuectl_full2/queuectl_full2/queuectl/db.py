@@ -1,25 +1,50 @@
 
 from __future__ import annotations
-import sqlite3
+import sqlite3, time
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional, Dict, Any
+from .models import JOB_STATES
+from . import metrics
 
 DEFAULT_DB_PATH = Path.cwd() / "queue.db"
+# Stored in PRAGMA user_version once migrate() has brought a file up to
+# date. Bump it whenever migrate() changes (tables, columns, indexes,
+# config defaults) so existing databases pick the change up.
+SCHEMA_VERSION = 4
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that remembers which queue file it points at."""
+    path: str = ""
+    config_cache = None
 
 def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
     path = Path(db_path) if db_path else DEFAULT_DB_PATH
     path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(path), timeout=5.0, isolation_level=None)
+    conn = sqlite3.connect(str(path), timeout=5.0, isolation_level=None, factory=Connection)
+    conn.path = str(path.resolve())
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA busy_timeout=5000;")
     conn.execute("PRAGMA foreign_keys=ON;")
-    migrate(conn)
+    # REPLACE conflict deletes only fire delete triggers with this on.
+    conn.execute("PRAGMA recursive_triggers=ON;")
+    # An up-to-date file costs one header read here: no transaction, no
+    # write lock, so read-only commands never wait behind workers.
+    if conn.execute("PRAGMA user_version;").fetchone()[0] < SCHEMA_VERSION:
+        migrate(conn)
     return conn
 
 def migrate(conn: sqlite3.Connection) -> None:
-    conn.execute("BEGIN;")
+    # Both persist in the file. auto_vacuum only takes effect on a new,
+    # empty file; `gc --vacuum` converts old ones.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("BEGIN IMMEDIATE;")
     try:
+        if conn.execute("PRAGMA user_version;").fetchone()[0] >= SCHEMA_VERSION:
+            # Another process migrated while we waited for the lock.
+            conn.execute("COMMIT;")
+            return
         conn.execute(
             '''CREATE TABLE IF NOT EXISTS jobs (
                 id TEXT PRIMARY KEY,
@@ -47,25 +72,288 @@ def migrate(conn: sqlite3.Connection) -> None:
                 FOREIGN KEY(job_id) REFERENCES jobs(id) ON DELETE CASCADE
             );'''
         )
+        _add_columns(conn, "job_logs", {
+            "segment": "TEXT",
+            "stdout_off": "INTEGER",
+            "stdout_len": "INTEGER",
+            "stderr_off": "INTEGER",
+            "stderr_len": "INTEGER",
+        })
+        have = {r[1] for r in conn.execute("PRAGMA table_info(jobs)")}
+        had_due, had_limited = "due_ms" in have, "limited" in have
+        # Per-job execution overrides; NULL means the configured default.
+        # argv is a JSON list run without a shell. kind='python' jobs keep
+        # the callable in `command` and {"args", "kwargs"} JSON in payload.
+        _add_columns(conn, "jobs", {
+            "timeout": "INTEGER",
+            "cpu_seconds": "INTEGER",
+            "memory_mb": "INTEGER",
+            "argv": "TEXT",
+            "kind": "TEXT NOT NULL DEFAULT 'shell'",
+            "payload": "TEXT",
+            "queue": "TEXT NOT NULL DEFAULT 'default'",
+            # Epoch ms a delayed job becomes runnable; NULL once it is due.
+            "due_ms": "INTEGER",
+            # Jobs sharing a key share that key's rate_limits row.
+            "concurrency_key": "TEXT",
+            # 1 while concurrency_key has a rate_limits row; kept by triggers.
+            "limited": "INTEGER NOT NULL DEFAULT 0",
+            # Dependencies not yet completed; the job is claimable at 0.
+            "pending_deps": "INTEGER NOT NULL DEFAULT 0",
+            # Caller-chosen dedup key, unique while the job is kept.
+            "idempotency_key": "TEXT",
+            # Hash of what the job runs, set only for coalescing enqueues.
+            "coalesce_key": "TEXT",
+        })
+        # DAG edges, keyed for "who is waiting on this job" on completion.
+        conn.execute(
+            '''CREATE TABLE IF NOT EXISTS job_deps (
+                depends_on TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+                job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+                PRIMARY KEY (depends_on, job_id)
+            ) WITHOUT ROWID;'''
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_job_deps_job ON job_deps(job_id);")
+        if not had_due:
+            conn.execute('''UPDATE jobs SET due_ms = CAST(strftime('%s', run_at) AS INTEGER) * 1000
+                             WHERE state IN ('pending','failed') AND run_at > strftime('%Y-%m-%dT%H:%M:%SZ','now')''')
+        # Scheduling state per named queue; rows appear on first claim.
+        # max_concurrency NULL = uncapped; pass NULL = currently drained.
+        conn.execute(
+            '''CREATE TABLE IF NOT EXISTS queues (
+                name TEXT PRIMARY KEY,
+                weight REAL NOT NULL DEFAULT 1 CHECK (weight > 0),
+                max_concurrency INTEGER,
+                pass REAL
+            );'''
+        )
         conn.execute(
             '''CREATE TABLE IF NOT EXISTS config (
                 key TEXT PRIMARY KEY,
                 value TEXT NOT NULL
             );'''
         )
+        # Claim path: per-queue ordered scan over due runnable rows only,
+        # covering the columns the claim subquery reads so it never touches
+        # the table. Its leading column also lets the scheduler find the
+        # queues with work by skipping from one queue name to the next.
+        # Delayed jobs sit in idx_jobs_timers until the claim promotes them.
+        # Jobs whose concurrency_key has a limit are indexed per key instead,
+        # so a throttled key's backlog is stepped over with one seek; keys
+        # without a limit cost nothing over unkeyed jobs. Jobs still waiting
+        # on dependencies are in neither.
+        for old in ("idx_jobs_runnable", "idx_jobs_queue_runnable", "idx_jobs_ready",
+                    "idx_jobs_ready_unkeyed", "idx_jobs_ready_keyed"):
+            conn.execute(f"DROP INDEX IF EXISTS {old};")
+        _ensure_index(conn, "idx_jobs_ready_open", '''
+                 ON jobs(queue, priority DESC, created_at, id, state, due_ms, pending_deps, limited)
+              WHERE state IN ('pending','failed') AND due_ms IS NULL AND pending_deps = 0
+                AND limited = 0''')
+        _ensure_index(conn, "idx_jobs_ready_limited", '''
+                 ON jobs(queue, concurrency_key, priority DESC, created_at, id, state, due_ms, pending_deps, limited)
+              WHERE state IN ('pending','failed') AND due_ms IS NULL AND pending_deps = 0
+                AND limited = 1''')
+        # Enqueue-side dedup: each check is a single probe of one of these.
+        conn.execute(
+            '''CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_idempotency
+                 ON jobs(idempotency_key) WHERE idempotency_key IS NOT NULL;'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_coalesce
+                 ON jobs(coalesce_key) WHERE coalesce_key IS NOT NULL AND state = 'pending';'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_key_processing
+                 ON jobs(concurrency_key)
+              WHERE state = 'processing' AND concurrency_key IS NOT NULL;'''
+        )
+        # Per-key concurrency cap and token bucket (rate tokens/s, up to
+        # burst); tokens are refilled lazily from refilled_ms at claim time.
+        conn.execute(
+            '''CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                max_concurrency INTEGER,
+                rate REAL,
+                burst REAL,
+                tokens REAL,
+                refilled_ms INTEGER
+            );'''
+        )
+        if not had_limited:
+            conn.execute("UPDATE jobs SET limited = 1 WHERE concurrency_key IN (SELECT key FROM rate_limits)")
+        # jobs.limited follows rate_limits. Adding or clearing a limit
+        # rewrites every job of that key (a scan, but an admin operation);
+        # set_rate_limit upserts so changing one does not.
+        conn.execute(
+            '''CREATE TRIGGER IF NOT EXISTS trg_jobs_limited AFTER INSERT ON jobs
+              WHEN NEW.concurrency_key IS NOT NULL
+               AND EXISTS (SELECT 1 FROM rate_limits WHERE key = NEW.concurrency_key) BEGIN
+                UPDATE jobs SET limited = 1 WHERE id = NEW.id;
+            END;'''
+        )
+        conn.execute(
+            '''CREATE TRIGGER IF NOT EXISTS trg_limits_ins AFTER INSERT ON rate_limits BEGIN
+                UPDATE jobs SET limited = 1 WHERE concurrency_key = NEW.key AND limited = 0;
+            END;'''
+        )
+        conn.execute(
+            '''CREATE TRIGGER IF NOT EXISTS trg_limits_del AFTER DELETE ON rate_limits BEGIN
+                UPDATE jobs SET limited = 0 WHERE concurrency_key = OLD.key AND limited = 1;
+            END;'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_timers
+                 ON jobs(due_ms)
+              WHERE due_ms IS NOT NULL;'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_queue_processing
+                 ON jobs(queue)
+              WHERE state = 'processing';'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_leases
+                 ON jobs(locked_until)
+              WHERE state = 'processing';'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_workers
+                 ON jobs(worker_id)
+              WHERE state = 'processing';'''
+        )
+        # Keyset pagination for list / DLQ export.
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_state_created
+                 ON jobs(state, created_at, id);'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_created
+                 ON jobs(created_at, id);'''
+        )
+        conn.execute(
+            '''CREATE INDEX IF NOT EXISTS idx_jobs_state_updated
+                 ON jobs(state, updated_at, id);'''
+        )
+        # Per-state row counts kept by triggers so status never scans jobs.
+        created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='job_counts'"
+        ).fetchone() is None
+        conn.execute(
+            '''CREATE TABLE IF NOT EXISTS job_counts (
+                state TEXT PRIMARY KEY,
+                n INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;'''
+        )
+        conn.execute(
+            '''CREATE TRIGGER IF NOT EXISTS trg_jobs_count_ins AFTER INSERT ON jobs BEGIN
+                UPDATE job_counts SET n = n + 1 WHERE state = NEW.state;
+            END;'''
+        )
+        conn.execute(
+            '''CREATE TRIGGER IF NOT EXISTS trg_jobs_count_del AFTER DELETE ON jobs BEGIN
+                UPDATE job_counts SET n = n - 1 WHERE state = OLD.state;
+            END;'''
+        )
+        conn.execute(
+            '''CREATE TRIGGER IF NOT EXISTS trg_jobs_count_upd AFTER UPDATE OF state ON jobs
+              WHEN OLD.state <> NEW.state BEGIN
+                UPDATE job_counts SET n = n - 1 WHERE state = OLD.state;
+                UPDATE job_counts SET n = n + 1 WHERE state = NEW.state;
+            END;'''
+        )
+        if created:
+            reconcile_counts(conn)
         defaults = {
             "max_retries": "3",
             "backoff_base": "2",
+            "backoff_cap_seconds": "3600",
+            "backoff_jitter": "0.5",
             "lease_seconds": "60",
             "poll_interval_ms": "500",
-            "timeout_seconds": "300"
+            "timeout_seconds": "300",
+            "batch_size": "1",
+            "flush_interval_ms": "200",
+            "log_store": "segments",
+            "log_segment_mb": "64",
+            "log_retention_days": "7",
+            "log_head_bytes": "32768",
+            "log_tail_bytes": "32768",
+            "job_retention_days": "7",
+            "gc_chunk_size": "500",
+            "gc_interval_seconds": "0",
+            "python_preload": "",
+            "python_max_tasks": "1000",
+            "dedup_window_seconds": "86400",
+            "scale_cooldown_seconds": "30",
+            "scale_up_wait_seconds": "5",
+            "shards": "1",
+            "shard_by": "id",
+            "config_version": "0"
         }
         for k,v in defaults.items():
             conn.execute("INSERT OR IGNORE INTO config(key,value) VALUES(?,?)", (k, v))
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION};")
         conn.execute("COMMIT;")
     except Exception:
         conn.execute("ROLLBACK;")
         raise
 
+def reconcile_counts(conn: sqlite3.Connection) -> None:
+    """Rebuild job_counts from jobs. Caller provides the transaction."""
+    conn.execute("DELETE FROM job_counts")
+    conn.executemany("INSERT INTO job_counts(state, n) VALUES(?, 0)", [(s,) for s in JOB_STATES])
+    conn.execute("""
+        UPDATE job_counts
+           SET n = (SELECT COUNT(*) FROM jobs WHERE jobs.state = job_counts.state)
+    """)
+
+def _add_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str]) -> None:
+    have = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in have:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+def _ensure_index(conn: sqlite3.Connection, name: str, definition: str) -> None:
+    """CREATE INDEX name <definition>, rebuilding an existing index of that
+    name whose definition has since changed."""
+    sql = f"CREATE INDEX {name} {definition.strip()}"
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='index' AND name=?", (name,)).fetchone()
+    if row and row[0].split() == sql.split():
+        return
+    if row:
+        conn.execute(f"DROP INDEX {name}")
+    conn.execute(sql)
+
+@contextmanager
+def write_txn(conn: sqlite3.Connection, op: str = "other"):
+    """BEGIN IMMEDIATE ... COMMIT; takes the write lock up front so a
+    read-then-write sequence cannot interleave with another writer.
+
+    Records how long BEGIN waited for the lock (time spent in busy_timeout)
+    and how long the transaction held it, both labelled with `op`. Inside
+    an open transaction (the broker's group commit) it is a savepoint, so
+    the operation can fail alone without undoing the rest of the group."""
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT nested;")
+        try:
+            yield conn
+            conn.execute("RELEASE nested;")
+        except BaseException:
+            conn.execute("ROLLBACK TO nested;")
+            conn.execute("RELEASE nested;")
+            raise
+        return
+    t0 = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE;")
+    t1 = time.perf_counter()
+    metrics.observe("queuectl_lock_wait_seconds", t1 - t0, op=op)
+    try:
+        yield conn
+        conn.execute("COMMIT;")
+        metrics.observe("queuectl_txn_seconds", time.perf_counter() - t1, op=op)
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+
 def dict_from_row(row: sqlite3.Row):
     return {k: row[k] for k in row.keys()}
@@ -1,15 +1,183 @@
 
 from __future__ import annotations
-import subprocess
-from typing import Tuple
+import os, signal, subprocess, threading, time
+from functools import partial
+from pathlib import Path
+from typing import List, Optional, Tuple
 
-def run_command(cmd: str, timeout: int) -> Tuple[int, str, str]:
+from . import metrics
+from .logstore import follow_marker
+
+CHUNK = 64 * 1024
+LIVE_MAX_BYTES = 8 * 1024 * 1024
+FOLLOW_CHECK_S = 0.2
+KILL_GRACE_S = 2.0
+
+class HeadTail:
+    """Bounded capture: the first `head` and last `tail` bytes of a stream."""
+
+    def __init__(self, head: int, tail: int):
+        self.head_max, self.tail_max = head, tail
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        room = self.head_max - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk and self.tail_max:
+            self.tail += chunk[-self.tail_max:]
+            if len(self.tail) > self.tail_max:
+                del self.tail[:len(self.tail) - self.tail_max]
+
+    def getvalue(self) -> bytes:
+        omitted = self.total - len(self.head) - len(self.tail)
+        if omitted <= 0:
+            return bytes(self.head + self.tail)
+        return bytes(self.head) + f"\n... [{omitted} bytes omitted] ...\n".encode() + bytes(self.tail)
+
+class _LiveSpool:
+    """Tee of both streams for `logs --follow`, written only once a follower
+    has asked for it: until follow_marker(path) shows up (looked for at
+    most every FOLLOW_CHECK_S) output goes to the HeadTail buffers alone.
+    The file then starts with what those hold and is truncated to empty
+    whenever it would pass LIVE_MAX_BYTES, so it stays bounded too."""
+
+    def __init__(self, path: Path, out: HeadTail, err: HeadTail):
+        self.path, self.marker = path, follow_marker(path)
+        self.bufs = (out, err)
+        self.fh = None
+        self.closed = False
+        self.next_check = 0.0
+        self.lock = threading.Lock()
+
+    def write(self, buf: HeadTail, chunk: bytes) -> None:
+        # Buffer under the lock too, so the snapshot taken on attach holds
+        # exactly the chunks that are not teed.
+        with self.lock:
+            buf.write(chunk)
+            if self.closed:
+                return
+            if self.fh is None:
+                now = time.monotonic()
+                if now < self.next_check:
+                    return
+                self.next_check = now + FOLLOW_CHECK_S
+                if not self.marker.exists():
+                    return
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.fh = open(self.path, "wb")
+                chunk = b"".join(b.getvalue() for b in self.bufs)
+            if self.fh.tell() + len(chunk) > LIVE_MAX_BYTES:
+                self.fh.seek(0)
+                self.fh.truncate()
+            self.fh.write(chunk)
+            self.fh.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            if self.fh:
+                self.fh.close()
+        for p in (self.path, self.marker):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+
+def _pump(pipe, buf: HeadTail, live: Optional[_LiveSpool]) -> None:
+    write = partial(live.write, buf) if live else buf.write
+    with pipe:
+        for chunk in iter(lambda: pipe.read1(CHUNK), b""):
+            write(chunk)
+
+def _limited(args: List[str], cpu_seconds: Optional[int], memory_mb: Optional[int]) -> List[str]:
+    """args behind a /bin/sh shim that sets the rlimits with `ulimit` and
+    then execs them. preexec_fn could do it in fewer processes but is not
+    safe in a worker that runs threads."""
+    steps = []
+    if cpu_seconds:
+        steps.append(f"ulimit -t {int(cpu_seconds)}")
+    if memory_mb:
+        steps.append(f"ulimit -v {int(memory_mb) * 1024}")
+    return ["/bin/sh", "-c", " && ".join(steps) + ' && exec "$@"', "sh", *args]
+
+def _kill_tree(proc: subprocess.Popen) -> None:
+    """Kill the job's whole process group, not just the shell."""
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/PID", str(proc.pid), "/T", "/F"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=KILL_GRACE_S)
+        except subprocess.TimeoutExpired:
+            pass
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def run_command(cmd: str, timeout: int, head_bytes: int = 32768, tail_bytes: int = 32768,
+                live_path: Optional[Path] = None, argv: Optional[List[str]] = None,
+                cpu_seconds: Optional[int] = None, memory_mb: Optional[int] = None) -> Tuple[int, bytes, bytes]:
+    """Run cmd through the shell (or argv directly, skipping /bin/sh),
+    reading its pipes incrementally.
+
+    The job gets its own process group. One deadline covers both waiting
+    for the command and draining its pipes; when it passes, in either
+    phase, the whole group is killed. cpu_seconds / memory_mb become
+    RLIMIT_CPU / RLIMIT_AS, set by a /bin/sh shim before the command is
+    exec'd (POSIX only). Only head_bytes + tail_bytes of each stream are
+    kept in memory, and output stays as bytes; callers decode when it is
+    shown. With live_path, output is also teed to that file while the job
+    runs and someone follows it."""
+    out, err = HeadTail(head_bytes, tail_bytes), HeadTail(head_bytes, tail_bytes)
+    live = None
+    t0 = time.perf_counter()
     try:
-        proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
-        return proc.returncode, proc.stdout or "", proc.stderr or ""
-    except subprocess.TimeoutExpired as e:
-        return 124, e.stdout or "", (e.stderr or "") + "\nTIMEOUT"
+        live = _LiveSpool(live_path, out, err) if live_path else None
+        args, shell = (argv, False) if argv else (cmd, True)
+        if os.name == "nt":
+            group = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {"start_new_session": True}
+            if cpu_seconds or memory_mb:
+                args, shell = _limited(argv or ["/bin/sh", "-c", cmd], cpu_seconds, memory_mb), False
+        proc = subprocess.Popen(args, shell=shell, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, **group)
+        readers = [threading.Thread(target=_pump, args=(proc.stdout, out, live), daemon=True),
+                   threading.Thread(target=_pump, args=(proc.stderr, err, live), daemon=True)]
+        for t in readers:
+            t.start()
+        deadline = time.monotonic() + timeout
+        try:
+            code = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            code = None
+        for t in readers:
+            # A background child can hold the pipes after the job's own
+            # process exits; draining them shares the job's deadline.
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+        timed_out = code is None or any(t.is_alive() for t in readers)
+        if timed_out:
+            _kill_tree(proc)
+            proc.wait()
+            code = 124
+            for t in readers:
+                # Anything that escaped the process group may still hold the pipes.
+                t.join(timeout=1.0)
+            err.write(b"\nTIMEOUT")
+            metrics.inc("queuectl_job_timeouts_total", kind="shell")
+        return code, out.getvalue(), err.getvalue()
     except FileNotFoundError as e:
-        return 127, "", str(e)
+        return 127, b"", str(e).encode()
     except Exception as e:
-        return 1, "", str(e)
+        return 1, b"", str(e).encode()
+    finally:
+        metrics.observe("queuectl_exec_seconds", time.perf_counter() - t0, kind="shell")
+        if live:
+            live.close()
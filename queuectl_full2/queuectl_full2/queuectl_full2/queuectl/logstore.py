@@ -0,0 +1,126 @@
+
+"""Append-only compressed segment files for job output.
+
+Job output is kept out of SQLite: every stream is compressed as its own
+frame (a gzip member, or a zstd frame when the optional `zstandard`
+package is installed) and appended to the current segment of the writing
+process. `job_logs` stores only (segment, offset, length), and reads map
+the segment and decompress just that range. Because frames are
+independent, a whole segment is also a valid .gz/.zst file for zcat.
+
+Segments live in `.queuectl/logs/<db name>/` next to the database, are
+named `<pid>-<unix time>-<seq>.<ext>` so concurrent workers (and a pid
+reused after a restart) never share a file, roll over at `log_segment_mb`
+and are deleted after `log_retention_days`.
+"""
+from __future__ import annotations
+import gzip, mmap, os, time
+from pathlib import Path
+from urllib.parse import quote
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import zstandard as _zstd
+except ImportError:  # optional dependency
+    _zstd = None
+
+EXT = ".zst" if _zstd else ".gz"
+
+def log_dir(db_path: str) -> Path:
+    p = Path(db_path)
+    return p.parent / ".queuectl" / "logs" / p.name
+
+def live_path(db_path: str, job_id: str) -> Path:
+    """Spool file a running job's output is teed to, for `logs --follow`."""
+    return log_dir(db_path) / "live" / f"{quote(job_id, safe='')}.live"
+
+def follow_marker(live: Path) -> Path:
+    """File `logs --follow` creates to have the worker fill `live`."""
+    return live.with_suffix(".follow")
+
+def _compress(data: bytes) -> bytes:
+    if _zstd:
+        return _zstd.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def _decompress(name: str, data: bytes) -> bytes:
+    if name.endswith(".zst"):
+        if not _zstd:
+            raise RuntimeError(f"{name} needs the 'zstandard' package to read")
+        return _zstd.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+class SegmentWriter:
+    def __init__(self, db_path: str, segment_bytes: int, retention_days: float):
+        self.db_path = db_path
+        self.dir = log_dir(db_path)
+        self.segment_bytes = segment_bytes
+        self.retention_days = retention_days
+        self._seq = 0
+        self._fh = None
+        self._name = ""
+
+    def _roll(self) -> None:
+        if self._fh:
+            self._fh.close()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        prune(self.db_path, self.retention_days)
+        self._seq += 1
+        self._name = f"{os.getpid()}-{int(time.time())}-{self._seq}{EXT}"
+        self._fh = open(self.dir / self._name, "ab")
+
+    def append(self, *chunks: bytes) -> Tuple[str, List[Tuple[int, int]]]:
+        """Write each chunk as its own compressed frame into one segment;
+        returns (segment, [(offset, length), ...])."""
+        if self._fh is None or self._fh.tell() >= self.segment_bytes:
+            self._roll()
+        spans = []
+        for data in chunks:
+            frame = _compress(data)
+            spans.append((self._fh.tell(), len(frame)))
+            self._fh.write(frame)
+        self._fh.flush()
+        return self._name, spans
+
+    def close(self) -> None:
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+_writers: Dict[Tuple[str, int], SegmentWriter] = {}
+
+def writer(db_path: str, segment_bytes: int, retention_days: float) -> SegmentWriter:
+    """Per-process writer for a database (re-created after fork)."""
+    key = (db_path, os.getpid())
+    w = _writers.get(key)
+    if w is None:
+        w = _writers[key] = SegmentWriter(db_path, segment_bytes, retention_days)
+    w.segment_bytes, w.retention_days = segment_bytes, retention_days
+    return w
+
+def read(db_path: str, segment: str, offset: int, length: int) -> Optional[bytes]:
+    """Decompress one frame, or None if its segment has been pruned."""
+    try:
+        with open(log_dir(db_path) / segment, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return _decompress(segment, m[offset:offset + length])
+    except FileNotFoundError:
+        return None
+
+def prune(db_path: str, retention_days: float) -> int:
+    """Delete segments last written more than retention_days ago."""
+    d = log_dir(db_path)
+    if not d.exists():
+        return 0
+    cutoff = time.time() - retention_days * 86400
+    removed = 0
+    for seg in d.iterdir():
+        if not seg.is_file():
+            continue
+        try:
+            if seg.stat().st_mtime < cutoff:
+                seg.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
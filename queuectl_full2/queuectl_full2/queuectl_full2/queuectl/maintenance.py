@@ -0,0 +1,124 @@
+
+"""Retention: archive and remove finished jobs, then give the space back.
+
+Finished jobs older than the TTL are copied, chunk by chunk, into one
+SQLite archive per day under `.queuectl/archive/<db name>/`, and only
+then deleted from the live database (their job_logs go with them via ON
+DELETE CASCADE). Every chunk is its own short write transaction, so
+workers are never locked out for long. Afterwards the WAL is checkpointed
+and free pages are returned with incremental vacuum.
+"""
+from __future__ import annotations
+import sqlite3
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from .config import snapshot
+from .db import write_txn, dict_from_row
+from .repo import _hydrate_log
+from .utils import utc_now, to_iso
+from . import logstore
+
+VACUUM_STEP_PAGES = 1000
+
+def archive_dir(db_path: str) -> Path:
+    p = Path(db_path)
+    return p.parent / ".queuectl" / "archive" / p.name
+
+def _open_archive(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY, command TEXT, state TEXT, attempts INTEGER, max_retries INTEGER,
+        created_at TEXT, updated_at TEXT, run_at TEXT, priority INTEGER, last_error TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS job_logs (
+        id INTEGER PRIMARY KEY, job_id TEXT, created_at TEXT, exit_code INTEGER,
+        stdout TEXT, stderr TEXT)""")
+    return conn
+
+def archive_finished(conn: sqlite3.Connection, ttl_days: float, states: Iterable[str] = ("completed",),
+                     chunk_size: int = 500, dest: Optional[Path] = None, archive: bool = True) -> int:
+    """Move jobs in `states` last updated more than ttl_days ago out of the
+    live DB. Returns the number of jobs removed."""
+    cutoff = to_iso(utc_now() - timedelta(days=ttl_days))
+    dest = dest or archive_dir(conn.path)
+    archives: Dict[str, sqlite3.Connection] = {}
+    removed = 0
+    try:
+        for state in states:
+            while True:
+                jobs = [dict_from_row(r) for r in conn.execute("""
+                    SELECT * FROM jobs WHERE state=? AND updated_at < ?
+                     ORDER BY updated_at, id LIMIT ?
+                """, (state, cutoff, chunk_size))]
+                if not jobs:
+                    break
+                ids = [j["id"] for j in jobs]
+                marks = ",".join("?" * len(ids))
+                if archive:
+                    logs = [_hydrate_log(conn, dict_from_row(r)) for r in conn.execute(
+                        f"SELECT * FROM job_logs WHERE job_id IN ({marks})", ids)]
+                    _write_archive(archives, dest, jobs, logs)
+                # Archive rows are committed first; replaying a chunk after a
+                # crash just overwrites them. The chunk was read outside this
+                # transaction, so recheck: a job retried (or requeued) since
+                # stays, and its archive copy is replaced if it finishes again.
+                with write_txn(conn):
+                    removed += conn.execute(f"""
+                        DELETE FROM jobs WHERE id IN ({marks}) AND state=? AND updated_at < ?
+                    """, (*ids, state, cutoff)).rowcount
+    finally:
+        for a in archives.values():
+            a.close()
+    return removed
+
+def _write_archive(archives: Dict[str, sqlite3.Connection], dest: Path, jobs, logs) -> None:
+    by_day: Dict[str, list] = {}
+    for j in jobs:
+        by_day.setdefault(j["updated_at"][:10], []).append(j)
+    day_of = {j["id"]: j["updated_at"][:10] for j in jobs}
+    for day, day_jobs in by_day.items():
+        a = archives.get(day)
+        if a is None:
+            a = archives[day] = _open_archive(dest / f"jobs-{day}.db")
+        a.execute("BEGIN IMMEDIATE;")
+        try:
+            a.executemany("INSERT OR REPLACE INTO jobs VALUES(?,?,?,?,?,?,?,?,?,?)", [
+                (j["id"], j["command"], j["state"], j["attempts"], j["max_retries"], j["created_at"],
+                 j["updated_at"], j["run_at"], j["priority"], j["last_error"]) for j in day_jobs])
+            a.executemany("INSERT OR REPLACE INTO job_logs VALUES(?,?,?,?,?,?)", [
+                (l["id"], l["job_id"], l["created_at"], l["exit_code"], l["stdout"], l["stderr"])
+                for l in logs if day_of[l["job_id"]] == day])
+            a.execute("COMMIT;")
+        except BaseException:
+            a.execute("ROLLBACK;")
+            raise
+
+def compact(conn: sqlite3.Connection, full_vacuum: bool = False) -> int:
+    """Checkpoint the WAL and hand free pages back to the filesystem.
+    Returns pages released."""
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+    before = conn.execute("PRAGMA page_count;").fetchone()[0]
+    if full_vacuum:
+        # One-off rewrite; also switches databases created before
+        # auto_vacuum was enabled to incremental mode.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("VACUUM;")
+    elif conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2:  # INCREMENTAL
+        # Small steps, each its own transaction, so writers can get in between.
+        while conn.execute("PRAGMA freelist_count;").fetchone()[0]:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});").fetchall()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+    return before - conn.execute("PRAGMA page_count;").fetchone()[0]
+
+def run_maintenance(conn: sqlite3.Connection, ttl_days: Optional[float] = None, include_dead: bool = False,
+                    archive: bool = True, dest: Optional[Path] = None, full_vacuum: bool = False) -> Dict[str, int]:
+    cfg = snapshot(conn)
+    ttl = float(ttl_days if ttl_days is not None else cfg.get_float("job_retention_days"))
+    states = ("completed", "dead") if include_dead else ("completed",)
+    removed = archive_finished(conn, ttl, states, cfg.get_int("gc_chunk_size"), dest, archive)
+    pruned = logstore.prune(conn.path, cfg.get_float("log_retention_days"))
+    pages = compact(conn, full_vacuum)
+    return {"removed": removed, "segments_pruned": pruned, "pages_released": pages}
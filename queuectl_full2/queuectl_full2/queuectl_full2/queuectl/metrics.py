@@ -0,0 +1,196 @@
+
+"""Counters and latency histograms for the hot paths.
+
+Recording is a dict lookup, a bisect and a few adds under one lock, so it
+is cheap enough to leave on in the claim and commit paths. Each process
+keeps its own registry. Workers dump theirs as JSON to
+`.queuectl/metrics/<db name>/<pid>.json` next to the database every
+DUMP_INTERVAL_S; `collect()` merges the files of live workers, the
+controller writes the merge as Prometheus text to
+`.queuectl/metrics/<db name>.prom` (for a node_exporter textfile
+collector), and `queuectl stats` shows it.
+
+Series names follow Prometheus conventions: `*_seconds` histograms and
+`*_total` counters, with labels folded into the key (`name{op="complete"}`).
+"""
+from __future__ import annotations
+import bisect, json, math, os, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DUMP_INTERVAL_S = 5.0
+# Seconds. Claims and commits land in the sub-millisecond buckets, job
+# runtimes and queue waits in the upper ones.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, math.inf)
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, dict] = {}
+
+    def inc(self, name: str, n: float = 1, **labels: str) -> None:
+        key = _series(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = _series(name, labels)
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            h["buckets"][i] += 1
+            h["sum"] += seconds
+            h["count"] += 1
+
+    @contextmanager
+    def timed(self, name: str, **labels: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "histograms": {k: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                                   for k, h in self.histograms.items()}}
+
+    def clear(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+REGISTRY = Registry()
+inc, observe, timed = REGISTRY.inc, REGISTRY.observe, REGISTRY.timed
+
+def _series(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+def metrics_dir(db_path: str) -> Path:
+    p = Path(db_path)
+    return p.parent / ".queuectl" / "metrics" / p.name
+
+def dump(db_path: str, registry: Registry = REGISTRY) -> None:
+    """Atomically replace this process's metrics file."""
+    d = metrics_dir(db_path)
+    d.mkdir(parents=True, exist_ok=True)
+    target = d / f"{os.getpid()}.json"
+    tmp = target.with_suffix(".tmp")
+    tmp.write_text(json.dumps(registry.snapshot()))
+    os.replace(tmp, target)
+
+def remove(db_path: str) -> None:
+    try:
+        (metrics_dir(db_path) / f"{os.getpid()}.json").unlink()
+    except FileNotFoundError:
+        pass
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+def collect(db_path: str) -> dict:
+    """Sum the dumps of all live workers; files of dead ones are removed."""
+    merged = Registry()
+    d = metrics_dir(db_path)
+    try:
+        names = os.listdir(d)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        path = d / name
+        if not name[:-5].isdigit() or not _alive(int(name[:-5])):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            snap = json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        for key, v in snap["counters"].items():
+            merged.counters[key] = merged.counters.get(key, 0) + v
+        for key, h in snap["histograms"].items():
+            m = merged.histograms.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            m["buckets"] = [a + b for a, b in zip(m["buckets"], h["buckets"])]
+            m["sum"] += h["sum"]
+            m["count"] += h["count"]
+    return merged.snapshot()
+
+def quantile(h: dict, q: float) -> Optional[float]:
+    """Estimate from bucket counts, interpolating linearly inside the
+    bucket (as Prometheus' histogram_quantile does)."""
+    if not h["count"]:
+        return None
+    rank = q * h["count"]
+    seen = 0
+    for i, n in enumerate(h["buckets"]):
+        if n and seen + n >= rank:
+            lo = BUCKETS[i - 1] if i else 0.0
+            hi = BUCKETS[i]
+            if math.isinf(hi):
+                return lo
+            return lo + (hi - lo) * (rank - seen) / n
+        seen += n
+    return BUCKETS[-2]
+
+def summary(snap: dict) -> List[dict]:
+    """One row per series: counters as value, histograms as count/mean/p50/p95/p99."""
+    rows = [{"series": k, "value": v} for k, v in sorted(snap["counters"].items())]
+    for k, h in sorted(snap["histograms"].items()):
+        rows.append({"series": k, "count": h["count"],
+                     "mean": h["sum"] / h["count"] if h["count"] else None,
+                     "p50": quantile(h, 0.5), "p95": quantile(h, 0.95), "p99": quantile(h, 0.99)})
+    return rows
+
+def render(snap: dict) -> str:
+    """Prometheus text exposition format."""
+    lines: List[str] = []
+    typed = set()
+    def header(key: str, kind: str) -> Tuple[str, str]:
+        name, _, labels = key.partition("{")
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+        return name, labels.rstrip("}")
+    for key, v in sorted(snap["counters"].items()):
+        header(key, "counter")
+        lines.append(f"{key} {v:g}")
+    for key, h in sorted(snap["histograms"].items()):
+        name, labels = header(key, "histogram")
+        sep = "," if labels else ""
+        cumulative = 0
+        for le, n in zip(BUCKETS, h["buckets"]):
+            cumulative += n
+            bound = "+Inf" if math.isinf(le) else f"{le:g}"
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {h['sum']:.6f}")
+        lines.append(f"{name}_count{suffix} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+def write_prom(db_path: str) -> Path:
+    """Merge the workers' dumps into `<db name>.prom` next to their directory."""
+    d = metrics_dir(db_path)
+    d.parent.mkdir(parents=True, exist_ok=True)
+    target = d.parent / f"{d.name}.prom"
+    tmp = d.parent / f"{d.name}.prom.tmp"
+    tmp.write_text(render(collect(db_path)))
+    os.replace(tmp, target)
+    return target
@@ -0,0 +1,106 @@
+
+"""Local wakeup channel between producers and idle workers.
+
+Each worker binds a Unix datagram socket in `.queuectl/wake/<db name>/`
+next to the database; `wake()` sends one byte to every socket there.
+Datagrams are fire-and-forget, so a producer never blocks on a busy or
+dead worker. Where AF_UNIX is unavailable (or the path is too long to
+bind) workers simply fall back to polling.
+"""
+from __future__ import annotations
+import os, socket, threading
+from pathlib import Path
+from typing import Optional
+
+_MAX_SUN_PATH = 100
+
+def wake_dir(db_path: str) -> Path:
+    p = Path(db_path)
+    return p.parent / ".queuectl" / "wake" / p.name
+
+def wake(db_path: Optional[str]) -> None:
+    if not db_path or not hasattr(socket, "AF_UNIX"):
+        return
+    d = wake_dir(db_path)
+    try:
+        names = os.listdir(d)
+    except FileNotFoundError:
+        return
+    if not names:
+        return
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    s.setblocking(False)
+    try:
+        for name in names:
+            target = d / name
+            try:
+                s.sendto(b"!", str(target))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker died without cleaning up.
+                try:
+                    target.unlink()
+                except FileNotFoundError:
+                    pass
+            except OSError:
+                # Receive buffer full: that worker is already awake.
+                pass
+    finally:
+        s.close()
+
+class Listener:
+    """Background receiver that sets `event` whenever a wakeup arrives."""
+
+    def __init__(self, db_path: str, event: threading.Event):
+        self.event = event
+        self.path = wake_dir(db_path) / f"{os.getpid()}.sock"
+        self._woken = False
+        self._sock = None
+        if not hasattr(socket, "AF_UNIX") or len(str(self.path)) > _MAX_SUN_PATH:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(str(self.path))
+        except OSError:
+            return
+        self._sock = sock
+        threading.Thread(target=self._run, name="wake", daemon=True).start()
+
+    @property
+    def available(self) -> bool:
+        return self._sock is not None
+
+    def _run(self) -> None:
+        sock = self._sock
+        while True:
+            try:
+                data = sock.recv(64)
+            except OSError:
+                return
+            if not data:
+                return
+            self._woken = True
+            self.event.set()
+
+    def take(self) -> bool:
+        """True if a wakeup arrived since the last call."""
+        woken, self._woken = self._woken, False
+        return woken
+
+    def close(self) -> None:
+        if self._sock is None:
+            return
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._sock = None
@@ -0,0 +1,144 @@
+
+"""Warm interpreter pool for `kind: "python"` jobs.
+
+A python job names a callable (`pkg.mod:func`) instead of a shell command.
+Workers run these in a multiprocessing pool whose processes are forked
+from a forkserver that has already imported `python_preload`, so dispatch
+costs a pickle round-trip instead of an interpreter start. Each pool
+process is replaced after `python_max_tasks` jobs to bound leaks.
+
+Inside the pool process print() output is captured into the same bounded
+head/tail buffers shell jobs use; a non-None return value is written to
+stdout as JSON. The job timeout is enforced with an interval timer in the
+pool process; a job stuck in C code past it takes the pool down with it.
+"""
+from __future__ import annotations
+import importlib, io, json, multiprocessing, signal, sys, threading, time, traceback
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .exec import HeadTail
+from . import metrics
+
+HARD_TIMEOUT_GRACE_S = 5.0
+
+class JobTimeout(BaseException):
+    """Raised by the timer; BaseException so `except Exception` in job
+    code cannot swallow it."""
+
+def resolve(spec: str):
+    module, _, attr = spec.partition(":")
+    if not module or not attr:
+        raise ValueError(f"callable must look like 'pkg.mod:func', got {spec!r}")
+    obj = importlib.import_module(module)
+    for part in attr.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+def _preload(modules: List[str]) -> None:
+    for name in modules:
+        importlib.import_module(name)
+
+class _Sink(io.TextIOBase):
+    def __init__(self, buf: HeadTail):
+        self.buf = buf
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        self.buf.write(s.encode("utf-8", "replace"))
+        return len(s)
+
+def _on_timer(signum, frame):
+    raise JobTimeout()
+
+def _call(spec: str, args: List[Any], kwargs: Dict[str, Any], timeout: int,
+          head: int, tail: int) -> Tuple[int, bytes, bytes]:
+    """Runs in the pool process."""
+    out, err = HeadTail(head, tail), HeadTail(head, tail)
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _Sink(out), _Sink(err)
+    timer = hasattr(signal, "setitimer")
+    if timer:
+        previous = signal.signal(signal.SIGALRM, _on_timer)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    code = 0
+    try:
+        result = resolve(spec)(*args, **kwargs)
+        if result is not None:
+            print(json.dumps(result, default=repr))
+    except JobTimeout:
+        code = 124
+        err.write(b"\nTIMEOUT")
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        code = 1
+        err.write(traceback.format_exc().encode())
+    finally:
+        if timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+        sys.stdout, sys.stderr = saved
+    return code, out.getvalue(), err.getvalue()
+
+class PythonPool:
+    """Started on the first python job, so shell-only workers never pay for it."""
+
+    def __init__(self, processes: int, preload: Iterable[str] = (), max_tasks: int = 0):
+        self.processes = processes
+        self.preload = [m for m in preload if m]
+        self.max_tasks = max_tasks or None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        with self._lock:
+            if self._pool is None:
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                ctx = multiprocessing.get_context(method)
+                if method == "forkserver":
+                    ctx.set_forkserver_preload(self.preload)
+                self._pool = ctx.Pool(self.processes, initializer=_preload, initargs=(self.preload,),
+                                      maxtasksperchild=self.max_tasks)
+            return self._pool
+
+    def run(self, spec: str, args: List[Any], kwargs: Dict[str, Any], timeout: int,
+            head: int = 32768, tail: int = 32768) -> Tuple[int, bytes, bytes]:
+        """Same contract as exec.run_command: (exit_code, stdout, stderr)."""
+        t0 = time.perf_counter()
+        try:
+            code, out, err = self._run(spec, args, kwargs, timeout, head, tail)
+        finally:
+            metrics.observe("queuectl_exec_seconds", time.perf_counter() - t0, kind="python")
+        if code == 124:
+            metrics.inc("queuectl_job_timeouts_total", kind="python")
+        return code, out, err
+
+    def _run(self, spec, args, kwargs, timeout, head, tail) -> Tuple[int, bytes, bytes]:
+        try:
+            pool = self._ensure()
+            res = pool.apply_async(_call, (spec, args, kwargs, timeout, head, tail))
+        except Exception as e:
+            return 1, b"", str(e).encode()
+        try:
+            return res.get(timeout + HARD_TIMEOUT_GRACE_S)
+        except multiprocessing.TimeoutError:
+            # The timer could not interrupt it; the only way out is a new pool.
+            self._discard(pool)
+            return 124, b"", b"\nTIMEOUT (interpreter pool restarted)"
+        except Exception as e:
+            return 1, b"", f"{type(e).__name__}: {e}".encode()
+
+    def _discard(self, pool) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.terminate()
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
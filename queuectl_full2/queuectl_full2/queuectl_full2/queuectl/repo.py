@@ -1,13 +1,101 @@
 
 from __future__ import annotations
-import sqlite3
-from typing import Optional, List, Dict, Any
+import hashlib, json, shlex, sqlite3
+from typing import Optional, List, Dict, Any, Tuple, Set, Iterable, Iterator, Union
+from itertools import islice
 from datetime import timedelta
-from .utils import utc_now, to_iso, parse_iso, clamp_text
-from .config import get_int
-from .db import dict_from_row
+from .utils import utc_now, to_iso, to_ms, parse_iso, clamp_text, gen_id
+from .config import snapshot
+from .scheduler import plan_claims, join_pass, compute_backoff_seconds, refill_tokens
+from . import logstore, metrics
+from .db import dict_from_row, write_txn, reconcile_counts
+from .models import JOB_STATES
+from .notify import wake
 
-def enqueue(conn: sqlite3.Connection, job: Dict[str, Any]) -> None:
+_JOB_COLUMNS = ("id", "command", "state", "attempts", "max_retries", "created_at", "updated_at",
+                "run_at", "priority", "worker_id", "locked_until", "last_error",
+                "timeout", "cpu_seconds", "memory_mb", "argv", "kind", "payload", "queue", "due_ms", "concurrency_key", "pending_deps",
+                "idempotency_key", "coalesce_key")
+_COL = {name: i for i, name in enumerate(_JOB_COLUMNS)}
+_JOB_KINDS = ("shell", "python")
+
+class DuplicateJobError(ValueError):
+    """A job with this id already exists."""
+# "replace" deletes the old row first (see _drop_replaceable); a running
+# job it leaves in place is then skipped, not overwritten.
+_INSERT_VERBS = {"fail": "INSERT", "skip": "INSERT OR IGNORE", "replace": "INSERT OR IGNORE"}
+
+def _insert_sql(on_conflict: str = "fail") -> str:
+    if on_conflict not in _INSERT_VERBS:
+        raise ValueError(f"on_conflict must be one of {', '.join(_INSERT_VERBS)}")
+    return f"{_INSERT_VERBS[on_conflict]} INTO jobs({', '.join(_JOB_COLUMNS)}) VALUES({','.join('?' * len(_JOB_COLUMNS))})"
+
+def _job_row(job: Dict[str, Any], now_iso: str) -> tuple:
+    kind = job.get("kind") or "shell"
+    if kind not in _JOB_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(_JOB_KINDS)}")
+    argv, payload = job.get("argv"), job.get("payload")
+    if isinstance(argv, (list, tuple)):
+        argv = json.dumps(list(argv))
+    if kind == "python":
+        command = job.get("command") or job.get("callable")
+        if not command:
+            raise ValueError("a python job needs a callable")
+        if payload is None:
+            payload = json.dumps({"args": job.get("args") or [], "kwargs": job.get("kwargs") or {}})
+    else:
+        if not (job.get("command") or argv):
+            raise ValueError("a shell job needs a command or argv")
+        command = job.get("command") or shlex.join(json.loads(argv))
+    queue = job.get("queue") or "default"
+    run_at = job.get("run_at", now_iso)
+    # Future jobs start on the timer index; the claim promotes them when due.
+    due_ms = None if run_at <= now_iso else to_ms(parse_iso(run_at))
+    coalesce_key = _coalesce_key(queue, kind, command, argv, payload) if job.get("coalesce") else None
+    return (
+        job.get("id") or gen_id(), command, job.get("state", "pending"), job.get("attempts", 0),
+        job.get("max_retries", 3), job.get("created_at", now_iso), job.get("updated_at", now_iso),
+        run_at, job.get("priority", 0),
+        job.get("worker_id"), job.get("locked_until"), job.get("last_error"),
+        job.get("timeout"), job.get("cpu_seconds"), job.get("memory_mb"), argv, kind, payload, queue, due_ms, job.get("concurrency_key"),
+        job.get("pending_deps", 0), job.get("idempotency_key"), coalesce_key,
+    )
+
+def _coalesce_key(*what: Any) -> str:
+    return hashlib.sha1(json.dumps(what).encode()).hexdigest()
+
+def _find_duplicate(conn: sqlite3.Connection, row: tuple, window_start: str) -> Optional[str]:
+    """Id of an existing job `row` duplicates, or None. One index probe per
+    key the row carries; caller holds the write transaction."""
+    key = row[_COL["idempotency_key"]]
+    if key is not None:
+        hit = conn.execute("SELECT id, created_at FROM jobs WHERE idempotency_key=?", (key,)).fetchone()
+        if hit is not None:
+            if hit[1] >= window_start:
+                return hit[0]
+            # Outside the window the key is free again.
+            conn.execute("UPDATE jobs SET idempotency_key=NULL WHERE id=?", (hit[0],))
+    coalesce = row[_COL["coalesce_key"]]
+    if coalesce is not None:
+        hit = conn.execute("SELECT id FROM jobs WHERE coalesce_key=? AND state='pending' LIMIT 1",
+                           (coalesce,)).fetchone()
+        if hit is not None:
+            return hit[0]
+    return None
+
+def _dedup_window_start(conn: sqlite3.Connection, now) -> str:
+    return to_iso(now - timedelta(seconds=snapshot(conn).get_float("dedup_window_seconds")))
+
+def enqueue(conn: sqlite3.Connection, job: Dict[str, Any]) -> str:
+    """Insert one job and return its id.
+
+    If the job's `idempotency_key` belongs to a job created within
+    `dedup_window_seconds`, or `coalesce` is set and an identical job (same
+    queue, kind, command, argv and payload) is still pending, nothing is
+    inserted and the existing job's id is returned. A duplicate `id`
+    raises DuplicateJobError."""
+    if job.get("depends_on"):
+        return enqueue_dag(conn, [job])[0]
     now = utc_now()
     job.setdefault("state", "pending")
     job.setdefault("attempts", 0)
@@ -16,113 +104,826 @@ def enqueue(conn: sqlite3.Connection, job: Dict[str, Any]) -> None:
     job.setdefault("updated_at", to_iso(now))
     job.setdefault("run_at", to_iso(now))
     job.setdefault("priority", 0)
-    with conn:
-        conn.execute("""
-            INSERT INTO jobs(id, command, state, attempts, max_retries, created_at, updated_at, run_at, priority, worker_id, locked_until, last_error)
-            VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
-        """, (
-            job["id"], job["command"], job["state"], job["attempts"], job["max_retries"],
-            job["created_at"], job["updated_at"], job["run_at"], job["priority"],
-            job.get("worker_id"), job.get("locked_until"), job.get("last_error")
-        ))
-
-def acquire_next_job(conn: sqlite3.Connection, worker_id: str) -> Optional[Dict[str, Any]]:
+    row = _job_row(job, to_iso(now))
+    try:
+        with write_txn(conn, "enqueue"):
+            existing = _find_duplicate(conn, row, _dedup_window_start(conn, now))
+            if existing is None:
+                conn.execute(_insert_sql(), row)
+    except sqlite3.IntegrityError as e:
+        if "jobs.id" in str(e):
+            raise DuplicateJobError(f"job {row[0]} already exists") from None
+        raise
+    if existing is not None:
+        return existing
+    wake(getattr(conn, "path", None))
+    return row[0]
+
+def enqueue_many(conn: sqlite3.Connection, jobs: Iterable[Dict[str, Any]],
+                 batch_size: int = 10000, on_conflict: str = "fail") -> int:
+    """Insert jobs from any iterable in transactions of batch_size rows.
+
+    Only one batch is held in memory, so a generator over a file of any
+    size streams through. on_conflict decides what a duplicate id does:
+    "fail" raises IntegrityError (earlier batches stay committed), "skip"
+    keeps the existing job, "replace" overwrites it unless it is running
+    (a processing job is kept, with its logs and dependencies). Jobs carrying an
+    idempotency_key or coalesce are deduplicated as in enqueue. Returns the
+    number of rows written."""
+    sql = _insert_sql(on_conflict)
+    replace = on_conflict == "replace"
+    it = iter(jobs)
+    total = 0
+    while True:
+        now_iso = to_iso(utc_now())
+        rows = [_job_row(_no_deps(j), now_iso) for j in islice(it, batch_size)]
+        if not rows:
+            break
+        plain = [r for r in rows if r[_COL["idempotency_key"]] is None and r[_COL["coalesce_key"]] is None]
+        keyed = [r for r in rows if r[_COL["idempotency_key"]] is not None or r[_COL["coalesce_key"]] is not None]
+        if replace:
+            # Later rows win, as with a row-by-row replace.
+            plain = [*{r[0]: r for r in plain}.values()]
+        with write_txn(conn, "enqueue"):
+            if plain:
+                if replace:
+                    _drop_replaceable(conn, [r[0] for r in plain])
+                total += conn.executemany(sql, plain).rowcount
+            window_start = _dedup_window_start(conn, parse_iso(now_iso))
+            for r in keyed:
+                if _find_duplicate(conn, r, window_start) is None:
+                    if replace:
+                        _drop_replaceable(conn, [r[0]])
+                    total += conn.execute(sql, r).rowcount
+        wake(getattr(conn, "path", None))
+    return total
+
+def _drop_replaceable(conn: sqlite3.Connection, ids: List[str]) -> None:
+    """Delete the jobs among ids that are not running, so they can be
+    inserted afresh; their logs and edges go with them."""
+    conn.execute("DELETE FROM jobs WHERE id IN (SELECT value FROM json_each(?)) AND state != 'processing'",
+                 (json.dumps(ids),))
+
+def _no_deps(job: Dict[str, Any]) -> Dict[str, Any]:
+    if job.get("depends_on"):
+        raise ValueError(f"job {job.get('id')} has depends_on; submit workflows with enqueue_dag")
+    return job
+
+def enqueue_dag(conn: sqlite3.Connection, jobs: List[Dict[str, Any]]) -> List[str]:
+    """Insert a workflow in one transaction. Each job may list `depends_on`
+    ids, either of jobs in this batch or of existing jobs; it becomes
+    claimable once all of them have completed. Rejects unknown or dead
+    dependencies and cycles; a duplicate `id` raises DuplicateJobError.
+    Jobs are deduplicated as in enqueue: a duplicate is not inserted, its
+    id is replaced by the existing job's in the result and in the
+    dependencies of the rest of the workflow. Returns the ids in
+    submission order."""
     now = utc_now()
-    lease_seconds = get_int(conn, "lease_seconds")
-    locked_until = to_iso(now + timedelta(seconds=lease_seconds))
-    with conn:
-        row = conn.execute("""
-            SELECT id FROM jobs
-            WHERE state IN ('pending','failed')
-              AND run_at <= ?
-              AND (locked_until IS NULL OR locked_until <= ?)
-            ORDER BY priority DESC, created_at ASC
-            LIMIT 1
-        """, (to_iso(now), to_iso(now))).fetchone()
-        if not row:
-            return None
-        job_id = row["id"]
-        conn.execute("""
+    now_iso = to_iso(now)
+    for j in jobs:
+        j.setdefault("id", gen_id())
+    ids = [j["id"] for j in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError("duplicate job id in workflow")
+    _check_acyclic(jobs)
+    try:
+        with write_txn(conn, "enqueue"):
+            alias = _dedup_batch(conn, jobs, now_iso, _dedup_window_start(conn, now))
+            fresh = [j for j in jobs if j["id"] not in alias]
+            batch = {j["id"] for j in fresh}
+            deps_of = {j["id"]: sorted({alias.get(d, d) for d in j.get("depends_on") or []}) for j in fresh}
+            external = sorted({d for deps in deps_of.values() for d in deps if d not in batch})
+            states = {}
+            for chunk in range(0, len(external), 500):
+                part = external[chunk:chunk + 500]
+                states.update(conn.execute(
+                    f"SELECT id, state FROM jobs WHERE id IN ({','.join('?' * len(part))})", part).fetchall())
+            for d in external:
+                if d not in states:
+                    raise ValueError(f"unknown dependency {d}")
+                if states[d] == "dead":
+                    raise ValueError(f"dependency {d} is dead")
+            rows, edges = [], []
+            for j in fresh:
+                deps = deps_of[j["id"]]
+                j["pending_deps"] = sum(1 for d in deps if d in batch or states[d] != "completed")
+                edges.extend((d, j["id"]) for d in deps)
+                rows.append(_job_row(j, now_iso))
+            conn.executemany(_insert_sql(), rows)
+            conn.executemany("INSERT INTO job_deps(depends_on, job_id) VALUES(?,?)", edges)
+    except sqlite3.IntegrityError as e:
+        if "jobs.id" in str(e):
+            taken = next((i for i in ids if conn.execute("SELECT 1 FROM jobs WHERE id=?", (i,)).fetchone()), None)
+            raise DuplicateJobError(f"job {taken} already exists") from None
+        raise
+    if len(alias) < len(jobs):
+        wake(getattr(conn, "path", None))
+    return [alias.get(i, i) for i in ids]
+
+def _dedup_batch(conn: sqlite3.Connection, jobs: List[Dict[str, Any]], now_iso: str,
+                 window_start: str) -> Dict[str, str]:
+    """{id: existing id} for the jobs of a workflow that duplicate a stored
+    job, or an earlier job of the same workflow."""
+    alias: Dict[str, str] = {}
+    taken: Dict[Tuple[str, str], str] = {}
+    for j in jobs:
+        row = _job_row(j, now_iso)
+        keys = [(c, row[_COL[c]]) for c in ("idempotency_key", "coalesce_key") if row[_COL[c]] is not None]
+        if not keys:
+            continue
+        existing = next((taken[k] for k in keys if k in taken), None) or _find_duplicate(conn, row, window_start)
+        if existing is not None:
+            alias[j["id"]] = existing
+        else:
+            taken.update((k, j["id"]) for k in keys)
+    return alias
+
+def _check_acyclic(jobs: List[Dict[str, Any]]) -> None:
+    """Kahn's algorithm over the in-batch edges."""
+    batch = {j["id"] for j in jobs}
+    indeg = {j["id"]: 0 for j in jobs}
+    children: Dict[str, List[str]] = {}
+    for j in jobs:
+        for d in set(j.get("depends_on") or []):
+            if d in batch:
+                indeg[j["id"]] += 1
+                children.setdefault(d, []).append(j["id"])
+    ready = [i for i, n in indeg.items() if n == 0]
+    seen = 0
+    while ready:
+        node = ready.pop()
+        seen += 1
+        for c in children.get(node, ()):
+            indeg[c] -= 1
+            if indeg[c] == 0:
+                ready.append(c)
+    if seen != len(jobs):
+        raise ValueError("workflow has a dependency cycle")
+
+def acquire_next_job(conn: sqlite3.Connection, worker_id: str,
+                     queues: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    jobs = acquire_batch(conn, worker_id, 1, queues)
+    return jobs[0] if jobs else None
+
+_READY = "state IN ('pending','failed') AND due_ms IS NULL AND pending_deps = 0"
+
+# Jobs whose concurrency_key has no rate_limits row (limited = 0) claim
+# exactly like unkeyed ones; only limited keys are looked at one by one.
+_CLAIM_OPEN = f"""
+    UPDATE jobs
+       SET state='processing', worker_id=?, locked_until=?, updated_at=?
+     WHERE id IN (
+        SELECT id FROM jobs
+         WHERE {_READY} AND limited = 0 AND queue=?
+         ORDER BY priority DESC, created_at ASC
+         LIMIT ?)
+    RETURNING *
+"""
+
+_OPEN_HEADS = f"""
+    SELECT id, priority, created_at, NULL FROM jobs
+     WHERE {_READY} AND limited = 0 AND queue=?
+     ORDER BY priority DESC, created_at ASC LIMIT ?
+"""
+
+_KEY_HEADS = f"""
+    SELECT id, priority, created_at, concurrency_key FROM jobs
+     WHERE {_READY} AND limited = 1 AND queue=? AND concurrency_key=?
+     ORDER BY priority DESC, created_at ASC LIMIT ?
+"""
+
+# Loose index scans: one index seek per distinct queue (or limited key
+# within a queue) with ready rows. INDEXED BY because the planner would
+# otherwise pick a state index and sort.
+_RUNNABLE_QUEUES = f"""
+    WITH RECURSIVE q(name) AS (
+        SELECT ''
+        UNION ALL
+        SELECT (SELECT queue FROM jobs INDEXED BY {{index}}
+                 WHERE {_READY} AND limited = {{limited}} AND queue > q.name
+                 ORDER BY queue LIMIT 1)
+          FROM q WHERE q.name IS NOT NULL)
+    SELECT name FROM q WHERE name IS NOT NULL AND name <> ''
+"""
+
+_READY_INDEXES = (("idx_jobs_ready_open", 0), ("idx_jobs_ready_limited", 1))
+
+_QUEUE_READY = f"""
+    SELECT 1 FROM jobs INDEXED BY idx_jobs_ready_open WHERE {_READY} AND limited = 0 AND queue=?
+    UNION ALL
+    SELECT 1 FROM jobs INDEXED BY idx_jobs_ready_limited WHERE {_READY} AND limited = 1 AND queue=?
+    LIMIT 1
+"""
+
+_READY_KEYS = f"""
+    WITH RECURSIVE k(key) AS (
+        SELECT ''
+        UNION ALL
+        SELECT (SELECT concurrency_key FROM jobs INDEXED BY idx_jobs_ready_limited
+                 WHERE {_READY} AND limited = 1 AND queue=? AND concurrency_key > k.key
+                 ORDER BY concurrency_key LIMIT 1)
+          FROM k WHERE k.key IS NOT NULL)
+    SELECT key FROM k WHERE key IS NOT NULL AND key <> ''
+"""
+
+def acquire_batch(conn: sqlite3.Connection, worker_id: str, n: int,
+                  queues: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Lease up to n runnable jobs to worker_id in one write transaction,
+    shared across `queues` (default: all) by weighted fair share. Within
+    a queue jobs go in priority DESC, created_at ASC order, skipping jobs
+    whose concurrency_key is at its concurrency cap or out of tokens."""
+    now = utc_now()
+    now_iso = to_iso(now)
+    lease = (worker_id, _lease_until(now, snapshot(conn).get_int("lease_seconds")), now_iso)
+    jobs: List[Dict[str, Any]] = []
+    with write_txn(conn, "claim"):
+        _reclaim_expired(conn, now_iso)
+        _promote_due(conn, to_ms(now))
+        state = _queue_state(conn, queues)
+        served = dict(state)
+        limits: Dict[str, dict] = {}
+        while n > 0 and state:
+            plan = plan_claims(state, n)
+            if not plan:
+                break
+            for name, want in plan.items():
+                rows = _claim_from_queue(conn, name, want, limits, lease, to_ms(now))
+                jobs.extend(rows)
+                n -= len(rows)
+                q = state[name]
+                q["pass"] += len(rows) / q["weight"]
+                if q["room"] is not None:
+                    q["room"] -= len(rows)
+                if len(rows) < want:
+                    # Nothing more is claimable here right now.
+                    del state[name]
+                    if not rows:
+                        q["pass"] = None
+        if len(served) > 1:
+            # A lone queue has nobody to be fair to; skip the write.
+            conn.executemany("UPDATE queues SET pass=? WHERE name=?",
+                             [(q["pass"], name) for name, q in served.items()])
+        conn.executemany("UPDATE rate_limits SET tokens=?, refilled_ms=? WHERE key=?",
+                         [(l["tokens"], to_ms(now), key) for key, l in limits.items() if l.get("debited")])
+    jobs.sort(key=lambda j: (-j["priority"], j["created_at"]))
+    if jobs:
+        metrics.inc("queuectl_jobs_claimed_total", len(jobs))
+        # Time since the job became runnable: created_at, or the scheduled /
+        # retry time for delayed jobs (second resolution).
+        now_s = now.timestamp()
+        for j in jobs:
+            metrics.observe("queuectl_queue_wait_seconds", max(0.0, now_s - parse_iso(j["run_at"]).timestamp()))
+    return jobs
+
+def _claim_from_queue(conn: sqlite3.Connection, queue: str, want: int,
+                      limits: Dict[str, dict], lease: tuple, now_ms: int) -> List[Dict[str, Any]]:
+    keys = [r[0] for r in conn.execute(_READY_KEYS, (queue,))]
+    if not keys:
+        # Fast path: no limited key is ready, one ordered index scan.
+        return [dict_from_row(r) for r in conn.execute(_CLAIM_OPEN, (*lease, queue, want)).fetchall()]
+    limits.update(_key_limits(conn, [k for k in keys if k not in limits], now_ms))
+    # Merge the open head with the head of every limited key that has
+    # room; saturated keys cost the one seek that found them.
+    cands = conn.execute(_OPEN_HEADS, (queue, want)).fetchall()
+    for key in keys:
+        room = limits[key]["room"] if key in limits else None
+        if room != 0:
+            cands += conn.execute(_KEY_HEADS, (queue, key, want if room is None else min(want, room))).fetchall()
+    cands.sort(key=lambda r: (-r[1], r[2]))
+    picked: List[str] = []
+    taken: Dict[str, int] = {}
+    for job_id, _priority, _created, key in cands:
+        if len(picked) == want:
+            break
+        if key is not None:
+            room = limits[key]["room"] if key in limits else None
+            if room is not None and taken.get(key, 0) >= room:
+                continue
+            taken[key] = taken.get(key, 0) + 1
+        picked.append(job_id)
+    for key, k in taken.items():
+        if key in limits:
+            _debit(limits[key], k)
+    if not picked:
+        return []
+    rows = conn.execute(f"""
+        UPDATE jobs SET state='processing', worker_id=?, locked_until=?, updated_at=?
+         WHERE id IN ({','.join('?' * len(picked))})
+        RETURNING *
+    """, (*lease, *picked)).fetchall()
+    return [dict_from_row(r) for r in rows]
+
+def _key_limits(conn: sqlite3.Connection, keys: List[str], now_ms: int) -> Dict[str, dict]:
+    """rate_limits rows of `keys` with `room`: jobs the key may start now
+    (None = unlimited), the smaller of its free concurrency and whole tokens."""
+    if not keys:
+        return {}
+    limits = {r["key"]: dict_from_row(r) for r in conn.execute(
+        "SELECT * FROM rate_limits WHERE key IN (SELECT value FROM json_each(?))", (json.dumps(keys),))}
+    capped = [k for k, l in limits.items() if l["max_concurrency"] is not None]
+    running = dict(conn.execute(
+        f"SELECT concurrency_key, COUNT(*) FROM jobs WHERE state='processing' AND concurrency_key IN "
+        f"({','.join('?' * len(capped))}) GROUP BY concurrency_key", capped).fetchall()) if capped else {}
+    for key, l in limits.items():
+        room = None
+        if l["max_concurrency"] is not None:
+            room = max(0, l["max_concurrency"] - running.get(key, 0))
+        if l["rate"]:
+            l["tokens"] = refill_tokens(l["tokens"], l["burst"], l["rate"], (now_ms - l["refilled_ms"]) / 1000.0)
+            room = int(l["tokens"]) if room is None else min(room, int(l["tokens"]))
+        l["room"] = room
+    return limits
+
+def _debit(limit: dict, n: int) -> None:
+    if limit["room"] is not None:
+        limit["room"] -= n
+    if limit["rate"]:
+        limit["tokens"] -= n
+        limit["debited"] = True
+
+def _queue_state(conn: sqlite3.Connection, queues: Optional[List[str]]) -> Dict[str, dict]:
+    """Scheduling state for the subscribed queues that hold runnable jobs;
+    queues that drained since the last claim get their pass cleared."""
+    if queues:
+        names = [q for q in queues if conn.execute(_QUEUE_READY, (q, q)).fetchone()]
+    else:
+        names = _runnable_queues(conn)
+    known = {r["name"]: r for r in conn.execute("SELECT * FROM queues")}
+    drained = [q for q, r in known.items() if r["pass"] is not None and q not in names
+               and (queues is None or q in queues)]
+    conn.executemany("UPDATE queues SET pass=NULL WHERE name=?", [(q,) for q in drained])
+    conn.executemany("INSERT INTO queues(name) VALUES(?)", [(q,) for q in names if q not in known])
+    state = {}
+    for q in names:
+        r = known.get(q)
+        state[q] = {"weight": r["weight"] if r else 1.0, "pass": r["pass"] if r else None,
+                    "cap": r["max_concurrency"] if r else None}
+    capped = [q for q, st in state.items() if st["cap"] is not None]
+    running = dict(conn.execute(
+        f"SELECT queue, COUNT(*) FROM jobs WHERE state='processing' AND queue IN ({','.join('?' * len(capped))}) GROUP BY queue",
+        capped).fetchall()) if capped else {}
+    start = join_pass(state)
+    for q, st in state.items():
+        if st["pass"] is None:
+            st["pass"] = start
+        st["room"] = None if st["cap"] is None else max(0, st["cap"] - running.get(q, 0))
+    return state
+
+def _runnable_queues(conn: sqlite3.Connection) -> List[str]:
+    """Names of the queues holding ready jobs, one seek per queue."""
+    return sorted({r[0] for index, limited in _READY_INDEXES
+                   for r in conn.execute(_RUNNABLE_QUEUES.format(index=index, limited=limited))})
+
+def _promote_due(conn: sqlite3.Connection, now_ms: int) -> int:
+    """Move delayed jobs whose time has come onto the ready index: a range
+    scan over idx_jobs_timers, never over jobs that are still waiting."""
+    return conn.execute("UPDATE jobs SET due_ms=NULL WHERE due_ms IS NOT NULL AND due_ms <= ?",
+                        (now_ms,)).rowcount
+
+def next_due_ms(conn: sqlite3.Connection) -> Optional[int]:
+    """Epoch ms at which the earliest delayed job becomes runnable."""
+    return conn.execute("SELECT MIN(due_ms) FROM jobs WHERE due_ms IS NOT NULL").fetchone()[0]
+
+def _lease_until(now, lease_seconds: int) -> str:
+    # Timestamps have one-second resolution; round up so a lease is never
+    # shorter than asked for.
+    whole = now.replace(microsecond=0)
+    return to_iso(whole + timedelta(seconds=lease_seconds + (1 if now.microsecond else 0)))
+
+def release_jobs(conn: sqlite3.Connection, worker_id: str, job_ids: List[str]) -> int:
+    """Hand leased-but-unstarted jobs back to the runnable set."""
+    if not job_ids:
+        return 0
+    now_iso = to_iso(utc_now())
+    marks = ",".join("?" * len(job_ids))
+    with write_txn(conn, "release"):
+        cur = conn.execute(f"""
             UPDATE jobs
-               SET state='processing', worker_id=?, locked_until=?, updated_at=?
-             WHERE id=?
-        """, (worker_id, locked_until, to_iso(now), job_id))
-    return get_job(conn, job_id)
+               SET state=CASE WHEN attempts > 0 THEN 'failed' ELSE 'pending' END,
+                   worker_id=NULL, locked_until=NULL, updated_at=?
+             WHERE worker_id=? AND state='processing' AND id IN ({marks})
+        """, (now_iso, worker_id, *job_ids))
+        return cur.rowcount
+
+def _reclaim_expired(conn: sqlite3.Connection, now_iso: str) -> int:
+    # Jobs whose worker vanished without completing keep state='processing';
+    # once the lease runs out they go back to the runnable set. Pinned to the
+    # lease index: the planner otherwise walks every processing row via a
+    # state index.
+    cur = conn.execute("""
+        UPDATE jobs INDEXED BY idx_jobs_leases
+           SET state=CASE WHEN attempts > 0 THEN 'failed' ELSE 'pending' END,
+               worker_id=NULL, locked_until=NULL, updated_at=?
+         WHERE state='processing' AND locked_until <= ?
+    """, (now_iso, now_iso))
+    return cur.rowcount
 
 def get_job(conn: sqlite3.Connection, job_id: str) -> Optional[Dict[str, Any]]:
     row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
     return dict_from_row(row) if row else None
 
-def complete_job(conn: sqlite3.Connection, job_id: str) -> None:
+def extend_leases(conn: sqlite3.Connection, worker_id: str, lease_seconds: int, job_ids: List[str]) -> int:
+    """Push out locked_until for the jobs in job_ids that worker_id still
+    holds. Only those: a row the worker has lost track of (say a claim it
+    retried after a broker timeout) must be left to expire."""
+    if not job_ids:
+        return 0
     now = utc_now()
-    with conn:
-        conn.execute("""
-            UPDATE jobs SET state='completed', worker_id=NULL, locked_until=NULL, updated_at=? WHERE id=?
-        """, (to_iso(now), job_id))
+    with write_txn(conn, "heartbeat"):
+        cur = conn.execute("""
+            UPDATE jobs SET locked_until=?
+             WHERE state='processing' AND worker_id=? AND id IN (SELECT value FROM json_each(?))
+        """, (_lease_until(now, lease_seconds), worker_id, json.dumps(job_ids)))
+        return cur.rowcount
+
+def release_worker_leases(conn: sqlite3.Connection, worker_id: str) -> int:
+    """Return every job held by a worker known to be dead to the runnable set."""
+    now_iso = to_iso(utc_now())
+    with write_txn(conn, "release"):
+        cur = conn.execute("""
+            UPDATE jobs
+               SET state=CASE WHEN attempts > 0 THEN 'failed' ELSE 'pending' END,
+                   worker_id=NULL, locked_until=NULL, updated_at=?
+             WHERE state='processing' AND worker_id=?
+        """, (now_iso, worker_id))
+    if cur.rowcount > 0:
+        wake(getattr(conn, "path", None))
+    return cur.rowcount
+
+def complete_job(conn: sqlite3.Connection, job_id: str) -> None:
+    with write_txn(conn, "complete"):
+        released = _complete(conn, job_id, to_iso(utc_now()))
+    if released:
+        wake(getattr(conn, "path", None))
+
+def _complete(conn: sqlite3.Connection, job_id: str, now_iso: str) -> int:
+    """Mark done and count the dependency off each dependent; returns how
+    many dependents were touched. A repeated completion (a job re-run after
+    its lease was reclaimed) does not count twice."""
+    done = conn.execute("""
+        UPDATE jobs SET state='completed', worker_id=NULL, locked_until=NULL, updated_at=?
+         WHERE id=? AND state<>'completed'
+    """, (now_iso, job_id)).rowcount
+    if not done:
+        return 0
+    metrics.inc("queuectl_jobs_finished_total", outcome="completed")
+    return conn.execute("""
+        UPDATE jobs SET pending_deps = pending_deps - 1
+         WHERE id IN (SELECT job_id FROM job_deps WHERE depends_on=?) AND pending_deps > 0
+    """, (job_id,)).rowcount
+
+# Everything downstream of the given job(s) through job_deps.
+# A subquery rather than a leading WITH, so the UPDATEs keep their rowcount.
+_DESCENDANTS = """
+    (WITH RECURSIVE down(id) AS (
+        SELECT job_id FROM job_deps WHERE depends_on IN (SELECT value FROM json_each(?))
+        UNION
+        SELECT d.job_id FROM job_deps d JOIN down ON d.depends_on = down.id)
+     SELECT id FROM down)
+"""
+
+def _propagate_dead(conn: sqlite3.Connection, job_id: str, now_iso: str) -> int:
+    """A dead job can never complete: fail everything still waiting on it."""
+    return conn.execute(f"""
+        UPDATE jobs SET state='dead', last_error=?, updated_at=?
+         WHERE id IN {_DESCENDANTS} AND state IN ('pending','failed') AND pending_deps > 0
+    """, (f"dependency {job_id} failed", now_iso, json.dumps([job_id]))).rowcount
+
+def _revive_dependents(conn: sqlite3.Connection, job_ids: List[str], now_iso: str) -> int:
+    """Undo _propagate_dead for retried jobs. Dependents killed that way
+    never ran, which is what pending_deps > 0 identifies. A dependent that
+    still waits on another dead job stays in the DLQ as it is."""
+    down = [r[0] for r in conn.execute(f"""
+        SELECT id FROM jobs WHERE id IN {_DESCENDANTS} AND state='dead' AND pending_deps > 0
+    """, (json.dumps(job_ids),))]
+    if not down:
+        return 0
+    parents: Dict[str, List[Tuple[str, str]]] = {}
+    for child, parent, state in conn.execute("""
+        SELECT d.job_id, d.depends_on, j.state FROM job_deps d JOIN jobs j ON j.id = d.depends_on
+         WHERE d.job_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(down),)):
+        parents.setdefault(child, []).append((parent, state))
+    # Revive outward from the retried jobs until no dependent is left with
+    # only live (or revived) parents.
+    alive, waiting, revive = set(job_ids), set(down), []
+    while True:
+        ready = [j for j in waiting if all(st != "dead" or p in alive for p, st in parents.get(j, ()))]
+        if not ready:
+            break
+        alive.update(ready)
+        waiting.difference_update(ready)
+        revive.extend(ready)
+    if not revive:
+        return 0
+    return conn.execute("""
+        UPDATE jobs SET state='pending', attempts=0, last_error=NULL, updated_at=?
+         WHERE id IN (SELECT value FROM json_each(?)) AND state='dead'
+    """, (now_iso, json.dumps(revive))).rowcount
+
+_INSERT_LOG = """
+    INSERT INTO job_logs(job_id, created_at, exit_code, stdout, stderr,
+                         segment, stdout_off, stdout_len, stderr_off, stderr_len)
+    VALUES(?,?,?,?,?,?,?,?,?,?)
+"""
+
+def _log_writer(conn: sqlite3.Connection) -> Optional[logstore.SegmentWriter]:
+    cfg = snapshot(conn)
+    if cfg.get("log_store") != "segments" or not getattr(conn, "path", ""):
+        return None
+    return logstore.writer(conn.path, cfg.get_int("log_segment_mb") * 1024 * 1024,
+                           cfg.get_float("log_retention_days"))
+
+def _as_bytes(s: Union[str, bytes, None]) -> bytes:
+    if isinstance(s, bytes):
+        return s
+    return clamp_text(s, 65535).encode("utf-8", "replace")
+
+def _as_text(s: Union[str, bytes, None]) -> str:
+    if isinstance(s, bytes):
+        return s.decode("utf-8", "replace")
+    return s or ""
+
+def _log_row(w: Optional[logstore.SegmentWriter], job_id: str, exit_code: int,
+             stdout: Union[str, bytes], stderr: Union[str, bytes], now_iso: str) -> tuple:
+    # Output goes to the segment files (outside any transaction) as the raw
+    # bytes captured; only the pointers end up in job_logs.
+    if w is None:
+        out, err = clamp_text(_as_text(stdout), 65535), clamp_text(_as_text(stderr), 65535)
+        return (job_id, now_iso, exit_code, out, err, None, None, None, None, None)
+    seg, ((so, sl), (eo, el)) = w.append(_as_bytes(stdout), _as_bytes(stderr))
+    return (job_id, now_iso, exit_code, None, None, seg, so, sl, eo, el)
 
 def log_execution(conn: sqlite3.Connection, job_id: str, exit_code: int, stdout: str, stderr: str) -> None:
-    from .utils import utc_now, to_iso
-    with conn:
-        conn.execute("""
-            INSERT INTO job_logs(job_id, created_at, exit_code, stdout, stderr)
-            VALUES(?,?,?,?,?)
-        """, (job_id, to_iso(utc_now()), exit_code, clamp_text(stdout, 65535), clamp_text(stderr, 65535)))
+    row = _log_row(_log_writer(conn), job_id, exit_code, stdout, stderr, to_iso(utc_now()))
+    with write_txn(conn, "log"):
+        conn.execute(_INSERT_LOG, row)
+
+def _backoff(conn: sqlite3.Connection) -> Tuple[int, float, float]:
+    cfg = snapshot(conn)
+    return cfg.get_int("backoff_base"), cfg.get_float("backoff_cap_seconds"), cfg.get_float("backoff_jitter")
 
 def fail_job(conn: sqlite3.Connection, job: Dict[str, Any], last_error: str) -> None:
-    now = utc_now()
+    backoff = _backoff(conn)
+    with write_txn(conn, "fail"):
+        _fail(conn, job, last_error, backoff, utc_now())
+
+def _fail(conn: sqlite3.Connection, job: Dict[str, Any], last_error: str,
+          backoff: Tuple[int, float, float], now) -> None:
     attempts = int(job["attempts"]) + 1
     max_retries = int(job["max_retries"])
-    base = get_int(conn, "backoff_base")
     if attempts > max_retries:
         state = "dead"
-        run_at = job["run_at"]
+        run_at, due_ms = job["run_at"], None
     else:
-        delay = base ** attempts
-        from datetime import timedelta
+        delay = compute_backoff_seconds(backoff[0], attempts, cap=backoff[1], jitter=backoff[2])
+        due_ms = to_ms(now) + int(delay * 1000)
         run_at = to_iso(now + timedelta(seconds=delay))
         state = "failed"
-    with conn:
-        conn.execute("""
-            UPDATE jobs
-               SET attempts=?, state=?, run_at=?, worker_id=NULL, locked_until=NULL, updated_at=?, last_error=?
-             WHERE id=?
-        """, (attempts, state, run_at, to_iso(now), last_error, job["id"]))
+    metrics.inc("queuectl_jobs_finished_total", outcome="dead" if state == "dead" else "retry")
+    conn.execute("""
+        UPDATE jobs
+           SET attempts=?, state=?, run_at=?, due_ms=?, worker_id=NULL, locked_until=NULL, updated_at=?, last_error=?
+         WHERE id=?
+    """, (attempts, state, run_at, due_ms, to_iso(now), last_error, job["id"]))
+    if state == "dead":
+        _propagate_dead(conn, job["id"], to_iso(now))
+
+def record_results(conn: sqlite3.Connection, results: List[Tuple[Dict[str, Any], int, Any, Any]]) -> None:
+    """Write logs and outcomes for a batch of finished jobs in one transaction.
+    Each result is (job, exit_code, stdout, stderr); output may be str or
+    the raw bytes from exec.run_command."""
+    if not results:
+        return
+    now = utc_now()
+    now_iso = to_iso(now)
+    backoff = _backoff(conn)
+    w = _log_writer(conn)
+    logs = [_log_row(w, job["id"], exit_code, out, err, now_iso) for job, exit_code, out, err in results]
+    released = 0
+    with write_txn(conn, "results"):
+        conn.executemany(_INSERT_LOG, logs)
+        for job, exit_code, out, err in results:
+            if exit_code == 0:
+                released += _complete(conn, job["id"], now_iso)
+            else:
+                _fail(conn, job, (_as_text((err or "")[:2048]) or f"exit {exit_code}")[:512], backoff, now)
+    if released:
+        wake(getattr(conn, "path", None))
 
-def list_jobs(conn: sqlite3.Connection, state: Optional[str]=None, limit: int=100) -> List[Dict[str, Any]]:
+def job_cursor(row: Dict[str, Any], key: str = "created_at") -> str:
+    """Opaque keyset cursor positioned just after row."""
+    return f"{row[key]}|{row['id']}"
+
+def _page(conn: sqlite3.Connection, state: Optional[str], key: str, desc: bool, after: Optional[str],
+          limit: int, command_like: Optional[str], error_like: Optional[str],
+          since: Optional[str], until: Optional[str]) -> List[Dict[str, Any]]:
+    where, params = [], []
     if state:
-        rows = conn.execute("SELECT * FROM jobs WHERE state=? ORDER BY created_at ASC LIMIT ?", (state, limit)).fetchall()
-    else:
-        rows = conn.execute("SELECT * FROM jobs ORDER BY created_at ASC LIMIT ?", (limit,)).fetchall()
-    return [dict_from_row(r) for r in rows]
+        where.append("state=?"); params.append(state)
+    if command_like:
+        where.append("command LIKE ?"); params.append(command_like)
+    if error_like:
+        where.append("last_error LIKE ?"); params.append(error_like)
+    if since:
+        where.append(f"{key} >= ?"); params.append(since)
+    if until:
+        where.append(f"{key} < ?"); params.append(until)
+    if after:
+        k, _, job_id = after.partition("|")
+        where.append(f"({key}, id) {'<' if desc else '>'} (?, ?)"); params.extend((k, job_id))
+    direction = "DESC" if desc else "ASC"
+    sql = (f"SELECT * FROM jobs {'WHERE ' + ' AND '.join(where) if where else ''} "
+           f"ORDER BY {key} {direction}, id {direction} LIMIT ?")
+    return [dict_from_row(r) for r in conn.execute(sql, (*params, limit))]
+
+def iter_jobs(conn: sqlite3.Connection, state: Optional[str]=None, after: Optional[str]=None,
+              command_like: Optional[str]=None, error_like: Optional[str]=None,
+              since: Optional[str]=None, until: Optional[str]=None,
+              key: str="created_at", desc: bool=False, page_size: int=1000) -> Iterator[Dict[str, Any]]:
+    """Yield matching jobs in (key, id) order, one keyset page at a time.
+
+    Only page_size rows are in memory and no read transaction is held
+    between pages. command_like/error_like are SQL LIKE patterns; since and
+    until bound `key` (ISO timestamps)."""
+    while True:
+        rows = _page(conn, state, key, desc, after, page_size, command_like, error_like, since, until)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = job_cursor(rows[-1], key)
+
+def list_jobs(conn: sqlite3.Connection, state: Optional[str]=None, limit: int=100,
+              after: Optional[str]=None, **filters) -> List[Dict[str, Any]]:
+    return _page(conn, state, "created_at", False, after, limit, filters.get("command_like"),
+                 filters.get("error_like"), filters.get("since"), filters.get("until"))
 
 def status(conn: sqlite3.Connection) -> Dict[str, Any]:
-    counts = {}
-    for st in ["pending","processing","completed","failed","dead"]:
-        counts[st] = conn.execute("SELECT COUNT(*) AS c FROM jobs WHERE state=?", (st,)).fetchone()["c"]
-    total = conn.execute("SELECT COUNT(*) AS c FROM jobs").fetchone()["c"]
-    from .utils import to_iso, utc_now
-    now_iso = to_iso(utc_now())
-    active_workers = conn.execute("""
-        SELECT COUNT(DISTINCT worker_id) AS c FROM jobs
-        WHERE worker_id IS NOT NULL AND locked_until > ?
-    """, (now_iso,)).fetchone()["c"]
-    return {"total": total, "states": counts, "active_workers": active_workers}
-
-def dlq_list(conn: sqlite3.Connection):
-    rows = conn.execute("SELECT * FROM jobs WHERE state='dead' ORDER BY updated_at DESC").fetchall()
-    return [dict_from_row(r) for r in rows]
+    counts = {st: 0 for st in JOB_STATES}
+    for row in conn.execute("SELECT state, n FROM job_counts"):
+        counts[row["state"]] = row["n"]
+    return {"total": sum(counts.values()), "states": counts, "active_workers": len(active_workers(conn))}
+
+def active_workers(conn: sqlite3.Connection) -> Set[str]:
+    """Ids of workers holding an unexpired lease."""
+    return {r[0] for r in conn.execute("""
+        SELECT DISTINCT worker_id FROM jobs
+        WHERE state='processing' AND worker_id IS NOT NULL AND locked_until > ?
+    """, (to_iso(utc_now()),))}
+
+def backlog(conn: sqlite3.Connection, cap: int) -> Tuple[int, int, Optional[float]]:
+    """(ready jobs, counted up to cap; processing jobs; seconds the longest
+    waiting job next in line has waited since its run_at, or None). Next in
+    line means the head of each queue and of each limited key, one seek
+    each, so delayed and blocked rows are never walked. Bounded index
+    reads, cheap enough for the autoscaler to call every tick."""
+    ready = min(cap, sum(conn.execute(f"""
+        SELECT COUNT(*) FROM (SELECT 1 FROM jobs INDEXED BY {index}
+                               WHERE {_READY} AND limited = {limited} LIMIT ?)
+    """, (cap,)).fetchone()[0] for index, limited in _READY_INDEXES))
+    processing = conn.execute("SELECT n FROM job_counts WHERE state='processing'").fetchone()[0]
+    heads = []
+    if ready:
+        for queue in _runnable_queues(conn):
+            heads += conn.execute(f"""
+                SELECT run_at FROM jobs WHERE {_READY} AND limited = 0 AND queue=?
+                 ORDER BY priority DESC, created_at ASC LIMIT 1
+            """, (queue,)).fetchall()
+            for (key,) in conn.execute(_READY_KEYS, (queue,)).fetchall():
+                heads += conn.execute(f"""
+                    SELECT run_at FROM jobs WHERE {_READY} AND limited = 1 AND queue=? AND concurrency_key=?
+                     ORDER BY priority DESC, created_at ASC LIMIT 1
+                """, (queue, key)).fetchall()
+    oldest = min((r[0] for r in heads), default=None)
+    wait = (utc_now() - parse_iso(oldest)).total_seconds() if oldest else None
+    return ready, processing, wait
+
+def set_queue(conn: sqlite3.Connection, name: str, weight: Optional[float] = None,
+              max_concurrency: Optional[int] = None, uncapped: bool = False) -> None:
+    """Set a queue's fair-share weight and/or concurrency cap."""
+    if weight is not None and weight <= 0:
+        raise ValueError("weight must be > 0")
+    with write_txn(conn):
+        conn.execute("INSERT OR IGNORE INTO queues(name) VALUES(?)", (name,))
+        if weight is not None:
+            conn.execute("UPDATE queues SET weight=? WHERE name=?", (weight, name))
+        if max_concurrency is not None or uncapped:
+            conn.execute("UPDATE queues SET max_concurrency=? WHERE name=?",
+                         (None if uncapped else max_concurrency, name))
+
+def set_rate_limit(conn: sqlite3.Connection, key: str, max_concurrency: Optional[int] = None,
+                   rate: Optional[float] = None, burst: Optional[float] = None, clear: bool = False) -> None:
+    """Cap how many jobs with concurrency_key=key run at once and/or how
+    fast they start (token bucket: `rate` per second, bursts of `burst`,
+    default max(1, rate)). clear=True removes every limit on the key."""
+    if clear:
+        with write_txn(conn):
+            conn.execute("DELETE FROM rate_limits WHERE key=?", (key,))
+        return
+    if rate is not None and rate < 0 or burst is not None and burst < 1:
+        raise ValueError("rate must be >= 0 and burst >= 1")
+    with write_txn(conn):
+        row = conn.execute("SELECT * FROM rate_limits WHERE key=?", (key,)).fetchone()
+        cur = dict_from_row(row) if row else {"max_concurrency": None, "rate": None, "burst": None}
+        if max_concurrency is not None:
+            cur["max_concurrency"] = max_concurrency
+        if rate is not None:
+            cur["rate"] = rate or None
+        if burst is not None or rate is not None:
+            cur["burst"] = burst or max(1.0, cur["rate"] or 0)
+        # An upsert, not REPLACE: deleting the row would clear jobs.limited.
+        conn.execute("""
+            INSERT INTO rate_limits(key, max_concurrency, rate, burst, tokens, refilled_ms)
+            VALUES(?,?,?,?,?,?)
+            ON CONFLICT(key) DO UPDATE SET max_concurrency=excluded.max_concurrency, rate=excluded.rate,
+                burst=excluded.burst, tokens=excluded.tokens, refilled_ms=excluded.refilled_ms
+        """, (key, cur["max_concurrency"], cur["rate"], cur["burst"], cur["burst"], to_ms(utc_now())))
+
+def rate_limits(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """Configured key limits with their processing and ready counts."""
+    rows = [dict_from_row(r) for r in conn.execute("SELECT * FROM rate_limits ORDER BY key")]
+    for r in rows:
+        r["processing"] = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state='processing' AND concurrency_key=?", (r["key"],)).fetchone()[0]
+        r["ready"] = conn.execute(
+            f"SELECT COUNT(*) FROM jobs WHERE {_READY} AND limited = 1 AND concurrency_key=?",
+            (r["key"],)).fetchone()[0]
+    return rows
+
+def queue_stats(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """Per-queue weight, cap and runnable/processing counts."""
+    rows = {r["name"]: {"name": r["name"], "weight": r["weight"], "max_concurrency": r["max_concurrency"],
+                        "runnable": 0, "processing": 0}
+            for r in conn.execute("SELECT * FROM queues")}
+    for state, sql in (("runnable", "state IN ('pending','failed')"), ("processing", "state='processing'")):
+        for name, n in conn.execute(f"SELECT queue, COUNT(*) FROM jobs WHERE {sql} GROUP BY queue"):
+            rows.setdefault(name, {"name": name, "weight": 1.0, "max_concurrency": None,
+                                   "runnable": 0, "processing": 0})[state] = n
+    return sorted(rows.values(), key=lambda r: r["name"])
+
+def reconcile_status(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Recount job_counts from jobs (full scan) and return the new status."""
+    with write_txn(conn):
+        reconcile_counts(conn)
+    return status(conn)
+
+def dlq_list(conn: sqlite3.Connection, limit: Optional[int]=None, after: Optional[str]=None, **filters):
+    """Dead jobs, most recently failed first. Without a limit every match is
+    returned; use iter_dlq to stream large dead-letter queues."""
+    if limit is None:
+        return [*iter_dlq(conn, after=after, **filters)]
+    return [*islice(iter_dlq(conn, after=after, page_size=max(1, min(limit, 1000)), **filters), limit)]
+
+def iter_dlq(conn: sqlite3.Connection, after: Optional[str]=None, **filters) -> Iterator[Dict[str, Any]]:
+    return iter_jobs(conn, "dead", after=after, key="updated_at", desc=True, **filters)
 
 def dlq_retry(conn: sqlite3.Connection, job_id: str) -> bool:
-    from .utils import utc_now, to_iso
     now = to_iso(utc_now())
-    with conn:
+    with write_txn(conn):
         cur = conn.execute("""
             UPDATE jobs
-               SET state='pending', attempts=0, run_at=?, updated_at=?, last_error=NULL
+               SET state='pending', attempts=0, run_at=?, due_ms=NULL, updated_at=?, last_error=NULL
              WHERE id=? AND state='dead'
         """, (now, now, job_id))
-        return cur.rowcount > 0
+        if cur.rowcount:
+            _revive_dependents(conn, [job_id], now)
+    if cur.rowcount > 0:
+        wake(getattr(conn, "path", None))
+    return cur.rowcount > 0
+
+def dlq_retry_many(conn: sqlite3.Connection, batch_size: int=1000, **filters) -> int:
+    """Re-enqueue every dead job matching filters, batch_size per transaction.
+
+    Pages walk (updated_at, id) downwards from a keyset cursor, so a job
+    revived here that dies again mid-call (newer updated_at) is never
+    picked up twice: one call covers only the jobs dead when it reached them."""
+    total, after = 0, None
+    while True:
+        rows = _page(conn, "dead", "updated_at", True, after, batch_size,
+                     filters.get("command_like"), filters.get("error_like"),
+                     filters.get("since"), filters.get("until"))
+        if not rows:
+            return total
+        ids = [r["id"] for r in rows]
+        after = job_cursor(rows[-1], "updated_at")
+        now = to_iso(utc_now())
+        with write_txn(conn):
+            total += conn.execute(f"""
+                UPDATE jobs
+                   SET state='pending', attempts=0, run_at=?, due_ms=NULL, updated_at=?, last_error=NULL
+                 WHERE state='dead' AND id IN ({','.join('?' * len(ids))})
+            """, (now, now, *ids)).rowcount
+            total += _revive_dependents(conn, ids, now)
+        wake(getattr(conn, "path", None))
 
 def get_logs(conn: sqlite3.Connection, job_id: str, limit: int=10):
     rows = conn.execute("SELECT * FROM job_logs WHERE job_id=? ORDER BY id DESC LIMIT ?", (job_id, limit)).fetchall()
-    return [dict_from_row(r) for r in rows]
+    return [_hydrate_log(conn, dict_from_row(r)) for r in rows]
+
+def _hydrate_log(conn: sqlite3.Connection, row: Dict[str, Any]) -> Dict[str, Any]:
+    seg = row.get("segment")
+    if seg:
+        for stream in ("stdout", "stderr"):
+            data = logstore.read(conn.path, seg, row[f"{stream}_off"], row[f"{stream}_len"])
+            row[stream] = "[log segment pruned]" if data is None else data.decode("utf-8", "replace")
+    return row
@@ -1,5 +1,78 @@
 
+"""Claim planning across named queues.
+
+Queues share workers by stride scheduling (weighted fair queueing): each
+queue carries a `pass` that grows by 1/weight for every job it is given,
+and the next slot goes to the runnable queue with the lowest pass. Passes
+live in the `queues` table and are updated inside the claim transaction,
+so fairness holds across all worker processes, not just within one. A
+queue that drains gets its pass cleared and rejoins at the current
+minimum, so idling does not bank credit for a later burst.
+"""
 from __future__ import annotations
+import heapq, random
+from typing import Dict, Optional
+
+def compute_backoff_seconds(base: int, attempts_after_increment: int, cap: Optional[float] = None,
+                            jitter: float = 0.0, rng: random.Random = random) -> float:
+    """base**attempts, capped at `cap` seconds, then shortened by a random
+    fraction of up to `jitter` (0..1) so jobs that failed together do not
+    all retry in the same instant."""
+    try:
+        delay = float(base) ** attempts_after_increment
+    except OverflowError:
+        delay = float("inf")
+    if cap is not None and cap > 0:
+        delay = min(delay, cap)
+    return delay * (1.0 - min(max(jitter, 0.0), 1.0) * rng.random())
+
+def plan_claims(queues: Dict[str, dict], n: int) -> Dict[str, int]:
+    """Split n slots over queues ({name: {"weight", "pass", "room"}}, room
+    None = uncapped). Passes are not modified; returns {name: slots}."""
+    heap = [(q["pass"], name) for name, q in queues.items() if q["room"] is None or q["room"] > 0]
+    heapq.heapify(heap)
+    plan: Dict[str, int] = {}
+    while n > 0 and heap:
+        p, name = heapq.heappop(heap)
+        q = queues[name]
+        plan[name] = plan.get(name, 0) + 1
+        n -= 1
+        if q["room"] is None or plan[name] < q["room"]:
+            heapq.heappush(heap, (p + 1.0 / q["weight"], name))
+    return plan
+
+def refill_tokens(tokens: float, burst: float, rate: float, elapsed_s: float) -> float:
+    """Token bucket level after elapsed_s seconds at `rate` tokens/s."""
+    return min(burst, tokens + rate * max(0.0, elapsed_s))
+
+def join_pass(queues: Dict[str, dict]) -> float:
+    """Pass for a queue that just became runnable: the lowest among the
+    queues already being served (0 when none are)."""
+    active = [q["pass"] for q in queues.values() if q["pass"] is not None]
+    return min(active) if active else 0.0
+
+def desired_workers(current: int, ready: int, processing: int, oldest_wait_s: Optional[float],
+                    concurrency: int, lo: int, hi: int, up_wait_s: float) -> int:
+    """Worker count for the backlog: enough slots for every ready and
+    running job, at least one more than `current` while the oldest ready
+    job has waited longer than up_wait_s, and never more than one fewer
+    per call, so scaling down is gradual. Clamped to [lo, hi]."""
+    want = -(-(ready + processing) // max(1, concurrency))
+    if oldest_wait_s is not None and oldest_wait_s > up_wait_s:
+        want = max(want, current + 1)
+    if want < current:
+        want = current - 1
+    return max(lo, min(hi, want))
+
+def parse_queues(spec: Optional[str]):
+    """'a,b' -> ['a', 'b']; empty or None means every queue."""
+    names = [q.strip() for q in (spec or "").split(",") if q.strip()]
+    return names or None
 
-def compute_backoff_seconds(base: int, attempts_after_increment: int) -> int:
-    return int(base ** attempts_after_increment)
+def parse_shards(spec: Optional[str]):
+    """'0,2' -> [0, 2]; empty or None means every shard."""
+    try:
+        shards = [int(k) for k in (spec or "").split(",") if k.strip()]
+    except ValueError:
+        raise ValueError(f"shards must be comma-separated numbers, got {spec!r}") from None
+    return shards or None
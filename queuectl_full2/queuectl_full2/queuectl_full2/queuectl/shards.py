@@ -0,0 +1,300 @@
+
+"""One queue spread over several SQLite files.
+
+SQLite lets one writer at a time into a file, so a single queue.db caps
+enqueue and claim throughput however many workers run. With `config set
+shards N` new jobs are hash-partitioned over N files: shard 0 is the
+database itself and shard k is `<stem>.<k><suffix>` beside it (queue.db,
+queue.1.db, ...). Each shard is a complete queue with its own write lock,
+broker socket and wakeup directory; a new shard file starts with shard 0's
+config, queues and key limits.
+
+`shard_by` picks the partition key. With "id" (the default) a job goes by
+its concurrency key, else its idempotency key, else (with coalesce) its
+command, else its id, so key limits and deduplication still see every job
+sharing a key; queue weights and caps then hold per shard. With "queue"
+whole queues stay together and it is key limits that hold per shard. A
+job with dependencies goes to the shard of its first dependency, and a
+workflow (enqueue_dag) lands in one shard, since dependencies are rows in
+one file.
+
+Workers claim round-robin over all shards or only the ones given with
+`--shards`. Reads (status, list, dlq, queues, limits) visit every shard and
+merge; settings are written to every shard.
+
+Changing `shards` changes where most keys route. Until the jobs enqueued
+before the change have finished (and, for idempotency keys, the dedup
+window has passed), a resubmitted idempotency or coalesce key can land in
+a different shard than its first copy and be enqueued twice, and a key's
+concurrency and rate limits hold separately in its old and new shard.
+Lowering the count also stops routing new jobs to the dropped files,
+which are still read and drained.
+"""
+from __future__ import annotations
+import heapq, sqlite3, zlib
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import repo
+from .broker import Store
+from .config import set_config, snapshot
+from .db import connect
+from .utils import gen_id
+
+SHARD_KEYS = ("id", "queue")
+
+def shard_path(db_path: str, k: int) -> str:
+    if k == 0:
+        return db_path
+    p = Path(db_path)
+    return str(p.with_name(f"{p.stem}.{k}{p.suffix}"))
+
+def shard_of(key: str, n: int) -> int:
+    # crc32, not hash(): it must agree across processes and restarts.
+    return zlib.crc32(key.encode("utf-8")) % n if n > 1 else 0
+
+def route_key(job: Dict[str, Any], by: str) -> str:
+    if by == "queue":
+        return job.get("queue") or "default"
+    for key in ("concurrency_key", "idempotency_key"):
+        if job.get(key):
+            return str(job[key])
+    if job.get("coalesce"):
+        return str(job.get("command") or job.get("argv") or job.get("callable"))
+    return job.setdefault("id", gen_id())
+
+def _seed(src: sqlite3.Connection, dst: sqlite3.Connection) -> None:
+    """Copy settings into a freshly created shard file."""
+    dst.execute("ATTACH DATABASE ? AS src", (src.path,))
+    try:
+        with dst:
+            dst.execute("INSERT OR REPLACE INTO config SELECT * FROM src.config")
+            dst.execute("INSERT OR IGNORE INTO queues(name, weight, max_concurrency) "
+                        "SELECT name, weight, max_concurrency FROM src.queues")
+            dst.execute("INSERT OR IGNORE INTO rate_limits SELECT * FROM src.rate_limits")
+    finally:
+        dst.execute("DETACH DATABASE src")
+
+class ShardSet:
+    """Every shard of the queue at db_path, each behind its own Store.
+
+    Exposes the Store methods, routed or fanned out, plus merged versions
+    of the read paths the CLI uses. With one shard each call is a plain
+    pass-through to shard 0. `only` restricts claiming (and lease and
+    release calls) to those shard numbers."""
+
+    def __init__(self, db_path: Optional[str] = None, only: Optional[List[int]] = None):
+        first = connect(db_path)
+        cfg = snapshot(first)
+        self.count = max(1, cfg.get_int("shards"))
+        self.by = cfg.get("shard_by")
+        if self.by not in SHARD_KEYS:
+            raise ValueError(f"shard_by must be one of {', '.join(SHARD_KEYS)}, got {self.by!r}")
+        self.path = first.path
+        self.conns = [first]
+        k = 1
+        while k < self.count or Path(shard_path(first.path, k)).exists():
+            fresh = not Path(shard_path(first.path, k)).exists()
+            conn = connect(shard_path(first.path, k))
+            if fresh:
+                _seed(first, conn)
+            self.conns.append(conn)
+            k += 1
+        self.stores = [Store(c) for c in self.conns]
+        bad = [k for k in only or () if not 0 <= k < len(self.conns)]
+        if bad:
+            raise ValueError(f"no shard {bad[0]}; this queue has {len(self.conns)}")
+        self.active = list(only) if only else list(range(len(self.conns)))
+        self._next = 0
+
+    def shard_for(self, job: Dict[str, Any]) -> int:
+        if self.count == 1:
+            return 0
+        deps = job.get("depends_on")
+        if deps:
+            k = self.locate(deps[0])
+            if k is not None:
+                return k
+        return shard_of(route_key(job, self.by), self.count)
+
+    def locate(self, job_id: str) -> Optional[int]:
+        """Shard number holding job_id, or None."""
+        for k, conn in enumerate(self.conns):
+            if conn.execute("SELECT 1 FROM jobs WHERE id=?", (job_id,)).fetchone():
+                return k
+        return None
+
+    def conn_for(self, job_id: str) -> sqlite3.Connection:
+        """Connection of the shard holding job_id (shard 0 when none does)."""
+        return self.conns[self.locate(job_id) or 0]
+
+    # Job flow (the Store interface).
+
+    def enqueue(self, job: Dict[str, Any]) -> str:
+        return self.stores[self.shard_for(job)].enqueue(job)
+
+    def enqueue_many(self, jobs: Iterable[Dict[str, Any]], batch_size: int = 10000,
+                     on_conflict: str = "fail") -> int:
+        if self.count == 1:
+            return self.stores[0].enqueue_many(jobs, batch_size, on_conflict)
+        it, total = iter(jobs), 0
+        while True:
+            batch = list(islice(it, batch_size))
+            if not batch:
+                return total
+            parts: Dict[int, List[Dict[str, Any]]] = {}
+            for job in batch:
+                parts.setdefault(self.shard_for(job), []).append(job)
+            for k, part in parts.items():
+                total += self.stores[k].enqueue_many(part, batch_size, on_conflict)
+
+    def enqueue_dag(self, jobs: List[Dict[str, Any]]) -> List[str]:
+        k = 0
+        if self.count > 1 and jobs:
+            ids = {j.get("id") for j in jobs}
+            external = [d for j in jobs for d in j.get("depends_on") or () if d not in ids]
+            k = self.shard_for({**jobs[0], "depends_on": external[:1]})
+        return self.stores[k].enqueue_dag(jobs)
+
+    def acquire_batch(self, worker_id: str, n: int, queues: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Up to n jobs, starting one shard further along each call so
+        every shard gets claimed from even while the first has work."""
+        jobs: List[Dict[str, Any]] = []
+        start, self._next = self._next, (self._next + 1) % len(self.active)
+        for i in range(len(self.active)):
+            if len(jobs) >= n:
+                break
+            k = self.active[(start + i) % len(self.active)]
+            for job in self.stores[k].acquire_batch(worker_id, n - len(jobs), queues):
+                job["shard"] = k
+                jobs.append(job)
+        return jobs
+
+    def record_results(self, results) -> None:
+        parts: Dict[int, list] = {}
+        for r in results:
+            parts.setdefault(r[0].get("shard", 0), []).append(r)
+        for k, part in parts.items():
+            self.stores[k].record_results(part)
+
+    def release_jobs(self, worker_id: str, job_ids: List[str]) -> int:
+        if not job_ids:
+            return 0
+        return sum(self.stores[k].release_jobs(worker_id, job_ids) for k in self.active)
+
+    def extend_leases(self, worker_id: str, lease_seconds: int, job_ids: List[str]) -> int:
+        if not job_ids:
+            return 0
+        return sum(self.stores[k].extend_leases(worker_id, lease_seconds, job_ids) for k in self.active)
+
+    def next_due_ms(self) -> Optional[int]:
+        due = [d for d in (self.stores[k].next_due_ms() for k in self.active) if d is not None]
+        return min(due) if due else None
+
+    def close(self) -> None:
+        for store in self.stores:
+            store.close()
+        for conn in self.conns:
+            conn.close()
+
+    # Supervision.
+
+    def release_worker_leases(self, worker_id: str) -> int:
+        return sum(repo.release_worker_leases(c, worker_id) for c in self.conns)
+
+    def backlog(self, cap: int) -> Tuple[int, int, Optional[float]]:
+        ready = processing = 0
+        waits = []
+        for conn in self.conns:
+            r, p, w = repo.backlog(conn, cap)
+            ready, processing = ready + r, processing + p
+            if w is not None:
+                waits.append(w)
+        return min(cap, ready), processing, max(waits) if waits else None
+
+    # Reads, merged across shards.
+
+    def status(self) -> Dict[str, Any]:
+        if len(self.conns) == 1:
+            return repo.status(self.conns[0])
+        merged: Dict[str, Any] = {"total": 0, "states": {}}
+        workers = set()
+        for conn in self.conns:
+            st = repo.status(conn)
+            merged["total"] += st["total"]
+            for state, n in st["states"].items():
+                merged["states"][state] = merged["states"].get(state, 0) + n
+            # One worker usually holds jobs in several shards.
+            workers |= repo.active_workers(conn)
+        merged["active_workers"] = len(workers)
+        return merged
+
+    def reconcile_status(self) -> Dict[str, Any]:
+        for conn in self.conns:
+            repo.reconcile_status(conn)
+        return self.status()
+
+    def iter_jobs(self, state: Optional[str] = None, after: Optional[str] = None,
+                  page_size: int = 1000, **filters) -> Iterator[Dict[str, Any]]:
+        its = [repo.iter_jobs(c, state, after=after, page_size=page_size, **filters) for c in self.conns]
+        return heapq.merge(*its, key=lambda r: (r["created_at"], r["id"]))
+
+    def list_jobs(self, state: Optional[str] = None, limit: int = 100, after: Optional[str] = None,
+                  **filters) -> List[Dict[str, Any]]:
+        return [*islice(self.iter_jobs(state, after, page_size=limit, **filters), limit)]
+
+    def iter_dlq(self, after: Optional[str] = None, page_size: int = 1000, **filters) -> Iterator[Dict[str, Any]]:
+        its = [repo.iter_jobs(c, "dead", after=after, key="updated_at", desc=True, page_size=page_size, **filters)
+               for c in self.conns]
+        return heapq.merge(*its, key=lambda r: (r["updated_at"], r["id"]), reverse=True)
+
+    def dlq_list(self, limit: Optional[int] = None, after: Optional[str] = None, **filters) -> List[Dict[str, Any]]:
+        if limit is None:
+            return [*self.iter_dlq(after, **filters)]
+        return [*islice(self.iter_dlq(after, page_size=limit, **filters), limit)]
+
+    def dlq_retry(self, job_id: str) -> bool:
+        return any(repo.dlq_retry(c, job_id) for c in self.conns)
+
+    def dlq_retry_many(self, batch_size: int = 1000, **filters) -> int:
+        return sum(repo.dlq_retry_many(c, batch_size=batch_size, **filters) for c in self.conns)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return repo.get_job(self.conn_for(job_id), job_id)
+
+    def queue_stats(self) -> List[Dict[str, Any]]:
+        merged: Dict[str, Dict[str, Any]] = {}
+        for conn in self.conns:
+            for r in repo.queue_stats(conn):
+                m = merged.setdefault(r["name"], {**r, "runnable": 0, "processing": 0})
+                m["runnable"] += r["runnable"]
+                m["processing"] += r["processing"]
+        return [merged[k] for k in sorted(merged)]
+
+    def rate_limits(self) -> List[Dict[str, Any]]:
+        merged: Dict[str, Dict[str, Any]] = {}
+        for conn in self.conns:
+            for r in repo.rate_limits(conn):
+                m = merged.setdefault(r["key"], {**r, "processing": 0, "ready": 0})
+                m["processing"] += r["processing"]
+                m["ready"] += r["ready"]
+        return [merged[k] for k in sorted(merged)]
+
+    # Settings, written to every shard.
+
+    def set_config(self, key: str, value: str) -> None:
+        if key == "shards" and (not value.isdigit() or int(value) < 1):
+            raise ValueError("shards must be a positive integer")
+        if key == "shard_by" and value not in SHARD_KEYS:
+            raise ValueError(f"shard_by must be one of {', '.join(SHARD_KEYS)}")
+        for conn in self.conns:
+            set_config(conn, key, value)
+
+    def set_queue(self, *args, **kwargs) -> None:
+        for conn in self.conns:
+            repo.set_queue(conn, *args, **kwargs)
+
+    def set_rate_limit(self, *args, **kwargs) -> None:
+        for conn in self.conns:
+            repo.set_rate_limit(conn, *args, **kwargs)
@@ -0,0 +1,18 @@
+import os, subprocess, sys, time
+from pathlib import Path
+import queuectl
+
+ROOT = str(Path(queuectl.__file__).resolve().parent.parent)
+
+def run_cli(args, cwd=None):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    cmd = [sys.executable, "-m", "queuectl.cli"] + args
+    return subprocess.run(cmd, capture_output=True, text=True, cwd=cwd, env=env)
+
+def wait_for(pred, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.05)
+    return False
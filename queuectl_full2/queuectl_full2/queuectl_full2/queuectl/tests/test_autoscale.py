@@ -0,0 +1,46 @@
+
+import json, os, signal
+from queuectl.db import connect
+from queuectl.config import set_config
+from queuectl.repo import enqueue, backlog, status, set_rate_limit
+from queuectl.scheduler import desired_workers
+from conftest import run_cli, wait_for
+
+def test_desired_workers():
+    assert desired_workers(1, ready=10, processing=0, oldest_wait_s=0, concurrency=2, lo=1, hi=4, up_wait_s=5) == 4
+    assert desired_workers(2, ready=1, processing=1, oldest_wait_s=9, concurrency=4, lo=1, hi=4, up_wait_s=5) == 3
+    assert desired_workers(4, ready=0, processing=0, oldest_wait_s=None, concurrency=1, lo=1, hi=4, up_wait_s=5) == 3
+    assert desired_workers(1, ready=0, processing=0, oldest_wait_s=None, concurrency=1, lo=1, hi=4, up_wait_s=5) == 1
+
+def test_backlog_counts_only_ready_jobs(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue(conn, {"id": "now", "command": "true"})
+    enqueue(conn, {"id": "later", "command": "true", "run_at": "2999-01-01T00:00:00Z"})
+    enqueue(conn, {"id": "blocked", "command": "true", "depends_on": ["later"]})
+    ready, processing, wait = backlog(conn, 100)
+    assert (ready, processing) == (1, 0) and wait is not None and wait < 5
+    # The head of a limited key counts too.
+    set_rate_limit(conn, "api", max_concurrency=1)
+    enqueue(conn, {"id": "keyed", "command": "true", "concurrency_key": "api", "queue": "other"})
+    conn.execute("UPDATE jobs SET run_at='2000-01-01T00:00:00Z' WHERE id='keyed'")
+    ready, processing, wait = backlog(conn, 100)
+    assert ready == 2 and wait > 86400
+
+def test_controller_scales_and_restarts(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    set_config(conn, "scale_cooldown_seconds", "0")
+    for i in range(6):
+        enqueue(conn, {"id": f"j{i}", "command": "sleep 1"})
+    children = lambda: json.loads((tmp_path/".queuectl"/"children.json").read_text())
+    r = run_cli(["worker-start", "--count", "1", "--max-count", "3", "--db", str(db)], cwd=tmp_path)
+    assert r.returncode == 0, r.stderr
+    try:
+        assert wait_for(lambda: len(children()) == 3)
+        assert wait_for(lambda: status(conn)["states"]["completed"] == 6)
+        assert wait_for(lambda: len(children()) == 1)
+        victim = children()[0]
+        os.kill(victim, signal.SIGKILL)
+        assert wait_for(lambda: children() and children()[0] != victim)
+    finally:
+        run_cli(["worker-stop"], cwd=tmp_path)
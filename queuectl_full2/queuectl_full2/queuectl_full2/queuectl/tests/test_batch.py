@@ -0,0 +1,46 @@
+
+import time, subprocess, sys, signal
+from concurrent.futures import Future
+from queuectl.db import connect
+from queuectl.worker import _outcome
+from queuectl.config import set_config
+from queuectl.repo import enqueue, acquire_batch, record_results, release_jobs, get_job, status
+
+def test_acquire_batch_and_record(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    for i in range(5):
+        enqueue(conn, {"id": f"j{i}", "command": "true", "priority": i % 2})
+    jobs = acquire_batch(conn, "w", 4)
+    assert [j["id"] for j in jobs] == ["j1", "j3", "j0", "j2"]
+    record_results(conn, [(jobs[0], 0, "ok", ""), (jobs[1], 1, "", "boom")])
+    assert get_job(conn, "j1")["state"] == "completed"
+    assert get_job(conn, "j3")["state"] == "failed"
+    assert get_job(conn, "j3")["last_error"] == "boom"
+    assert release_jobs(conn, "w", ["j0", "j2"]) == 2
+    assert status(conn)["states"]["pending"] == 3
+
+def test_sigterm_releases_prefetched(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    set_config(conn, "batch_size", "10")
+    for i in range(10):
+        enqueue(conn, {"id": f"j{i}", "command": "sleep 0.5"})
+    p = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)])
+    time.sleep(1.2)
+    p.send_signal(signal.SIGTERM); p.wait(timeout=5)
+    st = status(conn)["states"]
+    assert st["processing"] == 0
+    assert st["completed"] >= 1
+    assert st["completed"] + st["pending"] == 10
+
+def test_executor_error_fails_only_that_job(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue(conn, {"id": "boom", "command": "true", "max_retries": 0})
+    enqueue(conn, {"id": "fine", "command": "true"})
+    bad, good = Future(), Future()
+    bad.set_exception(OSError("pipe broke"))
+    good.set_result((0, b"ok", b""))
+    jobs = {j["id"]: j for j in acquire_batch(conn, "w", 2)}
+    record_results(conn, [_outcome(bad, jobs["boom"]), _outcome(good, jobs["fine"])])
+    assert get_job(conn, "boom")["state"] == "dead" and "pipe broke" in get_job(conn, "boom")["last_error"]
+    assert get_job(conn, "fine")["state"] == "completed"
@@ -0,0 +1,36 @@
+import json, subprocess, sys
+import pytest
+from queuectl import bench
+
+def test_generator_is_seeded():
+    a = [*bench.generate("cpu", 20, seed=7)]
+    assert a == [*bench.generate("cpu", 20, seed=7)]
+    assert a != [*bench.generate("cpu", 20, seed=8)]
+    assert {j["kind"] for j in a} == {"python"} and len({j["id"] for j in a}) == 20
+    with pytest.raises(ValueError):
+        next(bench.generate("sleepy", 1))
+
+def test_suite_reports_and_compares():
+    doc = bench.run(["enqueue", "claim", "retry", "large"], jobs=20, workers=[2], retries=1, large_rows=2000)
+    by = {(r["scenario"], r["variant"]): r for r in doc["results"]}
+    claim = by[("claim", "2w")]
+    assert claim["completed"] == 20 and claim["jobs_per_s"] > 0
+    assert 0 <= claim["start_p50_ms"] <= claim["start_p99_ms"] <= claim["e2e_p99_ms"]
+    retry = by[("retry", "2w")]
+    assert retry["dead"] == 20 and retry["executions"] == 40
+    assert by[("large", "2000 rows")]["db_bytes"] > 0
+    assert by[("enqueue", "bulk")]["jobs"] == 400
+    rows = bench.compare(doc, doc)
+    assert rows and all(r["change"] in (0, None) for r in rows)
+
+def test_cli_saves_json(tmp_path):
+    out = tmp_path/"run.json"
+    r = subprocess.run([sys.executable, "-m", "queuectl.cli", "bench", "--scenarios", "enqueue,large", "--jobs", "10",
+                        "--large-rows", "500", "--out", str(out), "--json"], capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr
+    saved = bench.load(str(out))
+    assert saved == json.loads(r.stdout)
+    assert saved["params"]["seed"] == 0 and saved["host"]["sqlite"]
+    r = subprocess.run([sys.executable, "-m", "queuectl.cli", "bench", "--scenarios", "claim,nope"],
+                       capture_output=True, text=True)
+    assert r.returncode != 0 and "nope" in r.stderr
@@ -0,0 +1,79 @@
+
+import json, signal, socket, subprocess, sys
+import pytest
+from queuectl import metrics
+from queuectl.broker import BrokerClient, Store, socket_path, _frame
+from queuectl.db import connect, write_txn
+from queuectl.repo import enqueue, get_job, status, DuplicateJobError
+from conftest import wait_for
+
+def test_nested_write_txn_fails_alone(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    with write_txn(conn):
+        enqueue(conn, {"id": "a", "command": "true"})
+        with pytest.raises(DuplicateJobError):
+            enqueue(conn, {"id": "a", "command": "false"})
+        enqueue(conn, {"id": "b", "command": "true"})
+    assert get_job(conn, "a")["command"] == "true" and get_job(conn, "b")
+
+def test_workers_and_cli_go_through_broker(tmp_path):
+    db = str(tmp_path/"t.db")
+    conn = connect(db)
+    assert not Store(conn).brokered
+    broker = subprocess.Popen([sys.executable, "-m", "queuectl.cli", "broker", "--db", db])
+    worker = None
+    try:
+        assert wait_for(lambda: socket_path(conn.path).exists())
+        store = Store(conn)
+        assert store.brokered
+        assert store.enqueue({"id": "a", "command": "echo hi"}) == "a"
+        with pytest.raises(DuplicateJobError):
+            store.enqueue({"id": "a", "command": "echo again"})
+        assert store.enqueue_many(({"id": f"m{i}", "command": "true"} for i in range(5)), batch_size=2) == 5
+        worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", db, "--concurrency", "2"])
+        assert wait_for(lambda: status(conn)["states"]["completed"] == 6, timeout=20)
+        assert wait_for(lambda: metrics.collect(db)["histograms"].get("queuectl_broker_group_size"), timeout=10)
+        worker.send_signal(signal.SIGTERM); worker.wait(timeout=10)
+        broker.send_signal(signal.SIGTERM); broker.wait(timeout=10)
+        assert not socket_path(conn.path).exists()
+        # Falls back to direct SQLite once the broker is gone.
+        assert store.enqueue({"id": "late", "command": "true"}) == "late"
+        assert not store.brokered and get_job(conn, "late")
+    finally:
+        for p in (worker, broker):
+            if p is not None and p.poll() is None:
+                p.kill(); p.wait()
+
+def _fake_broker(store, *replies):
+    """Point store at a socket whose far end already holds `replies`."""
+    ours, theirs = socket.socketpair()
+    theirs.sendall(b"".join(_frame(r) for r in replies))
+    store.client = BrokerClient(ours)
+    return theirs
+
+def test_failed_group_commit_is_retried_directly(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    store = Store(conn)
+    _fake_broker(store, {"ok": False, "error": "commit failed: disk I/O error", "kind": "CommitFailed"})
+    assert store.enqueue({"id": "a", "command": "true"}) == "a"
+    assert not store.brokered and get_job(conn, "a")
+
+def test_enqueue_many_sends_lists(tmp_path, monkeypatch):
+    conn = connect(str(tmp_path/"t.db"))
+    store = Store(conn)
+    assert not store.brokered
+    # The broker turns up just as the call starts.
+    theirs = _fake_broker(store, {"ok": True, "result": 2}, {"ok": True, "result": 1})
+    client, store.client, store._retry_at = store.client, None, 0.0
+    monkeypatch.setattr(BrokerClient, "connect", classmethod(lambda cls, path, timeout=30.0: client))
+    jobs = ({"id": f"g{i}", "command": "true"} for i in range(3))
+    assert store.enqueue_many(jobs, batch_size=2) == 3
+    theirs.settimeout(1.0)
+    sent, frames = b"", []
+    while len(frames) < 2:
+        sent += theirs.recv(1 << 16)
+        while len(sent) >= 4 and len(sent) >= 4 + int.from_bytes(sent[:4], "big"):
+            n = int.from_bytes(sent[:4], "big")
+            frames.append(json.loads(sent[4:4 + n]))
+            sent = sent[4 + n:]
+    assert [[j["id"] for j in f["args"][0]] for f in frames] == [["g0", "g1"], ["g2"]]
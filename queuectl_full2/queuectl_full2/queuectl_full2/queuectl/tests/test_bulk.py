@@ -0,0 +1,43 @@
+
+import json, sqlite3, subprocess, sys
+import pytest
+from queuectl.db import connect
+from queuectl.repo import enqueue_many, get_job, status, acquire_batch
+
+def test_enqueue_bulk_from_stdin(tmp_path):
+    db = tmp_path/"t.db"
+    lines = "\n".join(json.dumps({"id": f"j{i}", "command": "true", "priority": i % 3}) for i in range(2500))
+    r = subprocess.run([sys.executable, "-m", "queuectl.cli", "enqueue-bulk", "-", "--batch-size", "1000", "--db", str(db)],
+                       input=lines, capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr
+    assert status(connect(str(db)))["states"]["pending"] == 2500
+
+def test_enqueue_many_conflicts(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    assert enqueue_many(conn, ({"id": f"j{i}", "command": "a"} for i in range(10)), batch_size=3) == 10
+    assert enqueue_many(conn, [{"id": "j1", "command": "b"}, {"id": "new", "command": "b"}], on_conflict="skip") == 1
+    assert get_job(conn, "j1")["command"] == "a"
+    enqueue_many(conn, [{"id": "j1", "command": "c"}], on_conflict="replace")
+    assert get_job(conn, "j1")["command"] == "c"
+    with pytest.raises(sqlite3.IntegrityError):
+        enqueue_many(conn, [{"id": "j2", "command": "d"}])
+    assert status(conn)["total"] == 11
+
+def test_jobs_without_a_command_are_rejected(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    with pytest.raises(ValueError, match="command or argv"):
+        enqueue_many(conn, [{"id": "empty"}])
+    with pytest.raises(ValueError, match="callable"):
+        enqueue_many(conn, [{"id": "py", "kind": "python"}])
+    assert status(conn)["total"] == 0
+
+def test_replace_leaves_running_jobs_alone(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_many(conn, [{"id": "run", "command": "a", "priority": 1}, {"id": "idle", "command": "a"}])
+    assert [j["id"] for j in acquire_batch(conn, "w", 1)] == ["run"]
+    n = enqueue_many(conn, [{"id": "run", "command": "b"}, {"id": "idle", "command": "b"},
+                            {"id": "idle", "command": "c"}], on_conflict="replace")
+    assert n == 1
+    assert (get_job(conn, "run")["command"], get_job(conn, "run")["state"]) == ("a", "processing")
+    assert get_job(conn, "idle")["command"] == "c"
+    assert status(conn)["total"] == 2
@@ -0,0 +1,42 @@
+
+import threading
+from queuectl.db import connect
+from queuectl.repo import enqueue, acquire_next_job, get_job, extend_leases
+
+def test_concurrent_claims_are_exclusive(tmp_path):
+    db = str(tmp_path/"t.db")
+    conn = connect(db)
+    for i in range(200):
+        enqueue(conn, {"id": f"j{i}", "command": "true"})
+    claimed = []
+    def claimer(n):
+        c = connect(db)
+        while True:
+            job = acquire_next_job(c, f"w{n}")
+            if not job:
+                return
+            claimed.append(job["id"])
+    threads = [threading.Thread(target=claimer, args=(n,)) for n in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert sorted(claimed) == sorted(f"j{i}" for i in range(200))
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue(conn, {"id": "a", "command": "true"})
+    assert acquire_next_job(conn, "w1")["worker_id"] == "w1"
+    conn.execute("UPDATE jobs SET locked_until='2000-01-01T00:00:00Z' WHERE id='a'")
+    job = acquire_next_job(conn, "w2")
+    assert job["id"] == "a" and job["worker_id"] == "w2"
+    assert get_job(conn, "a")["state"] == "processing"
+
+def test_heartbeat_extends_only_held_jobs(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    for i in "ab":
+        enqueue(conn, {"id": i, "command": "true"})
+    assert acquire_next_job(conn, "w1") and acquire_next_job(conn, "w1")
+    conn.execute("UPDATE jobs SET locked_until='2000-01-01T00:00:00Z'")
+    assert extend_leases(conn, "w1", 60, ["a"]) == 1
+    assert get_job(conn, "b")["locked_until"] == "2000-01-01T00:00:00Z"
+    assert get_job(conn, "a")["locked_until"] > "2020"
+    assert extend_leases(conn, "w1", 60, []) == 0
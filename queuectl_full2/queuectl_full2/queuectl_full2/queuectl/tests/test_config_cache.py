@@ -0,0 +1,25 @@
+
+from queuectl.db import connect
+from queuectl.config import set_config, snapshot, get_config
+
+def test_cache_reloads_only_on_version_change(tmp_path):
+    db = str(tmp_path/"t.db")
+    writer, reader = connect(db), connect(db)
+    cache = snapshot(reader)
+    v0 = cache.version
+    assert cache.get_int("lease_seconds") == 60
+    set_config(writer, "lease_seconds", "5")
+    assert get_config(writer, "config_version") != v0
+    assert not cache.refresh()            # rate-limited: still the old snapshot
+    assert cache.get_int("lease_seconds") == 60
+    cache._checked = 0.0
+    assert cache.refresh()
+    assert cache.get_int("lease_seconds") == 5
+    cache._checked = 0.0
+    assert not cache.refresh()            # version unchanged: no reload
+
+def test_set_config_updates_own_cache(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    snapshot(conn)
+    set_config(conn, "backoff_base", "3")
+    assert snapshot(conn).get_int("backoff_base") == 3
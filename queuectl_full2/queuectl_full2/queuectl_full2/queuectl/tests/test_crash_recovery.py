@@ -0,0 +1,32 @@
+
+import os, subprocess, sys, json, signal
+from queuectl.db import connect
+from queuectl.config import set_config
+from queuectl.repo import enqueue, get_job
+from conftest import run_cli, wait_for
+
+def test_heartbeat_prevents_duplicate_run(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    set_config(conn, "lease_seconds", "1")
+    enqueue(conn, {"id": "long", "command": "sleep 2.5"})
+    workers = [subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)]) for _ in range(2)]
+    assert wait_for(lambda: get_job(conn, "long")["state"] == "completed", timeout=8)
+    for p in workers:
+        p.send_signal(signal.SIGTERM); p.wait(timeout=5)
+    runs = conn.execute("SELECT COUNT(*) AS c FROM job_logs WHERE job_id='long'").fetchone()["c"]
+    assert runs == 1
+
+def test_controller_releases_dead_child_leases(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    enqueue(conn, {"id": "stuck", "command": "sleep 30"})
+    r = run_cli(["worker-start", "--count", "1", "--db", str(db)], cwd=tmp_path)
+    assert r.returncode == 0, r.stderr
+    try:
+        assert wait_for(lambda: get_job(conn, "stuck")["state"] == "processing")
+        child = json.loads((tmp_path/".queuectl"/"children.json").read_text())[0]
+        os.kill(child, signal.SIGKILL)
+        assert wait_for(lambda: get_job(conn, "stuck")["state"] == "pending", timeout=3)
+    finally:
+        run_cli(["worker-stop"], cwd=tmp_path)
@@ -0,0 +1,78 @@
+
+import json, subprocess, sys, signal, time
+import pytest
+from queuectl.db import connect
+from queuectl.repo import enqueue, enqueue_dag, acquire_batch, complete_job, fail_job, get_job, dlq_retry
+
+def _ids(jobs):
+    return sorted(j["id"] for j in jobs)
+
+def test_dependents_become_ready_incrementally(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_dag(conn, [{"id": "a", "command": "true"}, {"id": "b", "command": "true"},
+                       {"id": "c", "command": "true", "depends_on": ["a", "b"]}])
+    assert _ids(acquire_batch(conn, "w", 10)) == ["a", "b"]
+    complete_job(conn, "a")
+    assert get_job(conn, "c")["pending_deps"] == 1
+    assert acquire_batch(conn, "w", 10) == []
+    complete_job(conn, "b")
+    complete_job(conn, "b")
+    assert _ids(acquire_batch(conn, "w", 10)) == ["c"]
+    enqueue(conn, {"id": "d", "command": "true", "depends_on": ["c", "a"]})
+    assert get_job(conn, "d")["pending_deps"] == 1
+
+def test_failure_propagates_and_retry_revives(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_dag(conn, [{"id": "a", "command": "false", "max_retries": 0},
+                       {"id": "b", "command": "true", "depends_on": ["a"]},
+                       {"id": "c", "command": "true", "depends_on": ["b"]}])
+    fail_job(conn, acquire_batch(conn, "w", 1)[0], "boom")
+    assert [get_job(conn, i)["state"] for i in "abc"] == ["dead"] * 3
+    assert get_job(conn, "c")["last_error"] == "dependency a failed"
+    assert dlq_retry(conn, "a")
+    assert [get_job(conn, i)["state"] for i in "abc"] == ["pending"] * 3
+    assert _ids(acquire_batch(conn, "w", 10)) == ["a"]
+
+def test_retry_keeps_dependents_of_other_dead_jobs(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_dag(conn, [{"id": "a", "command": "false", "max_retries": 0},
+                       {"id": "c", "command": "false", "max_retries": 0},
+                       {"id": "x", "command": "true", "depends_on": ["a", "c"]},
+                       {"id": "y", "command": "true", "depends_on": ["x"]}])
+    for job in acquire_batch(conn, "w", 2):
+        fail_job(conn, job, "boom")
+    assert [get_job(conn, i)["state"] for i in "acxy"] == ["dead"] * 4
+    error = get_job(conn, "x")["last_error"]
+    assert dlq_retry(conn, "a")
+    assert [get_job(conn, i)["state"] for i in "acxy"] == ["pending", "dead", "dead", "dead"]
+    assert get_job(conn, "x")["last_error"] == error
+    assert dlq_retry(conn, "c")
+    assert [get_job(conn, i)["state"] for i in "acxy"] == ["pending"] * 4
+
+def test_rejects_cycles_and_unknown_deps(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    with pytest.raises(ValueError, match="cycle"):
+        enqueue_dag(conn, [{"id": "a", "command": "true", "depends_on": ["b"]},
+                           {"id": "b", "command": "true", "depends_on": ["a"]}])
+    with pytest.raises(ValueError, match="unknown"):
+        enqueue_dag(conn, [{"id": "x", "command": "true", "depends_on": ["nope"]}])
+    assert conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+
+def test_workflow_runs_end_to_end(tmp_path):
+    db = tmp_path/"t.db"
+    out = tmp_path/"order.txt"
+    spec = [{"id": "extract", "command": f"echo extract >> {out}"},
+            {"id": "transform", "command": f"echo transform >> {out}", "depends_on": ["extract"]},
+            {"id": "load", "command": f"echo load >> {out}", "depends_on": ["transform"]}]
+    r = subprocess.run([sys.executable, "-m", "queuectl.cli", "enqueue-dag", "-", "--db", str(db)],
+                       input=json.dumps(spec), capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr
+    conn = connect(str(db))
+    worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db), "--concurrency", "2"])
+    try:
+        deadline = time.time() + 20
+        while time.time() < deadline and get_job(conn, "load")["state"] != "completed":
+            time.sleep(0.1)
+    finally:
+        worker.send_signal(signal.SIGTERM); worker.wait(timeout=5)
+    assert out.read_text().split() == ["extract", "transform", "load"]
@@ -0,0 +1,54 @@
+
+import pytest
+from queuectl.db import connect
+from queuectl.repo import enqueue, enqueue_many, enqueue_dag, acquire_batch, get_job, DuplicateJobError
+
+def _count(conn):
+    return conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+def test_idempotency_key_within_window(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    assert enqueue(conn, {"id": "a", "command": "true", "idempotency_key": "order-7"}) == "a"
+    assert enqueue(conn, {"id": "b", "command": "true", "idempotency_key": "order-7"}) == "a"
+    assert enqueue_many(conn, [{"id": "c", "command": "true", "idempotency_key": "order-7"},
+                               {"id": "d", "command": "true", "idempotency_key": "order-8"},
+                               {"id": "e", "command": "true", "idempotency_key": "order-8"}]) == 1
+    assert _count(conn) == 2
+    conn.execute("UPDATE jobs SET created_at='2000-01-01T00:00:00Z' WHERE id='a'")
+    assert enqueue(conn, {"id": "f", "command": "true", "idempotency_key": "order-7"}) == "f"
+    assert get_job(conn, "a")["idempotency_key"] is None
+
+def test_coalesce_while_pending(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    assert enqueue(conn, {"id": "a", "command": "make report", "coalesce": True}) == "a"
+    assert enqueue(conn, {"id": "b", "command": "make report", "coalesce": True}) == "a"
+    assert enqueue(conn, {"id": "c", "command": "make report", "queue": "other", "coalesce": True}) == "c"
+    assert acquire_batch(conn, "w", 1, ["default"])[0]["id"] == "a"
+    assert enqueue(conn, {"id": "d", "command": "make report", "coalesce": True}) == "d"
+
+def test_duplicate_id_is_a_friendly_error(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue(conn, {"id": "a", "command": "true"})
+    with pytest.raises(DuplicateJobError, match="job a already exists"):
+        enqueue(conn, {"id": "a", "command": "false"})
+
+def test_dedup_probes_use_indexes(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    plans = [" ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, ("k",)))
+             for sql in ("SELECT id, created_at FROM jobs WHERE idempotency_key=?",
+                         "SELECT id FROM jobs WHERE coalesce_key=? AND state='pending' LIMIT 1")]
+    assert "idx_jobs_idempotency" in plans[0] and "idx_jobs_coalesce" in plans[1]
+
+def test_dedup_with_dependencies(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue(conn, {"id": "a", "command": "true"})
+    assert enqueue(conn, {"id": "b", "command": "true", "depends_on": ["a"], "idempotency_key": "k"}) == "b"
+    assert enqueue(conn, {"id": "b2", "command": "true", "depends_on": ["a"], "idempotency_key": "k"}) == "b"
+    with pytest.raises(DuplicateJobError):
+        enqueue(conn, {"id": "b", "command": "false", "depends_on": ["a"]})
+    # A deduplicated workflow job is replaced by the existing one in its dependents' edges.
+    assert enqueue_dag(conn, [{"id": "x", "command": "true", "idempotency_key": "k"},
+                              {"id": "y", "command": "true", "depends_on": ["x"]}]) == ["b", "y"]
+    assert [r[0] for r in conn.execute("SELECT depends_on FROM job_deps WHERE job_id='y'")] == ["b"]
+    assert get_job(conn, "y")["pending_deps"] == 1 and get_job(conn, "x") is None
+    assert _count(conn) == 3
@@ -0,0 +1,47 @@
+
+import random, subprocess, sys, signal, time
+from datetime import timedelta
+from queuectl.db import connect
+from queuectl.repo import enqueue, acquire_next_job, fail_job, get_job, next_due_ms
+from queuectl.scheduler import compute_backoff_seconds
+from queuectl.utils import utc_now, to_iso, to_ms
+from queuectl.config import set_config
+
+def test_backoff_cap_and_jitter():
+    assert compute_backoff_seconds(2, 3) == 8
+    assert compute_backoff_seconds(2, 30, cap=60) == 60
+    rng = random.Random(1)
+    delays = {compute_backoff_seconds(2, 5, cap=60, jitter=0.5, rng=rng) for _ in range(50)}
+    assert len(delays) > 40 and all(16 <= d <= 32 for d in delays)
+
+def test_failed_job_waits_on_timer_index(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    set_config(conn, "backoff_jitter", "0")
+    enqueue(conn, {"id": "a", "command": "false"})
+    job = acquire_next_job(conn, "w")
+    fail_job(conn, job, "boom")
+    due = get_job(conn, "a")["due_ms"]
+    assert abs(due - (to_ms(utc_now()) + 2000)) < 500
+    assert next_due_ms(conn) == due
+    assert acquire_next_job(conn, "w") is None
+    conn.execute("UPDATE jobs SET due_ms=? WHERE id='a'", (to_ms(utc_now()) - 1,))
+    assert acquire_next_job(conn, "w")["id"] == "a"
+    assert get_job(conn, "a")["due_ms"] is None and next_due_ms(conn) is None
+
+def test_idle_worker_wakes_when_job_is_due(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    set_config(conn, "poll_interval_ms", "60000")
+    worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)])
+    try:
+        time.sleep(1.0)
+        due = utc_now().replace(microsecond=0) + timedelta(seconds=2)
+        enqueue(conn, {"id": "later", "command": "true", "run_at": to_iso(due)})
+        deadline = time.time() + 10
+        while time.time() < deadline and get_job(conn, "later")["state"] != "completed":
+            time.sleep(0.05)
+        finished = utc_now()
+    finally:
+        worker.send_signal(signal.SIGTERM); worker.wait(timeout=5)
+    assert get_job(conn, "later")["state"] == "completed"
+    assert due <= finished < due + timedelta(seconds=2)
@@ -0,0 +1,40 @@
+
+import sqlite3
+from queuectl.db import connect
+from queuectl import maintenance
+from queuectl.repo import enqueue_many, acquire_batch, record_results, status, dlq_retry, get_job
+from queuectl.maintenance import run_maintenance, archive_dir
+
+def test_gc_archives_old_finished_jobs(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_many(conn, ({"id": f"j{i}", "command": "true"} for i in range(30)))
+    jobs = acquire_batch(conn, "w", 20)
+    record_results(conn, [(j, 0, f"out {j['id']}", "") for j in jobs])
+    conn.execute("UPDATE jobs SET updated_at='2020-03-0' || (1 + rowid % 2) || 'T00:00:00Z' WHERE state='completed'")
+    r = run_maintenance(conn, ttl_days=1)
+    assert r["removed"] == 20
+    assert status(conn)["states"] == {"pending": 10, "processing": 0, "completed": 0, "failed": 0, "dead": 0}
+    assert conn.execute("SELECT COUNT(*) FROM job_logs").fetchone()[0] == 0
+    files = sorted(p.name for p in archive_dir(conn.path).iterdir() if p.suffix == ".db")
+    assert files == ["jobs-2020-03-01.db", "jobs-2020-03-02.db"]
+    total = 0
+    for f in files:
+        a = sqlite3.connect(str(archive_dir(conn.path)/f))
+        total += a.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        assert a.execute("SELECT stdout FROM job_logs LIMIT 1").fetchone()[0].startswith("out j")
+    assert total == 20
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+def test_gc_keeps_jobs_revived_mid_chunk(tmp_path, monkeypatch):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_many(conn, ({"id": f"d{i}", "command": "false", "max_retries": 0} for i in range(4)))
+    record_results(conn, [(j, 1, "", "boom") for j in acquire_batch(conn, "w", 4)])
+    conn.execute("UPDATE jobs SET updated_at='2020-03-01T00:00:00Z'")
+    write = maintenance._write_archive
+    def retry_during_copy(*args):
+        write(*args)
+        assert dlq_retry(conn, "d2")
+    monkeypatch.setattr(maintenance, "_write_archive", retry_during_copy)
+    r = run_maintenance(conn, ttl_days=1, include_dead=True)
+    assert r["removed"] == 3
+    assert get_job(conn, "d2")["state"] == "pending"
@@ -0,0 +1,58 @@
+
+import os, subprocess, sys, signal, time
+from queuectl.exec import run_command
+from queuectl.db import connect
+from queuectl.repo import enqueue, get_job
+
+def _alive(pid):
+    time.sleep(0.2)
+    try:
+        os.kill(pid, 0)
+        return open(f"/proc/{pid}/stat").read().split()[2] != "Z"
+    except (ProcessLookupError, FileNotFoundError):
+        return False
+
+def test_timeout_kills_process_group(tmp_path):
+    marker = tmp_path/"child.pid"
+    code, out, err = run_command(f"sleep 30 & echo $! > {marker}; wait", 1)
+    assert code == 124 and err.endswith(b"TIMEOUT")
+    assert not _alive(int(marker.read_text()))
+
+def test_timeout_kills_children_left_holding_pipes(tmp_path):
+    # The shell exits at once; the background sleep keeps stdout open.
+    marker = tmp_path/"child.pid"
+    code, out, err = run_command(f"sleep 30 & echo $! > {marker}", 1)
+    assert code == 124 and err.endswith(b"TIMEOUT")
+    assert not _alive(int(marker.read_text()))
+
+def test_argv_mode_skips_shell():
+    code, out, err = run_command("", 5, argv=[sys.executable, "-c", "import sys; print(sys.argv[1])", "$HOME"])
+    assert code == 0 and out.strip() == b"$HOME"
+
+def test_memory_limit_applied():
+    code, out, err = run_command(f"{sys.executable} -c \"b = bytearray(512 * 1024 * 1024)\"", 10, memory_mb=256)
+    assert code != 0 and b"MemoryError" in err
+
+def test_per_job_limits_reach_worker(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    enqueue(conn, {"id": "slow", "command": "sleep 30", "timeout": 1, "max_retries": 0})
+    enqueue(conn, {"id": "argv", "argv": ["echo", "a;b"]})
+    assert get_job(conn, "argv")["command"] == "echo 'a;b'"
+    worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)])
+    try:
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            if get_job(conn, "slow")["state"] == "dead" and get_job(conn, "argv")["state"] == "completed":
+                break
+            time.sleep(0.2)
+    finally:
+        worker.send_signal(signal.SIGTERM); worker.wait(timeout=5)
+    assert get_job(conn, "slow")["state"] == "dead"
+    assert get_job(conn, "argv")["state"] == "completed"
+
+def test_cpu_limit_applied_to_argv():
+    code, out, err = run_command("", 10, argv=[sys.executable, "-c", "while True: pass"], cpu_seconds=1)
+    assert code not in (0, 124)
+    code, out, err = run_command("", 5, argv=["sh", "-c", "ulimit -t; ulimit -v"], cpu_seconds=3, memory_mb=64)
+    assert code == 0 and out.split() == [b"3", b"65536"]
@@ -0,0 +1,39 @@
+
+import os
+from queuectl.db import connect
+from queuectl.config import set_config
+from queuectl.repo import enqueue, acquire_batch, record_results, get_logs
+from queuectl import logstore
+
+def test_output_lives_in_segments(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue(conn, {"id": "a", "command": "true"})
+    job = acquire_batch(conn, "w", 1)[0]
+    record_results(conn, [(job, 0, "hello " * 1000, "warn")])
+    row = conn.execute("SELECT * FROM job_logs WHERE job_id='a'").fetchone()
+    assert row["stdout"] is None and row["segment"]
+    assert row["stdout_len"] < 200
+    logs = get_logs(conn, "a")
+    assert logs[0]["stdout"] == "hello " * 1000 and logs[0]["stderr"] == "warn"
+
+def test_rotation_and_retention(tmp_path):
+    db = str(tmp_path/"t.db")
+    w = logstore.SegmentWriter(db, segment_bytes=1, retention_days=7)
+    first, _ = w.append(b"one")
+    second, [(off, n)] = w.append(b"two")
+    w.close()
+    assert first != second
+    assert logstore.read(db, second, off, n) == b"two"
+    old = logstore.log_dir(db) / first
+    os.utime(old, (0, 0))
+    assert logstore.prune(db, 7) == 1
+    assert logstore.read(db, first, 0, 10) is None
+
+def test_db_log_store_still_supported(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    set_config(conn, "log_store", "db")
+    enqueue(conn, {"id": "a", "command": "true"})
+    job = acquire_batch(conn, "w", 1)[0]
+    record_results(conn, [(job, 1, "out", "err")])
+    assert conn.execute("SELECT stdout FROM job_logs").fetchone()["stdout"] == "out"
+    assert get_logs(conn, "a")[0]["stderr"] == "err"
@@ -0,0 +1,61 @@
+
+import os, signal, subprocess, sys, time
+from queuectl import metrics
+from queuectl.db import connect
+from queuectl.repo import enqueue, acquire_batch, record_results, get_job
+
+def test_histogram_quantiles_and_exposition():
+    reg = metrics.Registry()
+    for _ in range(90):
+        reg.observe("lat_seconds", 0.0004, op="claim")
+    for _ in range(10):
+        reg.observe("lat_seconds", 2.0, op="claim")
+    reg.inc("jobs_total", 3)
+    snap = reg.snapshot()
+    h = snap["histograms"]['lat_seconds{op="claim"}']
+    assert h["count"] == 100
+    assert 0.00025 < metrics.quantile(h, 0.5) <= 0.0005
+    assert 1.0 < metrics.quantile(h, 0.99) <= 2.5
+    text = metrics.render(snap)
+    assert 'lat_seconds_bucket{op="claim",le="0.0005"} 90' in text
+    assert 'lat_seconds_bucket{op="claim",le="+Inf"} 100' in text
+    assert "jobs_total 3" in text
+
+def test_hot_paths_are_recorded(tmp_path):
+    metrics.REGISTRY.clear()
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue(conn, {"id": "a", "command": "true"})
+    enqueue(conn, {"id": "b", "command": "false", "max_retries": 0})
+    jobs = acquire_batch(conn, "w", 2)
+    record_results(conn, [(j, 0 if j["id"] == "a" else 1, b"", b"") for j in jobs])
+    snap = metrics.REGISTRY.snapshot()
+    assert snap["counters"]["queuectl_jobs_claimed_total"] == 2
+    assert snap["counters"]['queuectl_jobs_finished_total{outcome="completed"}'] == 1
+    assert snap["counters"]['queuectl_jobs_finished_total{outcome="dead"}'] == 1
+    for series in ('queuectl_txn_seconds{op="claim"}', 'queuectl_lock_wait_seconds{op="results"}',
+                   "queuectl_queue_wait_seconds"):
+        assert snap["histograms"][series]["count"] >= 1
+
+def test_worker_dumps_are_merged(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    for i in range(4):
+        enqueue(conn, {"id": f"j{i}", "command": "true"})
+    workers = [subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)]) for _ in range(2)]
+    try:
+        deadline = time.time() + 20
+        snap = {}
+        while time.time() < deadline:
+            snap = metrics.collect(str(db))
+            done = all(get_job(conn, f"j{i}")["state"] == "completed" for i in range(4))
+            if done and snap["counters"].get('queuectl_jobs_finished_total{outcome="completed"}') == 4:
+                break
+            time.sleep(0.5)
+    finally:
+        for w in workers:
+            w.send_signal(signal.SIGTERM)
+        for w in workers:
+            w.wait(timeout=10)
+    assert snap["counters"]['queuectl_jobs_finished_total{outcome="completed"}'] == 4
+    assert snap["histograms"]['queuectl_exec_seconds{kind="shell"}']["count"] == 4
+    assert os.listdir(metrics.metrics_dir(str(db))) == []
@@ -17,3 +17,14 @@ def test_multiworkers(tmp_path):
     r = run_cli(["status","--db",str(db), "--json"])
     data = json.loads(r.stdout.strip())
     assert data["states"]["completed"] >= 6
+
+def test_concurrency_in_one_process(tmp_path):
+    db = tmp_path/"t.db"
+    for i in range(6):
+        run_cli(["enqueue","--command","sleep 1","--db",str(db)])
+    p = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--concurrency", "6", "--db", str(db)])
+    time.sleep(2)
+    r = run_cli(["status","--db",str(db), "--json"])
+    p.send_signal(signal.SIGTERM); p.wait(timeout=5)
+    data = json.loads(r.stdout.strip())
+    assert data["states"]["completed"] == 6
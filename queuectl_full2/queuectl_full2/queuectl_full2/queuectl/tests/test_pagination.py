@@ -0,0 +1,56 @@
+
+import csv, io, json, subprocess, sys
+from queuectl import repo
+from queuectl.db import connect
+from queuectl.repo import enqueue_many, list_jobs, iter_jobs, job_cursor, dlq_list, dlq_retry_many, status
+
+def _seed(conn):
+    enqueue_many(conn, ({"id": f"j{i:02d}", "command": f"cmd {i % 2}",
+                         "created_at": f"2024-01-01T00:00:{i // 3:02d}Z",
+                         "updated_at": f"2024-01-02T00:00:{i:02d}Z",
+                         "state": "dead" if i % 5 == 0 else "pending",
+                         "last_error": "disk full" if i % 10 == 0 else "oops"} for i in range(25)))
+
+def test_keyset_pages_cover_everything_once(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    _seed(conn)
+    seen, after = [], None
+    while True:
+        page = list_jobs(conn, None, 4, after=after)
+        if not page:
+            break
+        seen += [r["id"] for r in page]
+        after = job_cursor(page[-1])
+    assert seen == [f"j{i:02d}" for i in range(25)]
+    assert [r["id"] for r in iter_jobs(conn, page_size=7)] == seen
+    assert len(list_jobs(conn, "pending", 100, command_like="cmd 1")) == 10
+
+def test_dlq_filters_and_bulk_retry(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    _seed(conn)
+    assert [r["id"] for r in dlq_list(conn)] == ["j20", "j15", "j10", "j05", "j00"]
+    assert [r["id"] for r in dlq_list(conn, error_like="disk%")] == ["j20", "j10", "j00"]
+    assert dlq_retry_many(conn, batch_size=2, error_like="disk%") == 3
+    assert status(conn)["states"]["dead"] == 2
+
+def test_bulk_retry_skips_jobs_that_die_again_mid_call(tmp_path, monkeypatch):
+    conn = connect(str(tmp_path/"t.db"))
+    _seed(conn)
+    kills = []
+    def rekill(path):
+        if not kills:   # the first batch's jobs fail straight away after their retry
+            kills.append(conn.execute("UPDATE jobs SET state='dead', updated_at='2099-01-01T00:00:00Z' "
+                                      "WHERE state='pending' AND id IN ('j20', 'j15')").rowcount)
+    monkeypatch.setattr(repo, "wake", rekill)
+    assert dlq_retry_many(conn, batch_size=2) == 5
+    assert kills == [2]
+    assert {r["id"] for r in dlq_list(conn)} == {"j20", "j15"}
+
+def test_streaming_export(tmp_path):
+    db = tmp_path/"t.db"
+    _seed(connect(str(db)))
+    cli = [sys.executable, "-m", "queuectl.cli"]
+    r = subprocess.run(cli + ["list", "--format", "jsonl", "--db", str(db)], capture_output=True, text=True)
+    assert len([json.loads(l) for l in r.stdout.splitlines()]) == 25
+    r = subprocess.run(cli + ["dlq-list-cmd", "--format", "csv", "--db", str(db)], capture_output=True, text=True)
+    assert [row["id"] for row in csv.DictReader(io.StringIO(r.stdout))] == ["j20", "j15", "j10", "j05", "j00"]
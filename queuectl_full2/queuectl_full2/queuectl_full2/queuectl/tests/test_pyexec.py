@@ -0,0 +1,34 @@
+
+import subprocess, sys, signal, time, json
+from queuectl.pyexec import PythonPool
+from queuectl.db import connect
+from queuectl.repo import enqueue, get_job, get_logs
+
+def test_pool_runs_callable_and_captures_output():
+    pool = PythonPool(1, preload=["json"], max_tasks=2)
+    try:
+        code, out, err = pool.run("builtins:print", ["hello"], {"end": "!\n"}, 5)
+        assert code == 0 and out == b"hello!\n"
+        code, out, err = pool.run("math:pow", [2, 10], {}, 5)
+        assert code == 0 and json.loads(out) == 1024.0
+        code, out, err = pool.run("math:sqrt", [-1], {}, 5)
+        assert code == 1 and b"ValueError" in err
+        code, out, err = pool.run("time:sleep", [10], {}, 1)
+        assert code == 124 and err.endswith(b"TIMEOUT")
+    finally:
+        pool.close()
+
+def test_python_job_through_worker(tmp_path):
+    db = tmp_path/"t.db"
+    conn = connect(str(db))
+    enqueue(conn, {"id": "py", "kind": "python", "callable": "os.path:join", "args": ["a", "b"]})
+    assert get_job(conn, "py")["command"] == "os.path:join"
+    worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)])
+    try:
+        deadline = time.time() + 20
+        while time.time() < deadline and get_job(conn, "py")["state"] != "completed":
+            time.sleep(0.2)
+    finally:
+        worker.send_signal(signal.SIGTERM); worker.wait(timeout=10)
+    assert get_job(conn, "py")["state"] == "completed"
+    assert json.loads(get_logs(conn, "py", 1)[0]["stdout"]) == "a/b"
@@ -0,0 +1,29 @@
+
+from collections import Counter
+from queuectl.db import connect
+from queuectl.repo import enqueue_many, acquire_batch, set_queue, queue_stats
+from queuectl.scheduler import plan_claims
+
+def test_plan_claims_follows_weights_and_caps():
+    qs = {"a": {"weight": 2.0, "pass": 0.0, "room": None},
+          "b": {"weight": 1.0, "pass": 0.0, "room": None},
+          "c": {"weight": 1.0, "pass": 0.0, "room": 1}}
+    assert plan_claims(qs, 9) == {"a": 5, "b": 3, "c": 1}
+
+def test_bulk_tenant_does_not_starve_others(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_many(conn, ({"id": f"big{i}", "command": "true", "queue": "bulk"} for i in range(500)))
+    enqueue_many(conn, ({"id": f"small{i}", "command": "true", "queue": "tenant"} for i in range(5)))
+    first = acquire_batch(conn, "w1", 10)
+    assert Counter(j["queue"] for j in first) == {"bulk": 5, "tenant": 5}
+    assert Counter(j["queue"] for j in acquire_batch(conn, "w2", 4)) == {"bulk": 4}
+
+def test_caps_and_subscriptions(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_many(conn, ({"command": "true", "queue": q} for q in ("a", "b") for _ in range(5)))
+    set_queue(conn, "a", max_concurrency=2)
+    assert Counter(j["queue"] for j in acquire_batch(conn, "w1", 10)) == {"a": 2, "b": 5}
+    assert acquire_batch(conn, "w1", 10) == []
+    assert acquire_batch(conn, "w2", 10, ["b"]) == []
+    stats = {r["name"]: r for r in queue_stats(conn)}
+    assert stats["a"]["processing"] == 2 and stats["a"]["runnable"] == 3
@@ -0,0 +1,48 @@
+
+from collections import Counter
+from queuectl.db import connect
+from queuectl import repo
+from queuectl.repo import enqueue_many, acquire_batch, complete_job, set_rate_limit, rate_limits
+
+def _load(conn):
+    enqueue_many(conn, ({"id": f"api{i:04d}", "command": "true", "concurrency_key": "api", "priority": 1}
+                        for i in range(1000)))
+    enqueue_many(conn, ({"id": f"plain{i}", "command": "true"} for i in range(5)))
+
+def test_concurrency_cap_skips_saturated_key(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    _load(conn)
+    set_rate_limit(conn, "api", max_concurrency=2)
+    first = acquire_batch(conn, "w1", 4)
+    assert [j["id"] for j in first] == ["api0000", "api0001", "plain0", "plain1"]
+    assert Counter(j["concurrency_key"] for j in acquire_batch(conn, "w2", 10)) == {None: 3}
+    complete_job(conn, "api0000")
+    assert [j["id"] for j in acquire_batch(conn, "w3", 10)] == ["api0002"]
+    assert rate_limits(conn)[0]["processing"] == 2
+
+def test_token_bucket_limits_starts(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    _load(conn)
+    set_rate_limit(conn, "api", rate=0.001, burst=3)
+    assert Counter(j["concurrency_key"] for j in acquire_batch(conn, "w", 10)) == {"api": 3, None: 5}
+    assert acquire_batch(conn, "w", 10) == []
+    conn.execute("UPDATE rate_limits SET refilled_ms = refilled_ms - 2000000")
+    assert Counter(j["concurrency_key"] for j in acquire_batch(conn, "w", 10)) == {"api": 2}
+    set_rate_limit(conn, "api", clear=True)
+    assert len(acquire_batch(conn, "w", 10)) == 10
+
+def test_unlimited_keys_claim_like_unkeyed_jobs(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_many(conn, ({"id": f"k{i:04d}", "command": "true", "concurrency_key": f"key{i}", "priority": i % 3}
+                        for i in range(2000)))
+    enqueue_many(conn, ({"id": f"plain{i}", "command": "true", "priority": 1} for i in range(5)))
+    # No key has a limit, so the claim never enumerates keys.
+    assert conn.execute(repo._READY_KEYS, ("default",)).fetchall() == []
+    assert [j["id"] for j in acquire_batch(conn, "w", 3)] == ["k0002", "k0005", "k0008"]
+    set_rate_limit(conn, "key11", max_concurrency=0)
+    assert [r[0] for r in conn.execute(repo._READY_KEYS, ("default",))] == ["key11"]
+    assert "k0011" not in [j["id"] for j in acquire_batch(conn, "w", 3)]
+    set_rate_limit(conn, "key11", max_concurrency=1)
+    assert rate_limits(conn)[0]["ready"] == 1
+    set_rate_limit(conn, "key11", clear=True)
+    assert conn.execute(repo._READY_KEYS, ("default",)).fetchall() == []
@@ -0,0 +1,79 @@
+import signal, subprocess, sys
+from pathlib import Path
+from queuectl.config import get_config
+from queuectl.db import connect
+from queuectl.repo import job_cursor
+from queuectl.shards import ShardSet, shard_path
+from conftest import wait_for
+
+def sharded(tmp_path, n, **settings):
+    db = str(tmp_path/"q.db")
+    ShardSet(db).set_config("shards", str(n))
+    s = ShardSet(db)
+    for k, v in settings.items():
+        s.set_config(k, v)
+    return db, s
+
+def test_routes_and_merges(tmp_path):
+    db, s = sharded(tmp_path, 4)
+    for i in range(40):
+        s.enqueue({"id": f"j{i:02d}", "command": "true"})
+    for i in range(6):
+        s.enqueue({"id": f"k{i}", "command": "true", "concurrency_key": "api"})
+    assert [Path(shard_path(s.path, k)).exists() for k in range(4)] == [True] * 4
+    assert all(connect(shard_path(s.path, k)).execute("SELECT COUNT(*) FROM jobs").fetchone()[0] for k in range(4))
+    assert len({s.locate(f"k{i}") for i in range(6)}) == 1
+    assert s.status()["total"] == 46
+    seen, after = [], None
+    while True:
+        page = s.list_jobs(limit=10, after=after)
+        seen += [r["id"] for r in page]
+        if len(page) < 10:
+            break
+        after = job_cursor(page[-1])
+    assert len(seen) == 46 and len(set(seen)) == 46
+    assert sorted(s.iter_jobs(), key=lambda r: (r["created_at"], r["id"])) == [*s.iter_jobs()]
+
+def test_new_shards_inherit_settings(tmp_path):
+    db, s = sharded(tmp_path, 2, lease_seconds="7")
+    s.set_queue("bulk", weight=3)
+    s.set_config("shards", "3")
+    s = ShardSet(db)
+    assert len(s.conns) == 3
+    assert get_config(s.conns[2], "lease_seconds") == "7"
+    assert {r["name"]: r["weight"] for r in s.queue_stats()}["bulk"] == 3
+    # Lowering the count keeps reading the extra files.
+    s.set_config("shards", "1")
+    assert len(ShardSet(db).conns) == 3
+
+def test_dlq_fans_out(tmp_path):
+    db, s = sharded(tmp_path, 3)
+    for i in range(9):
+        s.enqueue({"id": f"d{i}", "command": "false", "max_retries": 0})
+    jobs = s.acquire_batch("w", 9)
+    assert len(jobs) == 9
+    s.record_results([(j, 1, b"", b"boom") for j in jobs])
+    dead = s.dlq_list(limit=100)
+    assert len(dead) == 9
+    assert [(r["updated_at"], r["id"]) for r in dead] == sorted(((r["updated_at"], r["id"]) for r in dead), reverse=True)
+    assert s.dlq_retry("d4") and s.get_job("d4")["state"] == "pending"
+    assert s.dlq_retry_many() == 8
+
+def test_worker_claims_every_shard_or_its_own(tmp_path):
+    db, s = sharded(tmp_path, 3)
+    for i in range(12):
+        s.enqueue({"id": f"w{i}", "command": "true"})
+    mine = sum(1 for i in range(12) if s.locate(f"w{i}") == 1)
+    assert 0 < mine < 12
+    pinned = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", db, "--shards", "1"])
+    try:
+        assert wait_for(lambda: s.status()["states"]["completed"] == mine, timeout=20)
+        assert all(s.get_job(f"w{i}")["state"] == ("completed" if s.locate(f"w{i}") == 1 else "pending")
+                   for i in range(12))
+    finally:
+        pinned.send_signal(signal.SIGTERM); pinned.wait(timeout=10)
+    worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", db, "--concurrency", "2"])
+    try:
+        assert wait_for(lambda: s.status()["states"]["completed"] == 12, timeout=20)
+    finally:
+        worker.send_signal(signal.SIGTERM); worker.wait(timeout=10)
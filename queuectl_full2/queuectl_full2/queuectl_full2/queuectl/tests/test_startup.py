@@ -0,0 +1,40 @@
+
+import json, sqlite3, subprocess, sys
+from queuectl import db as qdb
+from queuectl.db import connect
+from queuectl.repo import enqueue, status
+
+def _cli(*args):
+    return subprocess.run([sys.executable, "-m", "queuectl.cli", *args], capture_output=True, text=True)
+
+def test_migrates_once_then_skips(tmp_path):
+    path = str(tmp_path/"t.db")
+    conn = connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == qdb.SCHEMA_VERSION
+    enqueue(conn, {"id": "a", "command": "true"})
+    # A writer holding the lock must not block a new reader's connect().
+    conn.execute("BEGIN IMMEDIATE")
+    other = connect(path)
+    assert status(other)["states"]["pending"] == 1
+    conn.execute("ROLLBACK")
+
+def test_stale_schema_is_migrated(tmp_path):
+    path = str(tmp_path/"t.db")
+    connect(path).execute("PRAGMA user_version=0")
+    raw = sqlite3.connect(path, isolation_level=None)
+    raw.execute("DELETE FROM config WHERE key='dedup_window_seconds'")
+    raw.close()
+    assert connect(path).execute("SELECT value FROM config WHERE key='dedup_window_seconds'").fetchone()[0] == "86400"
+
+def test_json_fast_path_and_tables(tmp_path):
+    db = str(tmp_path/"t.db")
+    enqueue(connect(db), {"id": "a", "command": "true"})
+    r = _cli("status", "--json", "--db", db)
+    assert r.returncode == 0 and json.loads(r.stdout)["states"]["pending"] == 1
+    r = _cli("status", "--db", db)
+    assert r.returncode == 0 and "Pending" in r.stdout
+    r = _cli("list", "--json", "--db", db)
+    assert [j["id"] for j in json.loads(r.stdout)] == ["a"]
+    probe = ("import sys, queuectl.cli; "
+             "print(sorted(m for m in ('rich', 'queuectl.worker', 'queuectl.maintenance') if m in sys.modules))")
+    assert subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True).stdout.strip() == "[]"
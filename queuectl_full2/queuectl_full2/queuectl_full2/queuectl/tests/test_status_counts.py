@@ -0,0 +1,16 @@
+
+from queuectl.db import connect
+from queuectl.repo import enqueue_many, acquire_batch, record_results, status, reconcile_status
+
+def test_counters_follow_transitions(tmp_path):
+    conn = connect(str(tmp_path/"t.db"))
+    enqueue_many(conn, ({"id": f"j{i}", "command": "true", "max_retries": 0} for i in range(6)))
+    jobs = acquire_batch(conn, "w", 3)
+    record_results(conn, [(jobs[0], 0, "", ""), (jobs[1], 1, "", "x")])
+    enqueue_many(conn, [{"id": "j5", "command": "again"}], on_conflict="replace")
+    conn.execute("DELETE FROM jobs WHERE id='j4'")
+    st = status(conn)
+    assert st["states"] == {"pending": 2, "processing": 1, "completed": 1, "failed": 0, "dead": 1}
+    assert st["total"] == 5 and st["active_workers"] == 1
+    conn.execute("UPDATE job_counts SET n = 99")
+    assert reconcile_status(conn)["states"] == st["states"]
@@ -0,0 +1,56 @@
+
+import subprocess, sys, signal, threading, time
+from queuectl.exec import HeadTail, run_command
+from queuectl.logstore import follow_marker
+from queuectl.db import connect
+from queuectl.repo import enqueue
+
+def test_head_tail_bounds_output():
+    buf = HeadTail(4, 4)
+    for chunk in (b"abc", b"defgh", b"ijkl"):
+        buf.write(chunk)
+    assert buf.getvalue() == b"abcd\n... [4 bytes omitted] ...\nijkl"
+
+def test_large_output_is_bounded():
+    code, out, err = run_command("yes x | head -c 20000000", 30, head_bytes=1000, tail_bytes=1000)
+    assert code == 0
+    assert len(out) < 2100 and b"bytes omitted" in out
+
+def _spooled(live, follow):
+    if follow:
+        follow_marker(live).parent.mkdir(parents=True)
+        follow_marker(live).touch()
+    seen = []
+    t = threading.Thread(target=run_command, args=("echo one; sleep 0.6; echo two; sleep 0.6", 10),
+                         kwargs={"live_path": live})
+    t.start()
+    while t.is_alive():
+        if live.exists():
+            seen.append(live.read_bytes())
+        time.sleep(0.05)
+    t.join()
+    assert not live.exists() and not follow_marker(live).exists()
+    return seen
+
+def test_live_spool_only_when_followed(tmp_path):
+    assert _spooled(tmp_path/"live"/"a.live", follow=False) == []
+    seen = _spooled(tmp_path/"live"/"b.live", follow=True)
+    assert seen[-1] == b"one\ntwo\n"
+
+def test_follow_streams_running_job(tmp_path):
+    db = tmp_path/"t.db"
+    enqueue(connect(str(db)), {"id": "tick", "command": "for i in 1 2 3; do echo line$i; sleep 0.3; done"})
+    worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)])
+    try:
+        r = subprocess.run([sys.executable, "-m", "queuectl.cli", "logs", "tick", "--follow", "--db", str(db)],
+                           capture_output=True, text=True, timeout=20)
+    finally:
+        worker.send_signal(signal.SIGTERM); worker.wait(timeout=5)
+    assert r.returncode == 0
+    assert r.stdout.split() == ["line1", "line2", "line3"]
+
+def test_timeout_covers_background_children_holding_pipes():
+    t0 = time.monotonic()
+    code, out, err = run_command("sleep 8 & echo hi", 2)
+    assert code == 124 and out == b"hi\n" and err.endswith(b"TIMEOUT")
+    assert time.monotonic() - t0 < 6
@@ -16,6 +16,10 @@ def to_iso(dt: datetime) -> str:
 def parse_iso(s: str) -> datetime:
     return datetime.strptime(s, ISO_FMT).replace(tzinfo=timezone.utc)
 
+def to_ms(dt: datetime) -> int:
+    """Epoch milliseconds."""
+    return int(dt.timestamp() * 1000)
+
 def gen_id() -> str:
     return str(uuid.uuid4())
 
@@ -12,18 +12,30 @@ CREATE_NEW_PROCESS_GROUP = 0x00000200 if os.name == "nt" else 0
 
 
 
-import os, signal, time, json, subprocess, sys
-from typing import Optional
+import os, signal, time, json, subprocess, sys, threading, sqlite3, traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from pathlib import Path
-from .db import connect
-from .repo import acquire_next_job, complete_job, fail_job, log_execution
+from .shards import ShardSet
 from .exec import run_command
-from .config import get_int
+from .pyexec import PythonPool
+from .notify import Listener
+from .logstore import live_path
+from .maintenance import run_maintenance
+from .config import snapshot
+from .scheduler import parse_queues, parse_shards, desired_workers, compute_backoff_seconds
+from . import metrics
 from .utils import utc_now, to_iso
 
 PID_DIR = Path(".queuectl")
 PID_FILE = PID_DIR / "controller.pid"
 CHILDREN_FILE = PID_DIR / "children.json"
+MIN_POLL_MS = 10
+CONTROLLER_TICK_S = 0.5
+RESTART_BASE_S = 1.0
+RESTART_MAX_S = 30.0
+RESTART_RESET_S = 60.0
 
 stop_flag = False
 
@@ -31,55 +43,311 @@ def _signal_handler(signum, frame):
     global stop_flag
     stop_flag = True
 
-def worker_loop(db_path: Optional[str]=None):
+def worker_loop(db_path: Optional[str]=None, concurrency: int=1, queues: Optional[List[str]]=None,
+                shards: Optional[List[int]]=None):
+    """Run jobs until SIGTERM/SIGINT.
+
+    The main thread is the only one touching SQLite: it claims, hands
+    commands to a pool of `concurrency` executor threads and commits their
+    results. It sleeps on one event that is set by finished jobs and by
+    enqueue notifications; with nothing to do it sleeps until the earliest
+    delayed job is due, re-polling with exponential backoff from MIN_POLL_MS
+    up to poll_interval_ms as a safety net. Claims and results go through
+    the broker when one is running (broker.Store). On stop it stops
+    claiming, lets in-flight jobs finish, flushes results and releases any
+    leases it never started. A heartbeat thread keeps extending the leases
+    of the jobs this worker holds (claimed, running or awaiting their
+    result commit), so lease_seconds only bounds how long a
+    crashed worker's jobs stay blocked, not how long a job may run. With
+    `queues` it only claims from those named queues. On a sharded queue it
+    claims round-robin over every shard, or over `shards` only. Metrics are
+    dumped for the controller and `queuectl stats` every
+    metrics.DUMP_INTERVAL_S."""
     global stop_flag
     signal.signal(signal.SIGTERM, _signal_handler)
     signal.signal(signal.SIGINT, _signal_handler)
-    conn = connect(db_path)
+    store = ShardSet(db_path, shards)
+    conn = store.conns[0]
     worker_id = f"pid-{os.getpid()}"
-    poll_ms = get_int(conn, "poll_interval_ms")
-    timeout = get_int(conn, "timeout_seconds")
-    while not stop_flag:
-        job = acquire_next_job(conn, worker_id)
-        if not job:
-            time.sleep(poll_ms/1000.0)
-            continue
-        exit_code, out, err = run_command(job["command"], timeout)
-        log_execution(conn, job["id"], exit_code, out, err)
-        if exit_code == 0:
-            complete_job(conn, job["id"])
-        else:
-            last_error = (err or f"exit {exit_code}")[:512]
-            fail_job(conn, job, last_error=last_error)
+    cfg = snapshot(conn)
+    concurrency = max(1, concurrency)
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job")
+    pypool = PythonPool(concurrency, cfg.get("python_preload").split(","), cfg.get_int("python_max_tasks"))
+    wakeup = threading.Event()
+    listeners = [Listener(store.conns[k].path, wakeup) for k in store.active]
+    prefetched = deque()
+    inflight = {}
+    results = []
+    last_flush = time.monotonic()
+    next_claim = 0.0
+    idle_s = MIN_POLL_MS / 1000.0
+    last_dump = 0.0
+    # Ids of the jobs held, republished by this thread every pass; a slice
+    # assignment, so the heartbeat thread always reads a whole list.
+    held: List[str] = []
+    hb_stop = threading.Event()
+    hb = threading.Thread(target=_heartbeat, args=(db_path, worker_id, hb_stop, held, shards),
+                          name="heartbeat", daemon=True)
+    hb.start()
+    try:
+        while inflight or not stop_flag:
+            wakeup.clear()
+            cfg.refresh()
+            poll_s = cfg.get_int("poll_interval_ms") / 1000.0
+            batch_size = max(1, cfg.get_int("batch_size"))
+            flush_s = cfg.get_int("flush_interval_ms") / 1000.0
+            now = time.monotonic()
+            if [l for l in listeners if l.take()]:
+                next_claim = now
+            if not stop_flag and not prefetched and len(inflight) < concurrency and now >= next_claim:
+                store.record_results(results)
+                results, last_flush = [], now
+                prefetched.extend(store.acquire_batch(worker_id, max(batch_size, concurrency - len(inflight)), queues))
+                if prefetched:
+                    idle_s = MIN_POLL_MS / 1000.0
+                else:
+                    next_claim = now + idle_s
+                    idle_s = min(idle_s * 2, poll_s)
+                    due = store.next_due_ms()
+                    if due is not None:
+                        # Sleep exactly until the earliest delayed job is due.
+                        next_claim = min(next_claim, now + max(0.0, (due + 1) / 1000.0 - time.time()))
+            while prefetched and len(inflight) < concurrency and not stop_flag:
+                job = prefetched.popleft()
+                timeout = job["timeout"] or cfg.get_int("timeout_seconds")
+                head, tail = cfg.get_int("log_head_bytes"), cfg.get_int("log_tail_bytes")
+                if job["kind"] == "python":
+                    payload = json.loads(job["payload"] or "{}")
+                    fut = pool.submit(pypool.run, job["command"], payload.get("args") or [],
+                                      payload.get("kwargs") or {}, timeout, head, tail)
+                else:
+                    fut = pool.submit(run_command, job["command"], timeout, head, tail,
+                                      live_path(store.conns[job["shard"]].path, job["id"]),
+                                      json.loads(job["argv"]) if job["argv"] else None,
+                                      job["cpu_seconds"], job["memory_mb"])
+                fut.add_done_callback(lambda _f: wakeup.set())
+                inflight[fut] = job
+            for fut in [f for f in inflight if f.done()]:
+                results.append(_outcome(fut, inflight.pop(fut)))
+            if results and (len(results) >= batch_size or time.monotonic() - last_flush >= flush_s):
+                store.record_results(results)
+                results, last_flush = [], time.monotonic()
+            if time.monotonic() - last_dump >= metrics.DUMP_INTERVAL_S:
+                metrics.dump(conn.path)
+                last_dump = time.monotonic()
+            held[:] = [j["id"] for j in (*prefetched, *inflight.values(), *(r[0] for r in results))]
+            deadline = time.monotonic() + poll_s
+            if results:
+                deadline = min(deadline, last_flush + flush_s)
+            if not stop_flag and len(inflight) < concurrency:
+                deadline = min(deadline, next_claim)
+            wakeup.wait(max(0.0, deadline - time.monotonic()))
+    finally:
+        for l in listeners:
+            l.close()
+        pool.shutdown(wait=True)
+        pypool.close()
+        for fut, job in inflight.items():
+            results.append(_outcome(fut, job))
+        store.record_results(results)
+        store.release_jobs(worker_id, [j["id"] for j in prefetched])
+        metrics.remove(conn.path)
+        hb_stop.set()
+        hb.join()
+        store.close()
+
+def _outcome(fut, job) -> tuple:
+    """(job, exit_code, stdout, stderr) of a finished job. An executor that
+    raised fails just that job, with the traceback as its stderr, instead
+    of taking the worker loop down."""
+    try:
+        return (job, *fut.result())
+    except Exception as e:
+        # Summary first: last_error keeps only the start of stderr.
+        report = f"executor raised {e!r}\n{traceback.format_exc()}"
+        print(f"job {job['id']}: {report}", file=sys.stderr, flush=True)
+        return (job, 1, b"", report.encode())
 
-def _spawn_child(count: int, db_path: Optional[str]):
-    args = [sys.executable, "-m", "queuectl.worker", "run"]
+def _heartbeat(db_path: Optional[str], worker_id: str, stop: threading.Event, held: List[str],
+               shards: Optional[List[int]]=None):
+    # Own connections: sqlite3 connections must not be shared across threads.
+    store = ShardSet(db_path, shards)
+    cfg = snapshot(store.conns[0])
+    while not stop.wait(max(0.2, cfg.get_int("lease_seconds") / 3.0)):
+        try:
+            cfg.refresh()
+            store.extend_leases(worker_id, cfg.get_int("lease_seconds"), list(held))
+        except sqlite3.OperationalError:
+            pass  # busy past busy_timeout; the next beat retries
+    store.close()
+
+def _popen(args):
+    if os.name == "nt":
+        return subprocess.Popen(
+            args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            creationflags=CREATE_NEW_PROCESS_GROUP,  # <-- important on Windows
+        )
+    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def _spawn_child(count: int, db_path: Optional[str], concurrency: int=1, queues: Optional[str]=None,
+                 shards: Optional[str]=None):
+    args = [sys.executable, "-m", "queuectl.worker", "run", "--concurrency", str(concurrency)]
     if db_path:
         args.extend(["--db", db_path])
-    procs = []
-    for _ in range(count):
+    if queues:
+        args.extend(["--queues", queues])
+    if shards:
+        args.extend(["--shards", shards])
+    return [_popen(args) for _ in range(count)]
+
+def _write_children(pids):
+    tmp = CHILDREN_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(pids))
+    os.replace(tmp, CHILDREN_FILE)
+
+def _terminate(pid: int):
+    try:
         if os.name == "nt":
-            p = subprocess.Popen(
-                args,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                creationflags=CREATE_NEW_PROCESS_GROUP,  # <-- important on Windows
-            )
+            # Try gentle console break first
+            try:
+                os.kill(pid, signal.CTRL_BREAK_EVENT)
+            except Exception:
+                # Fallback to taskkill /T /F to kill the process tree
+                subprocess.run(["taskkill", "/PID", str(pid), "/T", "/F"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         else:
-            p = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        procs.append(p.pid)
-    return procs
+            os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        # As a final fallback on Windows, force kill
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/PID", str(pid), "/T", "/F"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
+def run_controller(count: int, db_path: Optional[str]=None, concurrency: int=1, queues: Optional[str]=None,
+                   max_count: Optional[int]=None, shards: Optional[str]=None):
+    """Resident supervisor of the worker processes.
 
-def start_controller(count: int, db_path: Optional[str]=None):
+    Reaps children as they exit and hands the leases of any child that died
+    with jobs in hand straight back to the queue, instead of leaving them
+    blocked until locked_until passes, then restarts it after an exponential
+    backoff (RESTART_BASE_S doubling up to RESTART_MAX_S, reset once a
+    worker has stayed up RESTART_RESET_S). With max_count > count it
+    autoscales between the two from the backlog (repo.backlog,
+    scheduler.desired_workers), at most once per scale_cooldown_seconds.
+    Scaling down sends SIGTERM to the newest worker, which stops claiming
+    and exits once its current jobs are done. With gc_interval_seconds > 0
+    it also runs retention/compaction on that schedule, on every shard.
+    `shards` ('0,2') is passed to each worker to pin it. It keeps the merged
+    worker metrics in `.queuectl/metrics/<db name>.prom` for scraping."""
+    signal.signal(signal.SIGTERM, _signal_handler)
+    signal.signal(signal.SIGINT, _signal_handler)
+    PID_DIR.mkdir(exist_ok=True)
+    PID_FILE.write_text(str(os.getpid()))
+    store = ShardSet(db_path)
+    conn = store.conns[0]
+    lo, hi = count, max(count, max_count or count)
+    children = _spawn_child(count, db_path, concurrency, queues, shards)
+    draining = []
+    started = {p.pid: time.monotonic() for p in children}
+    respawn_at: List[float] = []
+    crashes = 0
+    _write_children([p.pid for p in children])
+    cfg = snapshot(conn)
+    last_gc = last_prom = last_scale = time.monotonic()
+    try:
+        while not stop_flag:
+            time.sleep(CONTROLLER_TICK_S)
+            cfg.refresh()
+            now = time.monotonic()
+            gc_every = cfg.get_int("gc_interval_seconds")
+            if gc_every > 0 and now - last_gc >= gc_every:
+                for c in store.conns:
+                    run_maintenance(c)
+                last_gc = now
+            if now - last_prom >= metrics.DUMP_INTERVAL_S:
+                metrics.write_prom(conn.path)
+                last_prom = now
+            changed = False
+            # poll() also reaps, so exited children never linger as zombies.
+            for p in [p for p in children if p.poll() is not None]:
+                children.remove(p)
+                store.release_worker_leases(f"pid-{p.pid}")
+                crashes = 1 if now - started.pop(p.pid) >= RESTART_RESET_S else crashes + 1
+                respawn_at.append(now + min(RESTART_MAX_S, RESTART_BASE_S * compute_backoff_seconds(2, crashes - 1)))
+                changed = True
+            for p in [p for p in draining if p.poll() is not None]:
+                draining.remove(p)
+                store.release_worker_leases(f"pid-{p.pid}")
+                changed = True
+            due = [t for t in respawn_at if t <= now]
+            if due:
+                respawn_at = [t for t in respawn_at if t > now]
+                changed |= _grow(children, started, len(due), db_path, concurrency, queues, shards)
+            if hi > lo and now - last_scale >= cfg.get_float("scale_cooldown_seconds"):
+                current = len(children) + len(respawn_at)
+                ready, processing, wait = store.backlog(hi * concurrency)
+                want = desired_workers(current, ready, processing, wait, concurrency, lo, hi,
+                                       cfg.get_float("scale_up_wait_seconds"))
+                if want != current:
+                    last_scale = now
+                    changed = True
+                if want > current:
+                    _grow(children, started, want - current, db_path, concurrency, queues, shards)
+                for _ in range(current - want):
+                    # Cancel a pending restart before draining a live worker.
+                    if respawn_at:
+                        respawn_at.pop()
+                        continue
+                    p = children.pop()
+                    started.pop(p.pid, None)
+                    _terminate(p.pid)
+                    draining.append(p)
+            if changed:
+                _write_children([p.pid for p in children + draining])
+    finally:
+        for p in children + draining:
+            _terminate(p.pid)
+        for p in children + draining:
+            p.wait()
+            store.release_worker_leases(f"pid-{p.pid}")
+        for f in (PID_FILE, CHILDREN_FILE):
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+
+def _grow(children, started, n: int, db_path: Optional[str], concurrency: int, queues: Optional[str],
+          shards: Optional[str]=None) -> bool:
+    for p in _spawn_child(n, db_path, concurrency, queues, shards):
+        children.append(p)
+        started[p.pid] = time.monotonic()
+    return n > 0
+
+def start_controller(count: int, db_path: Optional[str]=None, concurrency: int=1, queues: Optional[str]=None,
+                     max_count: Optional[int]=None, shards: Optional[str]=None):
     PID_DIR.mkdir(exist_ok=True)
     if PID_FILE.exists():
         raise RuntimeError("Workers already running (pid file exists).")
-    with open(PID_FILE, "w") as f:
-        f.write(str(os.getpid()))
-    children = _spawn_child(count, db_path)
-    with open(CHILDREN_FILE, "w") as f:
-        json.dump(children, f)
+    args = [sys.executable, "-m", "queuectl.worker", "controller",
+            "--count", str(count), "--concurrency", str(concurrency)]
+    if db_path:
+        args.extend(["--db", db_path])
+    if queues:
+        args.extend(["--queues", queues])
+    if max_count:
+        args.extend(["--max-count", str(max_count)])
+    if shards:
+        args.extend(["--shards", shards])
+    ctl = _popen(args)
+    PID_FILE.write_text(str(ctl.pid))
+    deadline = time.monotonic() + 10
+    while not CHILDREN_FILE.exists():
+        if ctl.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("Controller failed to start workers.")
+        time.sleep(0.05)
+    children = json.loads(CHILDREN_FILE.read_text())
     print(f"Started {len(children)} workers: {children}")
 
 def stop_controller():
@@ -92,25 +360,16 @@ def stop_controller():
             children = json.loads(CHILDREN_FILE.read_text())
         except Exception:
             children = []
+    try:
+        controller = int(PID_FILE.read_text())
+    except ValueError:
+        controller = None
 
-    # Send termination to each child
+    # Send termination to the controller and each child
+    if controller is not None and controller != os.getpid():
+        _terminate(controller)
     for pid in children:
-        try:
-            if os.name == "nt":
-                # Try gentle console break first
-                try:
-                    os.kill(pid, signal.CTRL_BREAK_EVENT)
-                except Exception:
-                    # Fallback to taskkill /T /F to kill the process tree
-                    subprocess.run(["taskkill", "/PID", str(pid), "/T", "/F"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            else:
-                os.kill(pid, signal.SIGTERM)
-        except ProcessLookupError:
-            pass
-        except PermissionError:
-            # As a final fallback on Windows, force kill
-            if os.name == "nt":
-                subprocess.run(["taskkill", "/PID", str(pid), "/T", "/F"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _terminate(pid)
 
     # Cleanup pid files
     try:
@@ -130,8 +389,20 @@ if __name__ == "__main__":
     sub = ap.add_subparsers(dest="cmd")
     runp = sub.add_parser("run")
     runp.add_argument("--db", default=None)
+    runp.add_argument("--concurrency", type=int, default=1)
+    runp.add_argument("--queues", default=None)
+    runp.add_argument("--shards", default=None)
+    ctlp = sub.add_parser("controller")
+    ctlp.add_argument("--db", default=None)
+    ctlp.add_argument("--count", type=int, default=1)
+    ctlp.add_argument("--concurrency", type=int, default=1)
+    ctlp.add_argument("--queues", default=None)
+    ctlp.add_argument("--max-count", type=int, default=None)
+    ctlp.add_argument("--shards", default=None)
     args = ap.parse_args()
     if args.cmd == "run":
-        worker_loop(args.db)
+        worker_loop(args.db, args.concurrency, parse_queues(args.queues), parse_shards(args.shards))
+    elif args.cmd == "controller":
+        run_controller(args.count, args.db, args.concurrency, args.queues, args.max_count, args.shards)
     else:
         ap.print_help()
@@ -0,0 +1,74 @@
+
+"""Claim latency vs. table size.
+
+Builds a fresh DB per size (90% completed history, 10% runnable), then times
+repeated acquire_next_job calls. With the partial covering index the p50/p99
+columns should stay flat from 10k to 10M rows. With --keys N the runnable
+jobs are spread over N concurrency keys that have no limit set; those
+claim like unkeyed jobs, so the columns should not move with N either.
+
+    python scripts/bench_claim.py [--sizes 10000,100000,1000000,10000000] [--claims 2000] [--keys 0]
+"""
+from __future__ import annotations
+import argparse, statistics, sys, tempfile, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from queuectl.db import connect, write_txn
+from queuectl.repo import acquire_next_job
+from queuectl.utils import utc_now, to_iso
+
+
+def populate(conn, n: int, keys: int = 0) -> None:
+    now = to_iso(utc_now())
+    def rows():
+        for i in range(n):
+            state = "pending" if i % 10 == 0 else "completed"
+            created = f"2024-01-01T00:00:{i % 60:02d}Z"
+            key = f"key-{i // 10 % keys}" if keys and state == "pending" else None
+            yield (f"job-{i:09d}", "true", state, 0, 3, created, now, created, i % 5, key)
+    with write_txn(conn):
+        conn.executemany("""
+            INSERT INTO jobs(id, command, state, attempts, max_retries, created_at, updated_at, run_at, priority,
+                             concurrency_key)
+            VALUES(?,?,?,?,?,?,?,?,?,?)
+        """, rows())
+    conn.execute("ANALYZE;")
+
+
+def bench(size: int, claims: int, workdir: Path, keys: int = 0) -> dict:
+    conn = connect(str(workdir / f"claim-{size}.db"))
+    t0 = time.perf_counter()
+    populate(conn, size, keys)
+    load_s = time.perf_counter() - t0
+    samples = []
+    for _ in range(min(claims, size // 10)):
+        t = time.perf_counter()
+        acquire_next_job(conn, "bench")
+        samples.append((time.perf_counter() - t) * 1e6)
+    samples.sort()
+    conn.close()
+    return {
+        "rows": size,
+        "load_s": round(load_s, 2),
+        "p50_us": round(statistics.median(samples), 1),
+        "p99_us": round(samples[int(len(samples) * 0.99) - 1], 1),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000,10000000")
+    ap.add_argument("--claims", type=int, default=2000)
+    ap.add_argument("--keys", type=int, default=0, help="Distinct unlimited concurrency keys")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as d:
+        print(f"{'rows':>10} {'load_s':>8} {'p50_us':>8} {'p99_us':>8}")
+        for size in (int(s) for s in args.sizes.split(",")):
+            r = bench(size, args.claims, Path(d), args.keys)
+            print(f"{r['rows']:>10} {r['load_s']:>8} {r['p50_us']:>8} {r['p99_us']:>8}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+
+"""Enqueue-to-start latency with and without the wakeup channel.
+
+Starts one idle worker, enqueues jobs at random intervals and compares the
+enqueue timestamp with the time the job's shell printed on start. In
+`poll` mode the producer suppresses notifications, so the worker only
+finds jobs through its backoff polling.
+
+    python scripts/bench_latency.py [--jobs 50] [--mode notify|poll|both]
+"""
+from __future__ import annotations
+import argparse, random, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from queuectl.db import connect
+from queuectl.repo import enqueue, status, get_logs
+
+
+def run(mode: str, jobs: int, workdir: Path) -> dict:
+    db = workdir / f"latency-{mode}.db"
+    conn = connect(str(db))
+    producer = connect(str(db))
+    if mode == "poll":
+        producer.path = ""
+    worker = subprocess.Popen([sys.executable, "-m", "queuectl.worker", "run", "--db", str(db)], cwd=ROOT)
+    time.sleep(1.0)
+    sent = {}
+    try:
+        for i in range(jobs):
+            time.sleep(random.uniform(0.05, 0.6))
+            job_id = f"lat-{i}"
+            sent[job_id] = time.time()
+            enqueue(producer, {"id": job_id, "command": "date +%s.%N"})
+        while status(conn)["states"]["completed"] < jobs:
+            time.sleep(0.1)
+    finally:
+        worker.terminate()
+        worker.wait(timeout=10)
+    lat = sorted(
+        (float(get_logs(conn, job_id, 1)[0]["stdout"]) - t) * 1000
+        for job_id, t in sent.items()
+    )
+    return {
+        "mode": mode,
+        "p50_ms": round(statistics.median(lat), 2),
+        "p99_ms": round(lat[max(0, int(len(lat) * 0.99) - 1)], 2),
+        "max_ms": round(lat[-1], 2),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=50)
+    ap.add_argument("--mode", choices=["notify", "poll", "both"], default="both")
+    args = ap.parse_args()
+    modes = ["notify", "poll"] if args.mode == "both" else [args.mode]
+    with tempfile.TemporaryDirectory() as d:
+        print(f"{'mode':>8} {'p50_ms':>8} {'p99_ms':>8} {'max_ms':>8}")
+        for mode in modes:
+            r = run(mode, args.jobs, Path(d))
+            print(f"{r['mode']:>8} {r['p50_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
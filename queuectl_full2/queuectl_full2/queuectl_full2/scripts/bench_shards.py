@@ -0,0 +1,82 @@
+"""Enqueue and claim throughput against the number of shards.
+
+For each shard count, --procs producer processes enqueue --jobs jobs each,
+one job per transaction, then --procs consumer processes claim and
+complete them one at a time (no command is run), all through ShardSet.
+Every commit holds its shard's write lock, so with one shard the
+processes queue behind a single lock; with more they spread over several.
+Scaling stops at the number of cores and the disk's fsync rate.
+
+    python scripts/bench_shards.py [--shards 1,2,4,8] [--procs 8] [--jobs 500]
+"""
+from __future__ import annotations
+import argparse, multiprocessing, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from queuectl.shards import ShardSet
+
+
+def produce(db: str, p: int, jobs: int, barrier) -> None:
+    s = ShardSet(db)
+    barrier.wait()
+    for i in range(jobs):
+        s.enqueue({"id": f"p{p}-{i}", "command": "true"})
+
+
+def consume(db: str, p: int, jobs: int, barrier) -> None:
+    s = ShardSet(db)
+    worker = f"bench-{p}"
+    barrier.wait()
+    while True:
+        batch = s.acquire_batch(worker, 1)
+        if not batch:
+            return
+        s.record_results([(j, 0, b"", b"") for j in batch])
+
+
+def timed(target, db: str, procs: int, jobs: int) -> float:
+    barrier = multiprocessing.Barrier(procs + 1)
+    ps = [multiprocessing.Process(target=target, args=(db, p, jobs, barrier)) for p in range(procs)]
+    for p in ps:
+        p.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for p in ps:
+        p.join()
+    return time.perf_counter() - t0
+
+
+def run(shards: int, procs: int, jobs: int, workdir: Path) -> dict:
+    db = str(workdir / f"shards-{shards}.db")
+    ShardSet(db).set_config("shards", str(shards))
+    ShardSet(db)  # create and seed the shard files before timing
+    total = procs * jobs
+    enq = timed(produce, db, procs, jobs)
+    claim = timed(consume, db, procs, jobs)
+    done = ShardSet(db).status()["states"]["completed"]
+    return {"shards": shards, "enqueue_per_s": round(total / enq), "claim_ack_per_s": round(total / claim),
+            "completed": done}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--shards", default="1,2,4,8")
+    ap.add_argument("--procs", type=int, default=8)
+    ap.add_argument("--jobs", type=int, default=500, help="Jobs per producer")
+    args = ap.parse_args()
+    print(f"{'shards':>6} {'enqueue/s':>10} {'claim+ack/s':>12} {'completed':>10}  ({args.procs} processes)")
+    base = None
+    with tempfile.TemporaryDirectory() as d:
+        for n in (int(x) for x in args.shards.split(",")):
+            r = run(n, args.procs, args.jobs, Path(d))
+            base = base or r
+            print(f"{r['shards']:>6} {r['enqueue_per_s']:>10} {r['claim_ack_per_s']:>12} {r['completed']:>10}"
+                  f"  (x{r['enqueue_per_s'] / base['enqueue_per_s']:.2f} / x{r['claim_ack_per_s'] / base['claim_ack_per_s']:.2f})",
+                  flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+
+"""Cold-start time per CLI subcommand.
+
+Runs each command as a fresh `python -m queuectl.cli` process against a
+small, already-migrated database and reports wall time, plus the import
+time of queuectl.cli alone (`-X importtime`) as the floor every command
+pays.
+
+    python scripts/bench_startup.py [--runs 15]
+"""
+from __future__ import annotations
+import argparse, re, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from queuectl.db import connect
+from queuectl.repo import enqueue
+
+COMMANDS = [
+    ["version"],
+    ["status", "--json"],
+    ["status"],
+    ["list", "--json"],
+    ["queues", "--json"],
+    ["stats", "--json"],
+    ["config", "get", "max_retries"],
+    ["enqueue", "--command", "true"],
+]
+
+
+def time_command(args, db: Path, runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "queuectl.cli", *args, *(["--db", str(db)] if args[0] != "version" else [])],
+                       cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def import_ms() -> float:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import queuectl.cli"],
+                         cwd=ROOT, capture_output=True, text=True).stderr
+    m = re.search(r"\|\s+(\d+) \| queuectl\.cli$", out, re.M)
+    return int(m.group(1)) / 1000 if m else float("nan")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=15)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as d:
+        db = Path(d) / "startup.db"
+        conn = connect(str(db))
+        for i in range(100):
+            enqueue(conn, {"id": f"s{i}", "command": "true"})
+        conn.close()
+        print(f"import queuectl.cli: {import_ms():.1f} ms")
+        print(f"{'command':<32} {'p50_ms':>8} {'min_ms':>8}")
+        for cmd in COMMANDS:
+            samples = time_command(cmd, db, args.runs)
+            print(f"{' '.join(cmd[:3]):<32} {statistics.median(samples):>8.1f} {min(samples):>8.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()